@@ -6,4 +6,18 @@ __copyright__ = "Copyright (c) 2024, Matthew D Blackledge"
 __gh_repo__ = "https://github.com/REPO_PLACEHOLDER"  # Replaced by GitHub Actions
 __gh_hash__ = "HASH_PLACEHOLDER"  # Replaced by GitHub Actions
 
-from pyosirix_example import server, client, utilities
+import importlib
+
+# Loaded on first access (PEP 562), so reading e.g. `__version__` does not import grpc, osirix,
+# dvc or Pillow.
+_submodules = ("client", "grpc_protocols", "server", "utilities")
+
+
+def __getattr__(name: str):
+    if name in _submodules:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_submodules))
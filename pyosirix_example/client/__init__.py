@@ -1 +1,14 @@
-from pyosirix_example.client import client
+import importlib
+
+# Loaded on first access (see pyosirix_example/__init__.py).
+_submodules = ("balancer", "channel_pool", "client")
+
+
+def __getattr__(name: str):
+    if name in _submodules:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_submodules))
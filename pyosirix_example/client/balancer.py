@@ -0,0 +1,163 @@
+import threading
+import time
+from typing import Dict, List, Sequence
+
+import grpc
+
+from pyosirix_example.client.channel_pool import ChannelPool, channel_pool as default_pool
+from pyosirix_example.grpc_protocols import server_pb2
+
+POLICIES = ("round_robin", "least_loaded")
+
+# Health check failures that mean a server is up but busy, rather than unavailable.
+BUSY_CODES = (grpc.StatusCode.RESOURCE_EXHAUSTED, grpc.StatusCode.DEADLINE_EXCEEDED)
+
+
+class Balancer:
+    """ Spreads requests over several servers, skipping those that are not healthy.
+
+    Each server's health (and load) is checked with its `Health` RPC at most every
+    `check_interval` seconds. The servers are checked concurrently, and in a background thread
+    once the first check is done, so a request never waits for more than one check timeout. A
+    server that fails a check, or a call (see `mark_unhealthy`), is skipped until a later check
+    succeeds. A server that is too busy to answer its check in time (DEADLINE_EXCEEDED or
+    RESOURCE_EXHAUSTED) is kept, but counted as busier than any server that did answer.
+
+    Properties:
+        addresses (Sequence[str]): The server addresses (ip:port).
+        policy (str): One of "round_robin" (take turns) or "least_loaded" (pick the server with
+            the fewest requests in flight, counting both those reported by its last health check
+            and those this balancer has outstanding). Default is "round_robin".
+        channel_pool (ChannelPool): Where the channels to the servers are kept. Default is None, in
+            which case the process-wide pool is used.
+        check_interval (float): The time between health checks (seconds). Default is 5.
+        check_timeout (float): The deadline of each health check (seconds). Default is 1.
+    """
+    def __init__(self, addresses: Sequence[str], policy: str = "round_robin",
+                 channel_pool: ChannelPool = None, check_interval: float = 5.0,
+                 check_timeout: float = 1.0):
+        if len(addresses) == 0:
+            raise ValueError("At least one address is needed.")
+        if policy not in POLICIES:
+            raise ValueError("Policy must be round_robin or least_loaded.")
+        self.addresses = list(addresses)
+        self.policy = policy
+        self.channel_pool = channel_pool if channel_pool is not None else default_pool
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self._healthy = {address: True for address in self.addresses}
+        self._reported = {address: 0 for address in self.addresses}  # Load at the last check.
+        self._outstanding = {address: 0 for address in self.addresses}  # Calls from this client.
+        self._next = 0
+        self._last_check = None
+        self._checking = False  # Whether a background check is running.
+        self._lock = threading.Lock()
+
+    @property
+    def healthy(self) -> List[str]:
+        """ The addresses currently considered healthy.
+        """
+        with self._lock:
+            return [address for address in self.addresses if self._healthy[address]]
+
+    def check(self) -> Dict[str, bool]:
+        """ Check the health (and load) of every server now.
+
+        Returns:
+            Dict[str, bool]: Whether each server is healthy.
+        """
+        calls = {address: self.channel_pool.stub(address).Health.future(
+            server_pb2.HealthRequest(), timeout=self.check_timeout) for address in self.addresses}
+        results = {}
+        busy = []
+        for address, call in calls.items():
+            try:
+                status = call.result()
+                results[address] = (status.serving, status.in_flight + status.pending)
+            except grpc.RpcError as e:
+                results[address] = (False, 0)
+                if e.code() in BUSY_CODES:
+                    busy.append(address)
+        busiest = max((load for _, load in results.values()), default=0)
+        for address in busy:
+            results[address] = (True, busiest + 1)
+        with self._lock:
+            for address, (serving, load) in results.items():
+                self._healthy[address] = serving
+                self._reported[address] = load
+            self._last_check = time.monotonic()
+        return {address: serving for address, (serving, _) in results.items()}
+
+    def _check_in_background(self) -> None:
+        """ Start a check in a background thread, unless one is already running.
+        """
+        with self._lock:
+            if self._checking:
+                return
+            self._checking = True
+
+        def run():
+            try:
+                self.check()
+            finally:
+                with self._lock:
+                    self._checking = False
+        threading.Thread(target=run, name="balancer-check", daemon=True).start()
+
+    def mark_unhealthy(self, address: str) -> None:
+        """ Skip a server (for example, after a failed call) until a later check succeeds.
+
+        Args:
+            address (str): The server address.
+        """
+        with self._lock:
+            self._healthy[address] = False
+
+    def address(self) -> str:
+        """ The server to send the next request to.
+
+        Returns:
+            str: The address.
+
+        Raises:
+            RuntimeError: When no server is healthy.
+        """
+        last_check = self._last_check
+        if last_check is None:
+            self.check()
+        elif time.monotonic() - last_check >= self.check_interval:
+            self._check_in_background()  # Meanwhile, use the last results.
+        with self._lock:
+            healthy = [address for address in self.addresses if self._healthy[address]]
+        if len(healthy) == 0:
+            self.check()  # They may have recovered since the last check.
+            with self._lock:
+                healthy = [address for address in self.addresses if self._healthy[address]]
+            if len(healthy) == 0:
+                raise RuntimeError("No healthy server is available.")
+
+        with self._lock:
+            if self.policy == "least_loaded":
+                return min(healthy,
+                           key=lambda address: self._outstanding[address] + self._reported[address])
+            address = healthy[self._next % len(healthy)]
+            self._next += 1
+            return address
+
+    def started(self, address: str) -> None:
+        """ Record that a call to a server has started (see "least_loaded").
+
+        Args:
+            address (str): The server address.
+        """
+        with self._lock:
+            self._outstanding[address] += 1
+
+    def finished(self, address: str) -> None:
+        """ Record that a call to a server has finished (see `started`).
+
+        Args:
+            address (str): The server address.
+        """
+        with self._lock:
+            self._outstanding[address] -= 1
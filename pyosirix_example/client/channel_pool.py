@@ -0,0 +1,106 @@
+import threading
+from typing import List, Tuple
+
+import grpc
+
+from pyosirix_example.grpc_protocols import server_pb2_grpc
+
+
+class ChannelPool:
+    """ Keeps one long-lived gRPC channel (and Service stub) per server address.
+
+    Reusing a channel avoids a new TCP and HTTP/2 handshake on every call. Keepalive pings detect
+    broken connections while idle, and dropped connections are re-established with exponential
+    backoff.
+
+    Properties:
+        keepalive_time_ms (int): How often to ping the server (ms). Default is 30000.
+        keepalive_timeout_ms (int): How long to wait for a ping reply before the connection is
+            considered broken (ms). Default is 10000.
+        initial_backoff_ms (int): The first reconnect delay (ms). Default is 1000.
+        max_backoff_ms (int): The largest reconnect delay (ms). Default is 30000.
+        max_message_length (int): The largest message that may be sent or received (bytes).
+            Default is 256 MB.
+        compression (grpc.Compression): The default compression of calls on each channel (e.g.
+            grpc.Compression.Gzip). Default is None (no compression).
+    """
+    def __init__(self, keepalive_time_ms: int = 30000, keepalive_timeout_ms: int = 10000,
+                 initial_backoff_ms: int = 1000, max_backoff_ms: int = 30000,
+                 max_message_length: int = 256 * 1024 ** 2, compression: grpc.Compression = None):
+        self.keepalive_time_ms = keepalive_time_ms
+        self.keepalive_timeout_ms = keepalive_timeout_ms
+        self.initial_backoff_ms = initial_backoff_ms
+        self.max_backoff_ms = max_backoff_ms
+        self.max_message_length = max_message_length
+        self.compression = compression
+        self._channels = {}
+        self._stubs = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._channels)
+
+    @property
+    def options(self) -> List[Tuple[str, int]]:
+        """ The gRPC channel options.
+        """
+        return [("grpc.keepalive_time_ms", self.keepalive_time_ms),
+                ("grpc.keepalive_timeout_ms", self.keepalive_timeout_ms),
+                ("grpc.keepalive_permit_without_calls", 1),
+                ("grpc.http2.max_pings_without_data", 0),
+                ("grpc.initial_reconnect_backoff_ms", self.initial_backoff_ms),
+                ("grpc.min_reconnect_backoff_ms", self.initial_backoff_ms),
+                ("grpc.max_reconnect_backoff_ms", self.max_backoff_ms),
+                ("grpc.max_send_message_length", self.max_message_length),
+                ("grpc.max_receive_message_length", self.max_message_length)]
+
+    def channel(self, address: str) -> grpc.Channel:
+        """ The channel to a server, created the first time it is requested.
+
+        Args:
+            address (str): The server address (ip:port).
+
+        Returns:
+            grpc.Channel: The channel.
+        """
+        with self._lock:
+            channel = self._channels.get(address)
+            if channel is None:
+                channel = grpc.insecure_channel(address, options=self.options,
+                                                compression=self.compression)
+                self._channels[address] = channel
+            return channel
+
+    def stub(self, address: str) -> server_pb2_grpc.ServiceStub:
+        """ A Service stub for a server, sharing its pooled channel.
+
+        Args:
+            address (str): The server address (ip:port).
+
+        Returns:
+            server_pb2_grpc.ServiceStub: The stub.
+        """
+        channel = self.channel(address)
+        with self._lock:
+            stub = self._stubs.get(address)
+            if stub is None:
+                stub = server_pb2_grpc.ServiceStub(channel)
+                self._stubs[address] = stub
+            return stub
+
+    def close(self, address: str = None) -> None:
+        """ Close pooled channels. They are re-created if requested again.
+
+        Args:
+            address (str): The server address to close. Default is None, which closes all.
+        """
+        with self._lock:
+            addresses = list(self._channels) if address is None else [address]
+            for address in addresses:
+                self._stubs.pop(address, None)
+                channel = self._channels.pop(address, None)
+                if channel is not None:
+                    channel.close()
+
+
+channel_pool = ChannelPool()  # Shared by all Client instances in this process.
@@ -1,14 +1,138 @@
+from collections import deque
+from typing import Dict, Iterator, List, Tuple
+
+import grpc
 import osirix
 from osirix.dcm_pix import DCMPix
 from osirix.viewer_controller import ViewerController
-import grpc
+import numpy as np
 
-from pyosirix_example.grpc_protocols import server_pb2_grpc
-from pyosirix_example.grpc_protocols import server_pb2
+from pyosirix_example.client.balancer import Balancer
+from pyosirix_example.client.channel_pool import ChannelPool, channel_pool as default_pool
+from pyosirix_example.grpc_protocols import server_pb2, server_pb2_grpc
+from pyosirix_example.utilities.pixel_codec import compact_array, decode_image, encode_array
 
 class Client:
     """ Burn text to images on an OsiriX viewer controller.
+
+    Properties:
+        server_address (str): The address (ip:port) of the processing server.
+            Default is "127.0.0.1:50051".
+        channel_pool (ChannelPool): Where the (long-lived) channel to the server is kept. Default
+            is None, in which case the process-wide pool is used.
+        max_in_flight (int): The most slices submitted at once in pipelined mode. Default is 8.
+        compression (grpc.Compression): The compression of each call (e.g. grpc.Compression.Gzip),
+            overriding that of the channel. Default is None, in which case the channel default is
+            used.
+        compress_threshold (int): The pixel bytes above which requests are delta-deflated (see
+            `pixel_codec.delta_deflate`). Default is None (never).
+        overlay_id (int): The registered overlay each request references (see
+            `register_overlay`). Default is 0, in which case the server's default overlay is used.
+        balancer (Balancer): Spreads requests over several servers, in which case
+            `server_address` is ignored. Default is None (a single server).
     """
+    def __init__(self, server_address: str = "127.0.0.1:50051", channel_pool: ChannelPool = None,
+                 max_in_flight: int = 8, compression: grpc.Compression = None,
+                 compress_threshold: int = None, overlay_id: int = 0, balancer: Balancer = None):
+        self.server_address = server_address
+        self.channel_pool = channel_pool if channel_pool is not None else default_pool
+        self.max_in_flight = max_in_flight
+        self.compression = compression
+        self.compress_threshold = compress_threshold
+        self.overlay_id = overlay_id
+        self.balancer = balancer
+        self._overlay_ids = {}  # Registered overlay IDs, keyed by server address (see `balancer`).
+        self._placements = {}  # Overlay placements, keyed by image shape (rows, columns).
+
+    def next_address(self) -> str:
+        """ The server to send the next request to (see `balancer`).
+        """
+        return self.balancer.address() if self.balancer is not None else self.server_address
+
+    @property
+    def stub(self) -> server_pb2_grpc.ServiceStub:
+        """ The (reused) Service stub for the next server.
+        """
+        return self.channel_pool.stub(self.next_address())
+
+    def image_request(self, array: np.ndarray, address: str = None,
+                      compact: bool = True) -> server_pb2.Image:
+        """ Encode an array for the server, compressing it if it is large enough.
+
+        Args:
+            array (np.ndarray): The image array.
+            address (str): The server it is sent to, which decides the overlay ID when several
+                servers are used. Default is None.
+            compact (bool): Whether to send the pixels in the smallest dtype that holds them (see
+                `pixel_codec.compact_array`), e.g. int16 rather than the float64 of a DCMPix.
+                Default is True.
+
+        Returns:
+            server_pb2.Image: The request. It always accepts a compressed reply.
+        """
+        if compact:
+            array = compact_array(array)
+        compress = self.compress_threshold is not None and array.nbytes >= self.compress_threshold
+        return server_pb2.Image(**encode_array(array, compress=compress), accept_compressed=True,
+                                overlay_id=self._overlay_ids.get(address, self.overlay_id))
+
+    def process_array(self, array: np.ndarray) -> np.ndarray:
+        """ Process an image with a unary call.
+
+        With a `balancer`, a server that is unavailable is marked unhealthy and the call is tried
+        once more on another server.
+
+        Args:
+            array (np.ndarray): The image array.
+
+        Returns:
+            np.ndarray: The processed array.
+        """
+        for attempt in range(2):
+            address = self.next_address()
+            if self.balancer is not None:
+                self.balancer.started(address)
+            try:
+                response = self.channel_pool.stub(address).ProcessImage(
+                    self.image_request(array, address), compression=self.compression)
+                return decode_image(response)
+            except grpc.RpcError as e:
+                if self.balancer is None or e.code() != grpc.StatusCode.UNAVAILABLE or attempt > 0:
+                    raise
+                self.balancer.mark_unhealthy(address)
+            finally:
+                if self.balancer is not None:
+                    self.balancer.finished(address)
+
+    def register_overlay(self, text: str = "", **kwargs) -> int:
+        """ Register an overlay with the server, which later requests then reference by ID.
+
+        The overlay is rendered once by the server, so each request only carries its pixels.
+
+        Args:
+            text (str): The text. Default is "", in which case the server's own text is used.
+            kwargs (dict): Other `server_pb2.OverlaySpec` fields (e.g. location, scale, value).
+                Unset fields take the server defaults.
+
+        Returns:
+            int: The ID, which is also stored in `overlay_id`. With a `balancer`, the overlay is
+                registered with every server, each of which may give it a different ID.
+        """
+        spec = server_pb2.OverlaySpec(text=text, **kwargs)
+        if self.balancer is None:
+            self.overlay_id = self.stub.RegisterOverlay(spec, compression=self.compression).id
+            return self.overlay_id
+        for address in self.balancer.addresses:
+            try:
+                self._overlay_ids[address] = self.channel_pool.stub(address).RegisterOverlay(
+                    spec, compression=self.compression).id
+            except grpc.RpcError as e:
+                if e.code() != grpc.StatusCode.UNAVAILABLE:
+                    raise
+                self.balancer.mark_unhealthy(address)  # Not sent requests until it is back.
+        self.overlay_id = self._overlay_ids[self.balancer.address()]
+        return self.overlay_id
+
     def write_text_in_pix(self, text: str, pix: DCMPix) -> None:
         """ Write a text string in an OsiriX DCMPix instance.
 
@@ -16,10 +140,136 @@ class Client:
             text (str): The desired string.
             pix (DCMPix): The OsiriX DCMPix.
         """
+        pix.image = self.process_array(pix.image)
+
+    def overlay_placement(self, shape: Tuple[int, int]) -> server_pb2.Placement:
+        """ Where the server places the overlay in an image (asked once per shape).
+
+        Args:
+            shape (Tuple[int, int]): The image shape (rows, columns).
+
+        Returns:
+            server_pb2.Placement: The region of the image changed by the server.
+        """
+        placement = self._placements.get(shape)
+        if placement is None:
+            placement = self.stub.GetOverlayPlacement(server_pb2.Shape(rows=shape[0],
+                                                                       columns=shape[1]),
+                                                      compression=self.compression)
+            self._placements[shape] = placement
+        return placement
+
+    def write_text_in_pix_patch(self, text: str, pix: DCMPix) -> None:
+        """ Write a text string in an OsiriX DCMPix instance, sending only the overlay patch.
+
+        Only the rectangle covered by the overlay travels to and from the server, which is far
+        less data than the whole image.
+
+        Args:
+            text (str): The desired string.
+            pix (DCMPix): The OsiriX DCMPix.
+        """
+        image = compact_array(pix.image)  # Decided for the whole image, not just the patch.
+        placement = self.overlay_placement(tuple(image.shape[0:2]))
+        if placement.rows == 0 or placement.columns == 0:
+            return
+        rows = slice(placement.top, placement.top + placement.rows)
+        columns = slice(placement.left, placement.left + placement.columns)
+        request = server_pb2.Patch(shape=server_pb2.Shape(rows=image.shape[0],
+                                                          columns=image.shape[1]),
+                                   placement=placement,
+                                   image=self.image_request(image[rows, columns], compact=False))
+        patch = decode_image(self.stub.ProcessPatch(request, compression=self.compression))
+        image = image.astype(patch.dtype)  # The server keeps int16/uint16, otherwise float32.
+        image[rows, columns] = patch
+        pix.image = image
+
+    def write_text_in_pix_list(self, text: str, pix_lists: Dict[int, List[DCMPix]]) -> None:
+        """ Write a text string in many DCMPix instances using a single streaming call.
+
+        Slices are read from OsiriX lazily as the stream consumes them, so gRPC flow control limits
+        how many are held in memory at once. Each result is written back as soon as it arrives.
+        With a `balancer`, the whole stream goes to one server. If it is unavailable, it is marked
+        unhealthy and the slices not yet written back are streamed once more to another server.
+
+        Args:
+            text (str): The desired string.
+            pix_lists (Dict[int, List[DCMPix]]): The DCMPix instances to write in, keyed by their
+                frame (movie index).
+        """
+        pixes = {(frame, index): pix
+                 for frame, pix_list in pix_lists.items()
+                 for index, pix in enumerate(pix_list)}
+
+        def slices(address: str) -> Iterator[server_pb2.Slice]:
+            for (frame, index), pix in list(pixes.items()):  # Written back ones are removed.
+                yield server_pb2.Slice(frame=frame,
+                                       index=index,
+                                       image=self.image_request(pix.image, address))
+
+        for attempt in range(2):
+            address = self.next_address()
+            if self.balancer is not None:
+                self.balancer.started(address)
+            try:
+                stub = self.channel_pool.stub(address)
+                for response in stub.ProcessSeries(slices(address), compression=self.compression):
+                    pixes.pop((response.frame, response.index)).image = \
+                        decode_image(response.image)
+                return
+            except grpc.RpcError as e:
+                if self.balancer is None or e.code() != grpc.StatusCode.UNAVAILABLE or attempt > 0:
+                    raise
+                self.balancer.mark_unhealthy(address)
+            finally:
+                if self.balancer is not None:
+                    self.balancer.finished(address)
+
+    def write_text_in_pix_list_pipelined(self, text: str,
+                                         pix_lists: Dict[int, List[DCMPix]]) -> None:
+        """ Write a text string in many DCMPix instances using concurrent unary calls.
+
+        Up to `max_in_flight` slices are submitted to the server at once (so several server
+        threads can work on them), and results are written back in submission order. With a
+        `balancer`, each slice may go to a different server.
+
+        Args:
+            text (str): The desired string.
+            pix_lists (Dict[int, List[DCMPix]]): The DCMPix instances to write in, keyed by their
+                frame (movie index).
+        """
+        window = deque()
 
+        def finish(done_pix: DCMPix, address: str, future: grpc.Future) -> None:
+            try:
+                done_pix.image = decode_image(future.result())
+            except grpc.RpcError as e:
+                if self.balancer is None or e.code() != grpc.StatusCode.UNAVAILABLE:
+                    raise
+                self.balancer.mark_unhealthy(address)
+                done_pix.image = self.process_array(done_pix.image)  # Another server.
+
+        try:
+            for pix_list in pix_lists.values():
+                for pix in pix_list:
+                    address = self.next_address()
+                    future = self.channel_pool.stub(address).ProcessImage.future(
+                        self.image_request(pix.image, address), compression=self.compression)
+                    if self.balancer is not None:
+                        self.balancer.started(address)
+                        future.add_done_callback(lambda _, a=address: self.balancer.finished(a))
+                    window.append((pix, address, future))
+                    if len(window) >= self.max_in_flight:
+                        finish(*window.popleft())
+            while window:
+                finish(*window.popleft())
+        finally:
+            for _, _, future in window:  # Only left over if something failed.
+                future.cancel()
 
     def write_text_in_viewer_controller(self, text: str, viewer: ViewerController,
-                                        movie_idx: int = -1) -> None:
+                                        movie_idx: int = -1, pipelined: bool = False,
+                                        patch: bool = False) -> None:
         """ Write a text string in all DCMPix instances within a viewer.
 
         Args:
@@ -27,16 +277,25 @@ class Client:
             viewer (ViewerController): The OsiriX ViewerController.
             movie_idx (int): The frame of the viewer in which to write the text. Default is -1 in
                 which case all frames are written.
+            pipelined (bool): Whether to submit slices as concurrent unary calls (see
+                `write_text_in_pix_list_pipelined`) rather than a single stream (see
+                `write_text_in_pix_list`). Default is False.
+            patch (bool): Whether to send only the patch covered by the text (see
+                `write_text_in_pix_patch`). Takes precedence over `pipelined`, and cannot be used
+                with a registered overlay. Default is False.
         """
         if movie_idx == -1:
-            for idx in range(viewer.max_movie_index):
-                pix_list = viewer.pix_list(idx)
+            pix_lists = {idx: viewer.pix_list(idx) for idx in range(viewer.max_movie_index)}
+        else:
+            pix_lists = {movie_idx: viewer.pix_list(movie_idx)}
+        if patch:
+            for pix_list in pix_lists.values():
                 for pix in pix_list:
-                    self.write_text_in_pix(text, pix)
+                    self.write_text_in_pix_patch(text, pix)
+        elif pipelined:
+            self.write_text_in_pix_list_pipelined(text, pix_lists)
         else:
-            pix_list = viewer.pix_list(movie_idx)
-            for pix in pix_list:
-                self.write_text_in_pix(text, pix)
+            self.write_text_in_pix_list(text, pix_lists)
         viewer.needs_display_update()
 
     def write_text_in_selected_viewer_controller(self) -> None:
@@ -51,21 +310,20 @@ class Client:
 def run():
     # Replace 'localhost' with the specific IP address of the server
     server_address = '192.168.1.100:50051'  # Replace with your server's IP address and port
-    with grpc.insecure_channel(server_address) as channel:
-        # Create a stub (client)
-        stub = server_pb2_grpc.ServiceStub(channel)
 
-        # Create a sample request with an array of image data
-        rows, columns = 2, 3  # Example dimensions
-        image_data = [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]  # Example image data
+    # Get a stub (client) on the pooled channel, which is kept open for later calls
+    stub = default_pool.stub(server_address)
+
+    # Create a sample request with an array of image data
+    image_data = np.arange(1, 7, dtype="float32").reshape(2, 3)  # Example image data
 
-        request = server_pb2.Image(rows=rows, columns=columns, image=image_data)
-        print(f"Sending Image: {rows}x{columns} with data {image_data}")
+    request = server_pb2.Image(**encode_array(image_data))
+    print(f"Sending Image: {request.rows}x{request.columns} with data {image_data.ravel()}")
 
-        # Call the ProcessImage method
-        response = stub.ProcessImage(request)
-        print(
-            f"Received Processed Image: {response.rows}x{response.columns} with data {response.image}")
+    # Call the ProcessImage method
+    response = stub.ProcessImage(request)
+    print(f"Received Processed Image: {response.rows}x{response.columns} "
+          f"with data {decode_image(response).ravel()}")
 
 
 # How to run the client.
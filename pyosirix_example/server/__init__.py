@@ -0,0 +1,14 @@
+import importlib
+
+# Loaded on first access (see pyosirix_example/__init__.py).
+_submodules = ("data_loader", "metrics", "overlay_registry", "render_pool", "server")
+
+
+def __getattr__(name: str):
+    if name in _submodules:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_submodules))
@@ -1,14 +1,22 @@
 import os
-
-import dvc.api
+import threading
 
 from pyosirix_example import __gh_hash__, __gh_repo__
 
 
 class DataLoader:
+    """ Provides the content of the data file, downloading it with DVC if needed.
+
+    The content is kept in memory and only read from disk again when the file changes (its
+    modification time or size differs).
+    """
     def __init__(self):
-        self.data_directory = os.path.join(__file__, "data")
+        self.data_directory = os.path.join(os.path.dirname(__file__), "data")
         os.makedirs(self.data_directory, exist_ok=True)
+        self._data = None
+        self._signature = None
+        self._lock = threading.Lock()
+        self._prefetch_thread = None
 
     @staticmethod
     def __dvc_data_path__() -> str:
@@ -16,6 +24,12 @@ class DataLoader:
         """
         return "data/viewer_text.txt"
 
+    @property
+    def overlay_directory(self) -> str:
+        """ Where rendered text images are stored within the package (see `OverlayStore`).
+        """
+        return os.path.join(self.data_directory, "overlays")
+
     @property
     def data_path(self) -> str:
         """ Where the data is located within the package.
@@ -25,16 +39,49 @@ class DataLoader:
     def __download_data__(self):
         """ Load the data from the DVC repository
         """
+        import dvc.api  # Slow to import, and only needed the first time the data is used.
+
         with dvc.api.open(self.__dvc_data_path__(), repo=__gh_repo__, rev=__gh_hash__) as f:
             with open(self.data_path, 'wb') as d:
                 d.write(f.read())
 
+    def prefetch(self, background: bool = True) -> None:
+        """ Download (if needed) and load the data ahead of the first request.
+
+        Args:
+            background (bool): Whether to do this in a background thread. Any access to `data`
+                while the prefetch is running waits for it to finish. Default is True.
+        """
+        if not background:
+            _ = self.data
+            return
+
+        def run():
+            try:
+                _ = self.data
+            except Exception as e:  # The next access to `data` will try again.
+                print(f"Data prefetch failed: {e}")
+
+        self._prefetch_thread = threading.Thread(target=run, name="DataLoaderPrefetch",
+                                                 daemon=True)
+        self._prefetch_thread.start()
+
     @property
     def data(self) -> str:
         """ The content of the data file.
         """
-        if not os.path.exists(self.data_path):
-            self.__download_data__()
+        thread = self._prefetch_thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+        with self._lock:
+            if not os.path.exists(self.data_path):
+                self.__download_data__()
 
-        with open(self.data_path, 'r') as f:
-            return f.read()
+            stat = os.stat(self.data_path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if signature != self._signature:
+                with open(self.data_path, 'r') as f:
+                    self._data = f.read()
+                self._signature = signature
+            return self._data
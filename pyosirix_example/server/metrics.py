@@ -0,0 +1,173 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+import threading
+import time
+from typing import Dict, Iterator, List, Tuple
+
+# Upper bounds (seconds) of the latency histogram buckets. A final bucket catches anything slower.
+LATENCY_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                  1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """ A fixed-bucket histogram of latencies.
+
+    Properties:
+        bounds (Tuple[float, ...]): The upper bound (seconds) of each bucket.
+        counts (List[int]): The number of observations in each bucket, plus one for values above
+            the last bound.
+        count (int): The total number of observations.
+        total (float): The sum of all observations (seconds).
+    """
+    def __init__(self, bounds: Tuple[float, ...] = LATENCY_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        """ Record an observation.
+
+        Args:
+            value (float): The observed latency (seconds).
+        """
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def quantile(self, q: float) -> float:
+        """ An estimate of a quantile: the upper bound of the bucket in which it falls.
+
+        Args:
+            q (float): The quantile, between 0 and 1.
+
+        Returns:
+            float: The estimate (seconds). Infinite if it falls above the last bound.
+        """
+        if self.count == 0:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """ Thread-safe latency histograms, counters and gauges for the server hot path.
+
+    Recording is a `time.perf_counter` call and a short locked update, so it is cheap enough to
+    leave on in production.
+
+    Properties:
+        enabled (bool): Whether to record anything. Default is True.
+    """
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, seconds: float) -> None:
+        """ Record the latency of a stage.
+
+        Args:
+            name (str): The name of the stage.
+            seconds (float): The latency (seconds).
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """ Time the enclosed block as a stage.
+
+        Args:
+            name (str): The name of the stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def increment(self, name: str, value: int = 1) -> None:
+        """ Add to a counter.
+
+        Args:
+            name (str): The name of the counter.
+            value (int): The amount to add. Default is 1.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_to_gauge(self, name: str, value: int) -> None:
+        """ Change a gauge (a value that can go up and down).
+
+        Args:
+            name (str): The name of the gauge.
+            value (int): The amount to add (may be negative).
+        """
+        with self._lock:  # Gauges are always kept, so they stay balanced if `enabled` changes.
+            self.gauges[name] = self.gauges.get(name, 0) + value
+
+    @contextmanager
+    def in_flight(self, name: str = "in_flight") -> Iterator[None]:
+        """ Count the enclosed block in a gauge for as long as it runs.
+
+        Args:
+            name (str): The name of the gauge. Default is "in_flight".
+        """
+        self.add_to_gauge(name, 1)
+        try:
+            yield
+        finally:
+            self.add_to_gauge(name, -1)
+
+    def snapshot(self) -> Dict:
+        """ A copy of all recorded values.
+
+        Returns:
+            dict: With keys "stages" (name: (count, total seconds, bounds, counts)), "counters"
+                and "gauges".
+        """
+        with self._lock:
+            stages = {name: (h.count, h.total, h.bounds, list(h.counts))
+                      for name, h in self.histograms.items()}
+            return {"stages": stages, "counters": dict(self.counters), "gauges": dict(self.gauges)}
+
+    def reset(self) -> None:
+        """ Clear the histograms and counters (gauges are kept).
+        """
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def to_text(self) -> str:
+        """ A human-readable summary of all recorded values.
+
+        Returns:
+            str: One line per stage, counter and gauge.
+        """
+        with self._lock:
+            lines: List[str] = []
+            for name, h in sorted(self.histograms.items()):
+                mean = h.total / h.count if h.count else 0.0
+                lines.append(f"stage {name}: count={h.count} mean={mean * 1000:.3f}ms "
+                             f"p50<={h.quantile(0.5) * 1000:g}ms "
+                             f"p99<={h.quantile(0.99) * 1000:g}ms")
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"counter {name}: {value}")
+            for name, value in sorted(self.gauges.items()):
+                lines.append(f"gauge {name}: {value}")
+            return "\n".join(lines)
@@ -0,0 +1,193 @@
+from collections import OrderedDict
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+from numpy.typing import NDArray
+
+from pyosirix_example.utilities.text_2_image import Text2Image
+
+
+class OverlayRegistryFull(Exception):
+    """ Raised when an overlay is registered beyond `OverlayRegistry.max_overlays`.
+    """
+
+
+class OverlayRegistry:
+    """ Overlays registered by clients, referenced by a small integer ID.
+
+    Each registered overlay is rendered once per image geometry and kept apart from the
+    renderer's own cache, so it is never evicted by other traffic and requests only need to carry
+    their pixels and the ID. Registering the same overlay twice returns the same ID.
+
+    Since clients choose what is registered, the number of registrations is capped, rendered
+    overlays are evicted (least recently used first) once they exceed `max_bytes`, and only the
+    fonts in `fonts` may be used.
+
+    Properties:
+        text_2_image (Text2Image): The renderer used to prepare the overlays.
+        fixed_text_2_image (Text2Image): The renderer of overlays registered with `fixed_size`,
+            when `text_2_image` picks the font size from the overlay width (see
+            `Text2Image.direct_size`). Default is None, in which case `text_2_image` renders
+            every overlay.
+        max_overlays (int): The largest number of registrations. Default is 256.
+        max_bytes (int): The byte budget of the rendered overlays. Default is 64 MB.
+        fonts (Iterable[str]): The font paths that overlays may use (leaving it unset is always
+            allowed). Default is None, in which case any font may be used.
+        evictions (int): The number of rendered overlays evicted to stay within budget.
+    """
+    def __init__(self, text_2_image: Text2Image, fixed_text_2_image: Text2Image = None,
+                 max_overlays: int = 256, max_bytes: int = 64 * 1024 ** 2,
+                 fonts: Iterable[str] = None):
+        self.text_2_image = text_2_image
+        self.fixed_text_2_image = fixed_text_2_image
+        self.max_overlays = max_overlays
+        self.max_bytes = max_bytes
+        self.fonts = None if fonts is None else frozenset(fonts)
+        self.evictions = 0
+        self._specs = {}  # (text, render kwargs, renderer), keyed by ID.
+        self._ids = {}  # ID, keyed by the (hashable) spec.
+        # Prepared overlays, keyed by (ID, text, mode, shape). Least recently used first.
+        self._overlays = OrderedDict()
+        self._sizes = {}  # The bytes of each prepared overlay.
+        self._size_bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._specs)
+
+    @property
+    def size_bytes(self) -> int:
+        """ The total number of bytes of the rendered overlays.
+        """
+        return self._size_bytes
+
+    @staticmethod
+    def _spec_key(text: Optional[str], kwargs: Dict) -> Tuple:
+        return text, tuple(sorted((key, tuple(value) if isinstance(value, list) else value)
+                                  for key, value in kwargs.items()))
+
+    def register(self, text: Optional[str], kwargs: Dict, shape: Tuple[int, int] = (512, 512),
+                 fixed_size: bool = False) -> int:
+        """ Register an overlay, rendering it straight away.
+
+        Args:
+            text (str): The text, or None to use the text given to `paste` (e.g. the server's).
+            kwargs (dict): Keyword arguments passed to `Text2Image.prepare_overlay`.
+            shape (Tuple[int, int]): The (rows, columns) used to check and pre-render the overlay.
+                Default is (512, 512).
+            fixed_size (bool): Whether to render the text at the `font_size` in `kwargs` (and
+                then resize it), using `fixed_text_2_image` if set. Default is False.
+
+        Returns:
+            int: The ID (at least 1).
+
+        Raises:
+            ValueError: When the overlay cannot be rendered (e.g. an invalid location) or its font
+                is not allowed.
+            OverlayRegistryFull: When `max_overlays` overlays are already registered.
+        """
+        key = (self._spec_key(text, kwargs), fixed_size)
+        renderer = self.text_2_image
+        if fixed_size and self.fixed_text_2_image is not None:
+            renderer = self.fixed_text_2_image
+        with self._lock:
+            overlay_id = self._ids.get(key)
+            if overlay_id is not None:
+                return overlay_id
+            if len(self._specs) >= self.max_overlays:
+                raise OverlayRegistryFull(f"No more than {self.max_overlays} overlays may be "
+                                          f"registered.")
+
+        font_path = kwargs.get("font_path")
+        if font_path is not None and self.fonts is not None and font_path not in self.fonts:
+            raise ValueError(f"Font {font_path} is not available.")
+        try:  # Render straight away, which also fails early if the spec is invalid.
+            overlay = renderer.prepare_overlay(text if text is not None else "0", shape, "F",
+                                               **kwargs)
+        except OSError as e:  # The font could not be loaded.
+            raise ValueError(f"Cannot render overlay: {e}") from e
+
+        with self._lock:
+            overlay_id = self._ids.get(key)
+            if overlay_id is None:
+                if len(self._specs) >= self.max_overlays:
+                    raise OverlayRegistryFull(f"No more than {self.max_overlays} overlays may be "
+                                              f"registered.")
+                overlay_id = len(self._specs) + 1
+                self._specs[overlay_id] = (text, dict(kwargs), renderer)
+                self._ids[key] = overlay_id
+                if text is not None:
+                    self._keep((overlay_id, text, "F", tuple(shape)), overlay)
+            return overlay_id
+
+    @staticmethod
+    def overlay_bytes(overlay: Tuple[int, int, NDArray, Optional[NDArray]]) -> int:
+        """ The number of bytes used by a prepared overlay and its mask.
+
+        Args:
+            overlay (Tuple[int, int, NDArray, NDArray]): The overlay (see
+                `Text2Image.prepare_overlay`).
+
+        Returns:
+            int: The number of bytes.
+        """
+        _, _, pixels, mask = overlay
+        return pixels.nbytes + (mask.nbytes if mask is not None else 0)
+
+    def _keep(self, key: Tuple, overlay: Tuple[int, int, NDArray, Optional[NDArray]]) -> None:
+        """ Keep a prepared overlay, evicting the least recently used if needed. Call with the lock.
+        """
+        size = self.overlay_bytes(overlay)
+        if size > self.max_bytes:
+            return
+        if key in self._overlays:
+            self._size_bytes -= self._sizes.pop(key)
+            del self._overlays[key]
+        while self._overlays and self._size_bytes + size > self.max_bytes:
+            old_key, _ = self._overlays.popitem(last=False)
+            self._size_bytes -= self._sizes.pop(old_key)
+            self.evictions += 1
+        self._overlays[key] = overlay
+        self._sizes[key] = size
+        self._size_bytes += size
+
+    def _overlay(self, overlay_id: int, text: str, kwargs: Dict, renderer: Text2Image, mode: str,
+                 shape: Tuple[int, int]) -> Tuple[int, int, NDArray, Optional[NDArray]]:
+        """ The prepared overlay of an ID for a given text and geometry, rendering it if needed.
+        """
+        key = (overlay_id, text, mode, shape)
+        with self._lock:
+            overlay = self._overlays.get(key)
+            if overlay is not None:
+                self._overlays.move_to_end(key)
+        if overlay is None:
+            overlay = renderer.prepare_overlay(text, shape, mode, **kwargs)
+            with self._lock:
+                self._keep(key, overlay)
+        return overlay
+
+    def paste(self, overlay_id: int, array: NDArray, default_text: str,
+              in_place: bool = False) -> NDArray:
+        """ Paste a registered overlay within a Numpy array.
+
+        Args:
+            overlay_id (int): The ID from `register`.
+            array (NDArray): The array to be pasted.
+            default_text (str): The text used if the overlay was registered without one.
+            in_place (bool): Whether to write into `array` where possible (see
+                `Text2Image.paste_text_in_array`). Default is False.
+
+        Returns:
+            NDArray: The pasted array.
+
+        Raises:
+            KeyError: When the ID is not registered.
+        """
+        spec = self._specs.get(overlay_id)
+        if spec is None:
+            raise KeyError(f"Unknown overlay ID {overlay_id}.")
+        text, kwargs, renderer = spec
+        mode = Text2Image.array_mode(array)
+        overlay = self._overlay(overlay_id, text if text is not None else default_text, kwargs,
+                                renderer, mode, tuple(array.shape[0:2]))
+        return renderer.paste_overlay(array, overlay, in_place=in_place)
@@ -0,0 +1,135 @@
+from concurrent import futures
+from multiprocessing import shared_memory
+import os
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+
+from pyosirix_example.utilities.font_registry import font_registry
+from pyosirix_example.utilities.overlay_cache import OverlayCache
+from pyosirix_example.utilities.overlay_store import OverlayStore
+from pyosirix_example.utilities.text_2_image import Text2Image
+
+_worker = {}  # The renderer of the current worker process (see `_initialise_worker`).
+
+
+def _initialise_worker(fonts: Iterable[Tuple[str, float]], cache_bytes: int, text: str,
+                       render_kwargs: Dict, store_directory: str = None,
+                       store_bytes: int = 0, direct_size: bool = False,
+                       warm_shapes: Iterable[Tuple[int, int]] = ()) -> None:
+    """ Load the fonts and render the expected text once when a worker process starts.
+    """
+    font_registry.preload(fonts)
+    store = None
+    if store_directory is not None and store_bytes > 0:
+        store = OverlayStore(store_directory, max_bytes=store_bytes)
+    _worker["text_2_image"] = Text2Image(cache=OverlayCache(max_bytes=cache_bytes),
+                                         measure_text=True, store=store, direct_size=direct_size)
+    if text is not None:
+        if direct_size:
+            # The font size depends on the image width, so size (and render) the text for each
+            # expected image shape.
+            for shape in warm_shapes:
+                _worker["text_2_image"].prepare_overlay(text, shape, "F", **render_kwargs)
+            return
+        kwargs = {key: value for key, value in render_kwargs.items()
+                  if key not in ("location", "scale", "offset", "remove_background")}
+        _worker["text_2_image"].text_to_image(text, **kwargs)
+
+
+def _paste_text_in_shared_array(name: str, shape: Tuple[int, ...], dtype: str, text: str,
+                                kwargs: Dict) -> None:
+    """ Paste a text string, in place, within an array held in shared memory.
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    array = None
+    try:
+        array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        _worker["text_2_image"].paste_text_in_array(text, array, engine="numpy", in_place=True,
+                                                    **kwargs)
+    finally:
+        del array  # Release the buffer before closing.
+        shm.close()
+
+
+class RenderPool:
+    """ Runs `Text2Image.paste_text_in_array` in a pool of worker processes.
+
+    Pixel data is passed to the workers through shared memory rather than being pickled, and each
+    worker is pre-warmed with the fonts (and optionally the text) it is expected to render.
+
+    Properties:
+        processes (int): The number of worker processes. Default is None, in which case the number
+            of CPUs is used.
+        fonts (Iterable[Tuple[str, float]]): The (font_path, font_size) pairs each worker preloads.
+        cache_bytes (int): The byte budget of each worker's rendered text cache. Default is 64 MB.
+        text (str): A text string each worker renders ahead of time. Default is None.
+        render_kwargs (dict): The `paste_text_in_array` keyword arguments used to pre-render
+            `text`. Default is None.
+        store_directory (str): The directory of an `OverlayStore` shared by all workers, so each
+            text is only rendered once between them. Default is None (no store).
+        store_bytes (int): The byte budget of the store. Default is 256 MB.
+        direct_size (bool): Whether to render text at its final size (see `Text2Image`).
+            Default is False.
+        warm_shapes (Iterable[Tuple[int, int]]): The (rows, columns) of the images `text` is
+            pre-rendered for if `direct_size`, since the font size then depends on the image
+            width. Default is (512, 512) only.
+    """
+    def __init__(self, processes: int = None, fonts: Iterable[Tuple[str, float]] = (),
+                 cache_bytes: int = 64 * 1024 ** 2, text: str = None, render_kwargs: Dict = None,
+                 store_directory: str = None, store_bytes: int = 256 * 1024 ** 2,
+                 direct_size: bool = False,
+                 warm_shapes: Iterable[Tuple[int, int]] = ((512, 512),)):
+        self.processes = processes or os.cpu_count()
+        self.executor = futures.ProcessPoolExecutor(
+            max_workers=self.processes,
+            initializer=_initialise_worker,
+            initargs=(list(fonts), cache_bytes, text, dict(render_kwargs or {}), store_directory,
+                      store_bytes, direct_size, [tuple(shape) for shape in warm_shapes]))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+    def warm_up(self) -> None:
+        """ Start the worker processes now, rather than on the first request.
+        """
+        list(self.executor.map(int, range(self.processes)))
+
+    def paste_text_in_array(self, text: str, array: NDArray, **kwargs) -> NDArray:
+        """ Paste a text string within a Numpy array using a worker process.
+
+        Args:
+            text (str): The text to be pasted.
+            array (NDArray): The array to be pasted.
+            kwargs (dict): Keyword arguments passed to `Text2Image.paste_text_in_array`.
+
+        Returns:
+            NDArray: The pasted array (see `Text2Image.output_dtype` for greyscale, uint8 for
+                RGB/RGBA).
+        """
+        if Text2Image.array_mode(array) == "F":
+            dtype = Text2Image.output_dtype(array)
+        else:
+            dtype = np.dtype("uint8")
+        shm = shared_memory.SharedMemory(create=True, size=max(array.size * dtype.itemsize, 1))
+        shared = None
+        try:
+            shared = np.ndarray(array.shape, dtype=dtype, buffer=shm.buf)
+            shared[...] = array
+            self.executor.submit(_paste_text_in_shared_array, shm.name, array.shape, dtype.str,
+                                 text, kwargs).result()
+            result = shared.copy()
+        finally:
+            del shared  # Release the buffer before closing.
+            shm.close()
+            shm.unlink()
+        return result
+
+    def shutdown(self) -> None:
+        """ Stop the worker processes.
+        """
+        self.executor.shutdown()
@@ -1,51 +1,645 @@
+import asyncio
 from concurrent import futures
+from contextlib import contextmanager, nullcontext
+import os
+import threading
+import time
+from typing import Iterator, List, Tuple
 
 import grpc
-import numpy as np
 
-from data_loader import DataLoader
 from pyosirix_example.grpc_protocols import server_pb2_grpc
 from pyosirix_example.grpc_protocols import server_pb2
+from pyosirix_example.server.data_loader import DataLoader
+from pyosirix_example.server.metrics import Metrics
+from pyosirix_example.server.overlay_registry import OverlayRegistry, OverlayRegistryFull
+from pyosirix_example.server.render_pool import RenderPool
+from pyosirix_example.utilities.font_registry import font_registry
+from pyosirix_example.utilities.memory_profile import memory_profiler, profiled
+from pyosirix_example.utilities.overlay_cache import OverlayCache
+from pyosirix_example.utilities.overlay_store import OverlayStore
+from pyosirix_example.utilities.pixel_codec import decode_image, encode_array, uses_legacy_field
 from pyosirix_example.utilities.text_2_image import Text2Image
 
+FONTS = [("GillSans.ttc", 40)]  # The (font_path, font_size) pairs used by `Service.process`.
+
+# How `Service.process` burns the text into each image (see `Text2Image.paste_text_in_array`).
+RENDER_KWARGS = dict(location=3,  # Top left
+                     scale=0.75,
+                     offset=0.05,
+                     remove_background=False,
+                     align="left",
+                     font_path=FONTS[0][0],
+                     font_size=FONTS[0][1],
+                     value=4095,
+                     bg_value=0)
+
+
+# Threads of the sync server beyond its admitted calls, for Health checks and rejections.
+SPARE_THREADS = 4
+
+
+def server_options(max_message_length: int = 256 * 1024 ** 2) -> List[Tuple[str, int]]:
+    """ The gRPC server options.
+
+    Args:
+        max_message_length (int): The largest message that may be sent or received (bytes).
+            Default is 256 MB, enough for a 4096x4096 float64 image.
+
+    Returns:
+        List[Tuple[str, int]]: The options.
+    """
+    return [("grpc.max_send_message_length", max_message_length),
+            ("grpc.max_receive_message_length", max_message_length),
+            # Accept the keepalive pings of pooled client channels (see `ChannelPool`).
+            ("grpc.keepalive_permit_without_calls", 1),
+            ("grpc.http2.min_recv_ping_interval_without_data_ms", 10000),
+            ("grpc.http2.max_ping_strikes", 0)]
+
+
+class RequestShed(Exception):
+    """ Raised when a request is dropped rather than processed (see `Service.check_call`).
+
+    Properties:
+        code (grpc.StatusCode): The status returned to the client.
+    """
+    def __init__(self, code: grpc.StatusCode, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+class CallState:
+    """ Whether an asyncio call is still worth processing, readable from any thread.
+
+    It offers the `is_active` and `time_remaining` methods of a (sync) `grpc.ServicerContext`, so
+    it can be passed to `Service.process` from an executor thread.
+
+    Properties:
+        context (grpc.aio.ServicerContext): The context of the call.
+    """
+    def __init__(self, context: grpc.aio.ServicerContext):
+        remaining = context.time_remaining()
+        self._deadline = None if remaining is None else time.monotonic() + remaining
+        self._done = threading.Event()
+        context.add_done_callback(lambda _: self._done.set())
+
+    def is_active(self) -> bool:
+        return not self._done.is_set()
+
+    def time_remaining(self) -> float:
+        return None if self._deadline is None else max(self._deadline - time.monotonic(), 0.0)
+
+
 class Service(server_pb2_grpc.ServiceServicer):
-    def __init__(self):
+    def __init__(self, cache_bytes: int = 64 * 1024 ** 2, render_pool: RenderPool = None,
+                 metrics: Metrics = None, compress_threshold: int = None, store_bytes: int = 0,
+                 direct_size: bool = True, max_active: int = None, max_pending: int = None):
         self.data_loader = DataLoader()
+        self.metrics = metrics if metrics is not None else Metrics()
+
+        # Admission of the (sync) RPCs that do work (see `admit`): at most `max_active` are
+        # processed at once, and calls beyond `max_pending` waiting or active are rejected.
+        self.max_pending = max_pending
+        self._active = threading.BoundedSemaphore(max_active) if max_active else nullcontext()
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+
+        # Replies with at least this many pixel bytes are delta-deflated, if the client accepts it.
+        self.compress_threshold = compress_threshold
+
+        # One renderer shared by all requests, so identical overlays are only rendered once (and,
+        # with a store, only once across restarts).
+        store = None
+        if store_bytes > 0:
+            store = OverlayStore(self.data_loader.overlay_directory, max_bytes=store_bytes,
+                                 metrics=self.metrics)
+        # With `direct_size`, text is rendered at its final size, so no slice is ever resampled.
+        self.text_2_image = Text2Image(cache=OverlayCache(max_bytes=cache_bytes), measure_text=True,
+                                       metrics=self.metrics, store=store, direct_size=direct_size)
+
+        # Overlays registered by clients (see `register_overlay`), rendered by the same renderer,
+        # except those that ask for a font size, which are rendered at it and then resized.
+        fixed_text_2_image = None
+        if direct_size:
+            fixed_text_2_image = Text2Image(cache=self.text_2_image.cache, measure_text=True,
+                                            metrics=self.metrics, store=store)
+        # Clients may only use the server's own fonts, rather than any path on the server.
+        self.overlays = OverlayRegistry(self.text_2_image, fixed_text_2_image,
+                                        fonts=[path for path, _ in FONTS])
+
+        # Optionally render in worker processes instead (avoids contention on the GIL).
+        self.render_pool = render_pool
+
+    @contextmanager
+    def admit(self) -> Iterator[None]:
+        """ Admit a call to be processed, waiting for one of the `max_active` slots.
+
+        Used by the sync RPC handlers. Calls rejected here never wait for a slot, and `Health`
+        is never subject to it, so both are answered straight away however busy the server is.
+
+        Raises:
+            RequestShed: When `max_pending` calls are already waiting or being processed.
+        """
+        with self._pending_lock:
+            if self.max_pending is not None and self._pending >= self.max_pending:
+                self.metrics.increment("shed_queue_full")
+                raise RequestShed(grpc.StatusCode.RESOURCE_EXHAUSTED,
+                                  "Server is busy, try again later.")
+            self._pending += 1
+        self.metrics.add_to_gauge("pending", 1)
+        try:
+            with self._active:
+                yield
+        finally:
+            with self._pending_lock:
+                self._pending -= 1
+            self.metrics.add_to_gauge("pending", -1)
+
+    def ProcessImage(self, request, context):
+        try:
+            with self.admit():
+                return self.process(request, context)
+        except KeyError as e:
+            context.abort(grpc.StatusCode.NOT_FOUND, e.args[0])
+        except ValueError as e:  # E.g. a pixel buffer that does not match its shape.
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+        except RequestShed as e:
+            context.abort(e.code, str(e))
+
+    def ProcessSeries(self, request_iterator, context):
+        for request in request_iterator:
+            try:
+                with self.admit():
+                    image = self.process(request.image, context)
+            except KeyError as e:
+                context.abort(grpc.StatusCode.NOT_FOUND, e.args[0])
+            except ValueError as e:  # E.g. a pixel buffer that does not match its shape.
+                context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+            except RequestShed as e:
+                context.abort(e.code, str(e))
+            yield server_pb2.Slice(frame=request.frame, index=request.index, image=image)
+
+    def RegisterOverlay(self, request, context):
+        try:
+            with self.admit():
+                return server_pb2.OverlayId(id=self.register_overlay(request))
+        except ValueError as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+        except OverlayRegistryFull as e:
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, str(e))
+        except RequestShed as e:
+            context.abort(e.code, str(e))
+
+    @staticmethod
+    def overlay_kwargs(spec: server_pb2.OverlaySpec) -> dict:
+        """ The render keyword arguments of an overlay spec, using `RENDER_KWARGS` for unset fields.
+
+        Args:
+            spec (server_pb2.OverlaySpec): The spec.
+
+        Returns:
+            dict: Keyword arguments for `Text2Image.paste_text_in_array`.
+        """
+        kwargs = dict(RENDER_KWARGS)
+        for name in ("font_path", "font_size", "location", "scale", "offset", "remove_background",
+                     "align", "value", "bg_value"):
+            if spec.HasField(name):
+                kwargs[name] = getattr(spec, name)
+        if len(spec.color) > 0:
+            kwargs["color"] = tuple(spec.color)
+        if len(spec.bg_color) > 0:
+            kwargs["bg_color"] = tuple(spec.bg_color)
+        return kwargs
+
+    def register_overlay(self, spec: server_pb2.OverlaySpec) -> int:
+        """ Register an overlay that requests can then reference by ID (see `Image.overlay_id`).
+
+        Args:
+            spec (server_pb2.OverlaySpec): How to render the overlay.
+
+        Returns:
+            int: The ID.
+
+        Raises:
+            ValueError: When the overlay cannot be rendered, or uses a font the server does not
+                offer.
+            OverlayRegistryFull: When too many overlays are registered.
+        """
+        try:
+            overlay_id = self.overlays.register(spec.text or None, self.overlay_kwargs(spec),
+                                                fixed_size=spec.HasField("font_size"))
+        except OverlayRegistryFull:
+            self.metrics.increment("overlays_rejected")
+            raise
+        self.metrics.increment("overlays_registered")
+        return overlay_id
+
+    def GetOverlayPlacement(self, request, context):
+        return self.placement(request.rows, request.columns)
+
+    def ProcessPatch(self, request, context):
+        try:
+            with self.admit():
+                return self.process_patch(request, context)
+        except ValueError as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+        except RequestShed as e:
+            context.abort(e.code, str(e))
+
+    def check_call(self, context) -> None:
+        """ Shed a request whose client has gone away or whose deadline has passed.
+
+        Called between the stages of `process`, so abandoned work stops as early as possible.
+
+        Args:
+            context (grpc.ServicerContext | CallState): The call, or None to never shed.
+
+        Raises:
+            RequestShed: When the call was cancelled or its deadline has passed.
+        """
+        if context is None:
+            return
+        remaining = context.time_remaining()
+        if remaining is not None and remaining <= 0:  # Checked first: expired calls are inactive.
+            self.metrics.increment("shed_deadline_exceeded")
+            raise RequestShed(grpc.StatusCode.DEADLINE_EXCEEDED, "Deadline exceeded.")
+        if not context.is_active():
+            self.metrics.increment("shed_cancelled")
+            raise RequestShed(grpc.StatusCode.CANCELLED, "Call cancelled by the client.")
+
+    def placement(self, rows: int, columns: int) -> server_pb2.Placement:
+        """ Where the overlay is placed within an image.
+
+        Args:
+            rows (int): The number of rows in the image.
+            columns (int): The number of columns in the image.
+
+        Returns:
+            server_pb2.Placement: The region of the image changed by `process`.
+        """
+        left, top, region_columns, region_rows = \
+            self.text_2_image.text_region(self.data_loader.data, (rows, columns), **RENDER_KWARGS)
+        return server_pb2.Placement(left=left, top=top, columns=region_columns, rows=region_rows)
+
+    @profiled("Service.process_patch")
+    def process_patch(self, request: server_pb2.Patch, context=None) -> server_pb2.Image:
+        """ Process only a patch of an image (see `placement`).
+
+        Args:
+            request (server_pb2.Patch): The patch, its placement and the shape of the full image.
+            context (grpc.ServicerContext | CallState): The call, checked between stages (see
+                `check_call`). Default is None.
+
+        Returns:
+            server_pb2.Image: The processed patch.
+        """
+        with self.metrics.in_flight(), self.metrics.stage("process_patch"):
+            self.metrics.increment("patch_requests")
+            self.check_call(context)  # It may have waited in a queue for a while.
+            with self.metrics.stage("decode"):
+                patch = decode_image(request.image)
+            placement = request.placement
+            if request.image.overlay_id != 0:
+                raise ValueError("Registered overlays are not supported for patches.")
+            if patch.shape[0:2] != (placement.rows, placement.columns):
+                raise ValueError("Patch shape does not match its placement.")
+            self.metrics.increment("pixel_bytes_received", patch.nbytes)
+
+            with self.metrics.stage("load_text"):
+                text = self.data_loader.data
+
+            self.check_call(context)
+            with self.metrics.stage("render"):
+                new_patch = self.text_2_image.paste_text_in_patch(
+                    text, patch, (request.shape.rows, request.shape.columns),
+                    (placement.top, placement.left), in_place=True, **RENDER_KWARGS)
+
+            self.check_call(context)
+            with self.metrics.stage("encode"):
+                response = self.encode_response(new_patch, request.image)
+            self.metrics.increment("pixel_bytes_sent", new_patch.nbytes)
+            return response
+
+    def encode_response(self, array, request: server_pb2.Image) -> server_pb2.Image:
+        """ Encode a processed array the way the client asked for it.
+
+        Legacy requests get a legacy reply. Otherwise, the pixels are compressed when the client
+        accepts it and they reach `compress_threshold` bytes.
+
+        Args:
+            array (NDArray): The processed array.
+            request (server_pb2.Image): The request the array came from.
+
+        Returns:
+            server_pb2.Image: The reply.
+        """
+        compress = (request.accept_compressed and self.compress_threshold is not None
+                    and array.nbytes >= self.compress_threshold)
+        if compress:
+            self.metrics.increment("compressed_replies")
+        return server_pb2.Image(**encode_array(array, legacy=uses_legacy_field(request),
+                                               compress=compress))
+
+    def Health(self, request, context):
+        return self.health()
+
+    def health(self) -> server_pb2.HealthStatus:
+        """ Whether the service is serving, and its current load.
+
+        Returns:
+            server_pb2.HealthStatus: The status.
+        """
+        gauges = self.metrics.snapshot()["gauges"]
+        return server_pb2.HealthStatus(serving=True, in_flight=gauges.get("in_flight", 0),
+                                       pending=gauges.get("pending", 0))
+
+    def GetStats(self, request, context):
+        return self.stats(include_text=request.include_text, reset=request.reset)
+
+    def stats(self, include_text: bool = False, reset: bool = False) -> server_pb2.Stats:
+        """ A snapshot of the service metrics.
+
+        When `memory_profiler` is enabled, the largest peak of each profiled call and stage is
+        included as a "peak_bytes:<name>" gauge.
+
+        Args:
+            include_text (bool): Whether to include a human-readable summary. Default is False.
+            reset (bool): Whether to clear the histograms and counters afterwards. Default is False.
+
+        Returns:
+            server_pb2.Stats: The snapshot.
+        """
+        snapshot = self.metrics.snapshot()
+        stats = server_pb2.Stats(counters=snapshot["counters"], gauges=snapshot["gauges"])
+        for name, (count, total, bounds, counts) in sorted(snapshot["stages"].items()):
+            stats.stages.add(name=name, count=count, total_seconds=total, bounds=bounds,
+                             counts=counts)
+        for name, peaks in memory_profiler.snapshot().items():  # Empty unless profiling.
+            stats.gauges[f"peak_bytes:{name}"] = peaks["max"]
+        if include_text:
+            stats.text = "\n".join(text for text in (self.metrics.to_text(),
+                                                     memory_profiler.to_text()) if text)
+        if reset:
+            self.metrics.reset()
+            memory_profiler.reset()
+        return stats
+
+    @profiled("Service.process")
+    def process(self, request, context=None):
+        with self.metrics.in_flight(), self.metrics.stage("process"):
+            self.metrics.increment("requests")
+            self.check_call(context)  # Skip work nobody is waiting for (see `check_call`).
+
+            # Convert to numpy array (raw pixel buffer if present, otherwise the legacy float field)
+            with self.metrics.stage("decode"), memory_profiler.profile("Service.process/decode"):
+                array = decode_image(request)
+            self.metrics.increment("pixel_bytes_received", array.nbytes)
+
+            # Get the data to add
+            with self.metrics.stage("load_text"):
+                text = self.data_loader.data
+
+            # Process the image
+            self.check_call(context)
+            with self.metrics.stage("render"), memory_profiler.profile("Service.process/render"):
+                if request.overlay_id != 0:  # Pre-rendered, so there is no need for the pool.
+                    new_array = self.overlays.paste(request.overlay_id, array, text, in_place=True)
+                elif self.render_pool is not None:
+                    new_array = self.render_pool.paste_text_in_array(text, array, **RENDER_KWARGS)
+                else:
+                    new_array = self.text_2_image.paste_text_in_array(text, array, engine="numpy",
+                                                                      in_place=True,
+                                                                      **RENDER_KWARGS)
+
+            # Return the processed image, encoded the same way as the request
+            self.check_call(context)
+            with self.metrics.stage("encode"), memory_profiler.profile("Service.process/encode"):
+                response = self.encode_response(new_array, request)
+            self.metrics.increment("pixel_bytes_sent", new_array.nbytes)
+            return response
+
+
+class AsyncService(server_pb2_grpc.ServiceServicer):
+    """ An asyncio (grpc.aio) front end to `Service`.
+
+    The event loop only handles I/O, while the CPU-bound image processing is run on a dedicated
+    executor, so slow clients do not tie up processing threads.
+
+    Properties:
+        service (Service): The service that processes the images.
+        executor (futures.Executor): The executor used to process the images.
+        max_pending (int): The most calls waiting for, or running on, the executor. Further calls
+            are rejected with RESOURCE_EXHAUSTED straight away. Default is None (unlimited).
+    """
+    def __init__(self, service: Service, executor: futures.Executor, max_pending: int = None):
+        self.service = service
+        self.executor = executor
+        self.max_pending = max_pending
+        self.pending = 0  # Only changed on the event loop, so no lock is needed.
+
+    async def _run(self, context, function, *args):
+        """ Run a function on the executor, unless too many calls are already waiting for it.
+        """
+        if self.max_pending is not None and self.pending >= self.max_pending:
+            self.service.metrics.increment("shed_queue_full")
+            await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED,
+                                "Server is busy, try again later.")
+        self.pending += 1
+        self.service.metrics.add_to_gauge("pending", 1)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+        finally:
+            self.pending -= 1
+            self.service.metrics.add_to_gauge("pending", -1)
+
+    async def ProcessImage(self, request, context):
+        try:
+            return await self._run(context, self.service.process, request, CallState(context))
+        except KeyError as e:
+            await context.abort(grpc.StatusCode.NOT_FOUND, e.args[0])
+        except ValueError as e:  # E.g. a pixel buffer that does not match its shape.
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+        except RequestShed as e:
+            await context.abort(e.code, str(e))
+
+    async def ProcessSeries(self, request_iterator, context):
+        call = CallState(context)
+        async for request in request_iterator:
+            try:
+                image = await self._run(context, self.service.process, request.image, call)
+            except KeyError as e:
+                await context.abort(grpc.StatusCode.NOT_FOUND, e.args[0])
+            except ValueError as e:  # E.g. a pixel buffer that does not match its shape.
+                await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+            except RequestShed as e:
+                await context.abort(e.code, str(e))
+            yield server_pb2.Slice(frame=request.frame, index=request.index, image=image)
+
+    async def GetStats(self, request, context):
+        return self.service.GetStats(request, context)
+
+    async def Health(self, request, context):
+        return self.service.health()  # Cheap, and must answer even when the executor is busy.
+
+    async def RegisterOverlay(self, request, context):
+        try:
+            overlay_id = await self._run(context, self.service.register_overlay, request)
+            return server_pb2.OverlayId(id=overlay_id)
+        except ValueError as e:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+        except OverlayRegistryFull as e:
+            await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, str(e))
+
+    async def GetOverlayPlacement(self, request, context):
+        return await self._run(context, self.service.placement, request.rows, request.columns)
+
+    async def ProcessPatch(self, request, context):
+        try:
+            return await self._run(context, self.service.process_patch, request,
+                                   CallState(context))
+        except ValueError as e:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+        except RequestShed as e:
+            await context.abort(e.code, str(e))
+
+
+def create_async_server(service: Service, ip_address: str = "127.0.0.1", port: int = 50051,
+                        max_concurrent_rpcs: int = None, render_workers: int = None,
+                        max_message_length: int = 256 * 1024 ** 2,
+                        compression: grpc.Compression = None,
+                        max_queue_depth: int = None) -> Tuple[grpc.aio.Server, int]:
+    """ Create (but do not start) an asyncio gRPC server for a service.
+
+    Args:
+        service (Service): The service that processes the images.
+        ip_address (str): The address to listen on. Default is "127.0.0.1".
+        port (int): The port to listen on. Use 0 to pick a free port. Default is 50051.
+        max_concurrent_rpcs (int): The maximum number of RPCs handled at once; further RPCs are
+            rejected with RESOURCE_EXHAUSTED. Default is None (unlimited).
+        render_workers (int): The number of threads used to process images. Default is None, in
+            which case the number of CPUs is used.
+        max_message_length (int): The largest message that may be sent or received (bytes).
+            Default is 256 MB.
+        compression (grpc.Compression): The default compression of replies (e.g.
+            grpc.Compression.Gzip), used for clients that accept it. Default is None.
+        max_queue_depth (int): The most calls waiting for a free render worker; further calls are
+            rejected with RESOURCE_EXHAUSTED. Default is None (unlimited).
+
+    Returns:
+        Tuple[grpc.aio.Server, int]: The server and the port it is bound to.
+    """
+    render_workers = render_workers or os.cpu_count()
+    executor = futures.ThreadPoolExecutor(max_workers=render_workers, thread_name_prefix="render")
+    server = grpc.aio.server(maximum_concurrent_rpcs=max_concurrent_rpcs,
+                             options=server_options(max_message_length), compression=compression)
+    max_pending = None if max_queue_depth is None else render_workers + max_queue_depth
+    server_pb2_grpc.add_ServiceServicer_to_server(AsyncService(service, executor, max_pending),
+                                                  server)
+    port = server.add_insecure_port(f'{ip_address}:{port}')
+    return server, port
+
+
+def create_service(cache_bytes: int = 64 * 1024 ** 2, processes: int = 0,
+                   compress_threshold: int = None, store_bytes: int = 256 * 1024 ** 2,
+                   max_active: int = None, max_pending: int = None) -> Service:
+    """ Create a service with its fonts and data loaded ahead of the first request.
 
-    def process(self, request):
-        # Log the received image details
-        print(
-            f"Received Image: {request.rows}x{request.columns} with data size {len(request.image)}")
+    Args:
+        cache_bytes (int): The byte budget of the rendered text cache. Default is 64 MB.
+        processes (int): The number of worker processes used to render. Default is 0, in which
+            case images are rendered in the server threads.
+        compress_threshold (int): The pixel bytes above which replies are delta-deflated (see
+            `Service.encode_response`). Default is None (never).
+        store_bytes (int): The byte budget of the on-disk store of rendered text, which is shared
+            with the worker processes. Default is 256 MB. Use 0 to disable it.
+        max_active (int): The most (sync) calls processed at once. Default is None (unlimited).
+        max_pending (int): The most (sync) calls waiting or being processed; further calls are
+            rejected with RESOURCE_EXHAUSTED (see `Service.admit`). Default is None (unlimited).
 
-        # Convert to numpy array
-        array = np.array(request.image).reshape(request.rows, request.columns)
+    Returns:
+        Service: The service.
+    """
+    font_registry.preload(FONTS)  # Keep font loading out of the first request.
+    if processes > 0:
+        data_loader = DataLoader()
+        data_loader.prefetch(background=False)  # The workers are pre-warmed with the text.
+        render_pool = RenderPool(processes, fonts=FONTS, cache_bytes=cache_bytes,
+                                 text=data_loader.data, render_kwargs=RENDER_KWARGS,
+                                 store_directory=data_loader.overlay_directory,
+                                 store_bytes=store_bytes, direct_size=True)
+        render_pool.warm_up()
+    else:
+        render_pool = None
+    service = Service(cache_bytes=cache_bytes, render_pool=render_pool,
+                      compress_threshold=compress_threshold, store_bytes=store_bytes,
+                      max_active=max_active, max_pending=max_pending)
+    service.data_loader.prefetch()  # Download the data before the first request needs it.
+    return service
 
-        # Get the data to add
-        text = self.data_loader.data
 
-        # Process the image
-        t2i = Text2Image()
-        new_array = t2i.paste_text_in_array(text,
-                                            array,
-                                            location=3,  # Top left
-                                            scale=0.75,
-                                            offset=0.05,
-                                            remove_background=False,
-                                            align="left",
-                                            font_path="GillSans.ttc",
-                                            value=4095,
-                                            bg_value=0)
+async def serve_async(ip_address: str = "127.0.0.1", port: int = 50051,
+                      cache_bytes: int = 64 * 1024 ** 2, max_concurrent_rpcs: int = None,
+                      render_workers: int = None, processes: int = 0,
+                      compression: grpc.Compression = None, compress_threshold: int = None,
+                      store_bytes: int = 256 * 1024 ** 2, max_queue_depth: int = None):
+    """ Run the server with asyncio (see `create_async_server` and `create_service`).
+    """
+    service = create_service(cache_bytes, processes, compress_threshold, store_bytes)
+    server, port = create_async_server(service, ip_address, port, max_concurrent_rpcs,
+                                       render_workers, compression=compression,
+                                       max_queue_depth=max_queue_depth)
+    await server.start()
+    print(f"Server (asyncio) is running on port {port}...")
+    await server.wait_for_termination()
 
-        # Create a list
-        flat_list = new_array.ravel().tolist()
 
-        # Return the processed image
-        return server_pb2.Image(rows=request.rows, columns=request.columns, image=flat_list)
+def serve(ip_address: str = "127.0.0.1", port: int = 50051, cache_bytes: int = 64 * 1024 ** 2,
+          max_workers: int = 10, use_asyncio: bool = False, max_concurrent_rpcs: int = None,
+          processes: int = 0, compression: grpc.Compression = None, compress_threshold: int = None,
+          store_bytes: int = 256 * 1024 ** 2, max_queue_depth: int = 32):
+    """ Run the server until it is terminated.
 
+    Args:
+        ip_address (str): The address to listen on. Default is "127.0.0.1".
+        port (int): The port to listen on. Default is 50051.
+        cache_bytes (int): The byte budget of the rendered text cache. Default is 64 MB.
+        max_workers (int): The number of threads used to handle (or, with asyncio, process)
+            requests. Default is 10.
+        use_asyncio (bool): Whether to run a grpc.aio server (see `serve_async`). Default is False.
+        max_concurrent_rpcs (int): The maximum number of RPCs handled at once, rejecting the rest
+            before they reach the service. Default is None (unlimited).
+        processes (int): The number of worker processes used to render. Default is 0, in which
+            case images are rendered in the server threads.
+        compression (grpc.Compression): The default compression of replies (e.g.
+            grpc.Compression.Gzip), used for clients that accept it. Default is None.
+        compress_threshold (int): The pixel bytes above which replies are delta-deflated, for
+            clients that accept it. Default is None (never).
+        store_bytes (int): The byte budget of the on-disk store of rendered text, kept in the
+            package data directory. Default is 256 MB. Use 0 to disable it.
+        max_queue_depth (int): The most requests waiting for a free worker. Further requests are
+            rejected with RESOURCE_EXHAUSTED straight away, rather than queueing behind work that
+            may outlive their deadline. Default is 32. Use None for an unbounded queue.
+    """
+    if use_asyncio:
+        asyncio.run(serve_async(ip_address, port, cache_bytes, max_concurrent_rpcs, max_workers,
+                                processes, compression, compress_threshold, store_bytes,
+                                max_queue_depth))
+        return
 
-def serve(ip_address: str = "127.0.0.1", port: int = 50051):
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    server_pb2_grpc.add_ServiceServicer_to_server(Service(), server)
+    # The service admits `max_workers` calls at a time and queues up to `max_queue_depth` more
+    # (see `Service.admit`), counting those it sheds. Every queued call holds a thread, and the
+    # spare threads answer Health checks and rejections while the others are busy.
+    threads = max_workers
+    max_pending = None
+    if max_queue_depth is not None:
+        max_pending = max_workers + max_queue_depth
+        threads = max_pending + SPARE_THREADS
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=threads),
+                         maximum_concurrent_rpcs=max_concurrent_rpcs, options=server_options(),
+                         compression=compression)
+    service = create_service(cache_bytes, processes, compress_threshold, store_bytes,
+                             max_active=max_workers, max_pending=max_pending)
+    server_pb2_grpc.add_ServiceServicer_to_server(service, server)
     server.add_insecure_port(f'{ip_address}:{port}')
     server.start()
     print(f"Server is running on port {port}...")
@@ -53,4 +647,4 @@ def serve(ip_address: str = "127.0.0.1", port: int = 50051):
 
 
 if __name__ == "__main__":
-    serve()
\ No newline at end of file
+    serve()
@@ -1 +1,15 @@
-from pyosirix_example.utilities import text_2_image
+import importlib
+
+# Loaded on first access (see pyosirix_example/__init__.py).
+_submodules = ("font_registry", "glyph_atlas", "memory_profile", "overlay_cache", "overlay_store",
+               "pixel_codec", "text_2_image")
+
+
+def __getattr__(name: str):
+    if name in _submodules:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_submodules))
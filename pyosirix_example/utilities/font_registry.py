@@ -0,0 +1,201 @@
+""" A process-wide registry of loaded TrueType fonts """
+
+from collections import OrderedDict
+import threading
+from typing import Hashable, Iterable, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+from pyosirix_example.utilities.glyph_atlas import GlyphAtlas
+
+# The font size at which text is first measured by `FontRegistry.font_size_for_width`.
+REFERENCE_SIZE = 100
+
+
+class FontRegistry:
+    """ Loads each TrueType font (path and size) once and shares it for the life of the process.
+
+    Text measurements (see `text_width` and `font_size_for_width`) are kept in tables of at most
+    `max_measurements` entries each, forgetting the least recently used, so that rendering many
+    different strings (e.g. one per slice) does not grow them without limit. Likewise, at most
+    `max_fonts` fonts are kept loaded only for measuring, and at most `max_atlases` glyph atlases,
+    as text sized to fit a width (see `Text2Image.direct_size`) uses many font sizes.
+
+    Properties:
+        default_font_path (str): The font used when no path is given. Default is "Arial.ttf".
+        max_measurements (int): The number of widths, and of font sizes, remembered. Default is
+            4096.
+        max_fonts (int): The number of fonts kept loaded for measuring only. Default is 64.
+        max_atlases (int): The number of glyph atlases kept. Default is 16.
+    """
+
+    def __init__(self, default_font_path: str = "Arial.ttf", max_measurements: int = 4096,
+                 max_fonts: int = 64, max_atlases: int = 16):
+        self.default_font_path = default_font_path
+        self.max_measurements = max_measurements
+        self.max_fonts = max_fonts
+        self.max_atlases = max_atlases
+        self._fonts = {}
+        # Least recently used last. Text width (pixels), keyed by (font_path, text, align, size).
+        self._widths = OrderedDict()
+        self._sizes = OrderedDict()  # Font size, keyed by (font_path, text, align, columns).
+        self._measuring_fonts = OrderedDict()  # Font, keyed by (font_path, font_size).
+        self._atlases = OrderedDict()  # Glyph atlas, keyed by (font_path, font_size).
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._fonts)
+
+    def get(self, font_path: str = None, font_size: float = 40) -> ImageFont.FreeTypeFont:
+        """ Get a font, loading it from disk only the first time it is requested.
+
+        Args:
+            font_path (str, optional): A path to a font file. Defaults to None in which case
+                `default_font_path` is used.
+            font_size (float, optional): A font size. Defaults to 40.
+
+        Returns:
+            ImageFont.FreeTypeFont: The font.
+        """
+        key = (font_path or self.default_font_path, font_size)
+        font = self._fonts.get(key)
+        if font is None:
+            with self._lock:
+                font = self._fonts.get(key)
+                if font is None:
+                    font = ImageFont.truetype(key[0], font_size)
+                    self._fonts[key] = font
+        return font
+
+    def atlas(self, font_path: str = None, font_size: float = 40) -> GlyphAtlas:
+        """ Get the glyph atlas of a font, rasterising its glyphs only the first time.
+
+        Args:
+            font_path (str, optional): A path to a font file. Defaults to None in which case
+                `default_font_path` is used.
+            font_size (float, optional): A font size. Defaults to 40.
+
+        Returns:
+            GlyphAtlas: The atlas.
+        """
+        key = (font_path or self.default_font_path, font_size)
+        atlas = self._recall(self._atlases, key)
+        if atlas is None:
+            atlas = GlyphAtlas(self.get(font_path, font_size))
+            self._remember(self._atlases, key, atlas, self.max_atlases)
+        return atlas
+
+    def _measuring_font(self, font_path: str, font_size: float) -> ImageFont.FreeTypeFont:
+        """ A font to measure text with: the loaded one if any, otherwise one kept in an LRU table
+        (see `max_fonts`), so sizes that are only measured are not kept loaded for good.
+        """
+        key = (font_path, font_size)
+        font = self._fonts.get(key) or self._recall(self._measuring_fonts, key)
+        if font is None:
+            font = ImageFont.truetype(font_path, font_size)
+            self._remember(self._measuring_fonts, key, font, self.max_fonts)
+        return font
+
+    def _recall(self, table: OrderedDict, key: Hashable):
+        """ Look up a measurement, marking it as recently used. None if not present.
+        """
+        with self._lock:
+            value = table.get(key)
+            if value is not None:
+                table.move_to_end(key)
+            return value
+
+    def _remember(self, table: OrderedDict, key: Hashable, value, max_entries: int = None) -> None:
+        """ Keep a measurement, forgetting the least recently used beyond `max_entries` (by default
+        `max_measurements`).
+        """
+        if max_entries is None:
+            max_entries = self.max_measurements
+        with self._lock:
+            table[key] = value
+            table.move_to_end(key)
+            while len(table) > max_entries:
+                table.popitem(last=False)
+
+    def text_width(self, text: str, font_path: str = None, font_size: int = 40,
+                   align: str = "left") -> int:
+        """ The width of the ink of a (multiline) text string, measured once per font and size.
+
+        Args:
+            text (str): The text.
+            font_path (str, optional): A path to a font file. Defaults to None in which case
+                `default_font_path` is used.
+            font_size (int, optional): A font size. Defaults to 40.
+            align (str, optional): One of "left", "center", or "right".
+
+        Returns:
+            int: The width (pixels).
+        """
+        key = (font_path or self.default_font_path, text, align, font_size)
+        width = self._recall(self._widths, key)
+        if width is None:
+            font = self._measuring_font(key[0], font_size)
+            draw = ImageDraw.Draw(Image.new("L", (1, 1)))
+            left, _, right, _ = draw.multiline_textbbox((0, 0), text, anchor="la", align=align,
+                                                        font=font)
+            width = int(right - left)
+            self._remember(self._widths, key, width)
+        return width
+
+    def font_size_for_width(self, text: str, columns: int, font_path: str = None,
+                            align: str = "left", max_size: int = 1000) -> int:
+        """ The largest font size at which a text string is no wider than a number of columns.
+
+        Widths are close to proportional to the font size, so the text is measured at
+        `REFERENCE_SIZE`, scaled to the target width, and then only the sizes either side of the
+        estimate are measured. The result is remembered (see `max_measurements`).
+
+        Args:
+            text (str): The text.
+            columns (int): The target width (pixels).
+            font_path (str, optional): A path to a font file. Defaults to None in which case
+                `default_font_path` is used.
+            align (str, optional): One of "left", "center", or "right".
+            max_size (int, optional): The largest font size considered. Defaults to 1000.
+
+        Returns:
+            int: The font size (at least 1).
+        """
+        key = (font_path or self.default_font_path, text, align, columns)
+        size = self._recall(self._sizes, key)
+        if size is None:
+            reference = self.text_width(text, font_path, REFERENCE_SIZE, align)
+            if reference == 0:
+                size = max_size  # No ink, so any size fits.
+            else:
+                size = min(max(int(columns * REFERENCE_SIZE / reference), 1), max_size)
+                # Hinting makes widths slightly non-linear, so step to the exact answer.
+                while size > 1 and self.text_width(text, font_path, size, align) > columns:
+                    size -= 1
+                while size < max_size and \
+                        self.text_width(text, font_path, size + 1, align) <= columns:
+                    size += 1
+            self._remember(self._sizes, key, size)
+        return size
+
+    def preload(self, fonts: Iterable[Tuple[str, float]]) -> None:
+        """ Load a list of fonts ahead of time (for example, when a server starts).
+
+        Args:
+            fonts (Iterable[Tuple[str, float]]): The (font_path, font_size) pairs to load.
+        """
+        for font_path, font_size in fonts:
+            self.get(font_path, font_size)
+
+    def clear(self) -> None:
+        """ Forget all loaded fonts, glyph atlases and measured sizes.
+        """
+        with self._lock:
+            self._fonts.clear()
+            self._measuring_fonts.clear()
+            self._atlases.clear()
+            self._widths.clear()
+            self._sizes.clear()
+
+
+font_registry = FontRegistry()  # Shared by all Text2Image instances in this process.
@@ -0,0 +1,208 @@
+""" Fast text rendering by composing glyphs rasterised once into a Numpy atlas """
+
+import math
+import string
+import threading
+from typing import Iterable, List, NamedTuple
+
+from PIL import Image, ImageDraw, ImageFont
+import numpy as np
+from numpy.typing import NDArray
+
+# Glyphs rasterised when an atlas is created. Others are added the first time they are used.
+DEFAULT_CHARACTERS = string.digits + string.ascii_letters + string.punctuation + " "
+
+# The extra space between lines of multiline text, as used by Pillow.
+LINE_SPACING = 4
+
+# The transparency (1 - coverage) of each coverage value.
+TRANSPARENCY = 1 - np.arange(256) / 255
+
+
+class _Glyph(NamedTuple):
+    """ A rasterised glyph.
+    """
+    tile: NDArray  # The transparency (1 - coverage), trimmed to the ink. Empty if there is none.
+    top: int  # The top row of `tile`, relative to the top of the line.
+    left: int  # The first column of `tile`, relative to the pen position.
+    advance: float  # The advance (pixels).
+
+
+class GlyphAtlas:
+    """ Renders text strings in one font and size from glyphs rasterised once into a Numpy atlas.
+
+    Each glyph is drawn by Pillow once, and kept as a small tile of its transparency (1 - coverage)
+    trimmed to its ink, along with its position and advance. A string is then laid out with the
+    advances (and Pillow's kerning, line spacing and alignment) and each tile is multiplied into the
+    result with a slice operation, so strings that were never seen before (such as slice numbers or
+    timestamps) cost a fraction of a full rasterisation. The result matches
+    `ImageDraw.multiline_text` drawn at the origin and trimmed to its ink (see
+    `Text2Image.text_to_image`), although Pillow may differ by a pixel for fonts whose hinting
+    depends on the position of a glyph.
+
+    Properties:
+        font (ImageFont.FreeTypeFont): The font (and size) of the glyphs.
+        characters (Iterable[str]): The glyphs rasterised straight away. Default is the digits,
+            ASCII letters, punctuation and space.
+        line_spacing (int): The distance between the tops of consecutive lines (pixels).
+    """
+
+    def __init__(self, font: ImageFont.FreeTypeFont,
+                 characters: Iterable[str] = DEFAULT_CHARACTERS):
+        self.font = font
+        self.line_spacing = font.getbbox("A", anchor="la")[3] + LINE_SPACING
+        self._glyphs = {}  # Glyph, keyed by character.
+        self._kerning = {}  # The advance adjustment (pixels), keyed by pair of characters.
+        self._lock = threading.Lock()
+        self.add(characters)
+
+    def __len__(self) -> int:
+        return len(self._glyphs)
+
+    def __contains__(self, character: str) -> bool:
+        return character in self._glyphs
+
+    @property
+    def nbytes(self) -> int:
+        """ The memory used by the tiles of the atlas (bytes).
+        """
+        return sum(glyph.tile.nbytes for glyph in list(self._glyphs.values()))
+
+    def _rasterise(self, character: str) -> _Glyph:
+        """ Draw a single glyph with Pillow.
+        """
+        left, top, right, bottom = self.font.getbbox(character, anchor="la")
+        tile = np.ones((0, 0))
+        if right > left and bottom > top:
+            image = Image.new("L", (right - left, bottom - top), 0)
+            ImageDraw.Draw(image).text((-left, -top), character, fill=255, font=self.font,
+                                       anchor="la")
+            ink = image.getbbox()
+            if ink is not None:
+                tile = TRANSPARENCY[np.asarray(image.crop(ink))]
+                left, top = left + ink[0], top + ink[1]
+        return _Glyph(tile, top, left, self.font.getlength(character))
+
+    def add(self, characters: Iterable[str]) -> None:
+        """ Rasterise glyphs into the atlas, if not already present.
+
+        Args:
+            characters (Iterable[str]): The characters (newlines are ignored).
+        """
+        with self._lock:
+            for character in dict.fromkeys(characters):
+                if character not in self._glyphs and character != "\n":
+                    self._glyphs[character] = self._rasterise(character)
+
+    def _lookup(self, text: str) -> List[_Glyph]:
+        """ The glyphs of the characters in a line of text, adding any missing glyphs.
+        """
+        glyphs = self._glyphs
+        try:
+            return [glyphs[c] for c in text]
+        except KeyError:
+            self.add(text)
+            return [glyphs[c] for c in text]
+
+    def _line_kerning(self, line: str) -> List[float]:
+        """ The kerning between each character of a line and the next (0 for the last one).
+        """
+        kerning = self._kerning
+        adjustments = []
+        for pair in zip(line, line[1:]):
+            adjustment = kerning.get(pair)
+            if adjustment is None:  # Measured once per pair.
+                adjustment = self.font.getlength(pair[0] + pair[1]) - \
+                    self.font.getlength(pair[0]) - self.font.getlength(pair[1])
+                kerning[pair] = adjustment
+            adjustments.append(adjustment)
+        if len(line) > 0:
+            adjustments.append(0.0)
+        return adjustments
+
+    def text_length(self, text: str) -> float:
+        """ The advance (pixels) of a single line of text, as `ImageFont.FreeTypeFont.getlength`.
+
+        Args:
+            text (str): The text (without newlines).
+
+        Returns:
+            float: The advance.
+        """
+        return sum(glyph.advance for glyph in self._lookup(text)) + sum(self._line_kerning(text))
+
+    def render(self, text: str, align: str = "left") -> NDArray:
+        """ Render a (multiline) text string, trimmed to its ink.
+
+        Args:
+            text (str): The text.
+            align (str, optional): One of "left", "center", or "right". Default is "left".
+
+        Returns:
+            NDArray: The coverage of the text (uint8, 0 to 255), with shape (rows, columns). A
+                single zero pixel if the text has no ink.
+
+        Raises:
+            ValueError: When `align` is not valid.
+        """
+        if align not in ("left", "center", "right"):
+            raise ValueError("Align must be left, center, or right.")
+        lines = text.split("\n")
+
+        # Lay out each line: the pen position of each glyph with ink, and the advance of the line.
+        line_glyphs, line_widths = [], []
+        for line in lines:
+            placed, pen = [], 0.0
+            for glyph, kerning in zip(self._lookup(line), self._line_kerning(line)):
+                if glyph.tile.size > 0:
+                    placed.append((glyph, pen))
+                pen += glyph.advance + kerning
+            line_glyphs.append(placed)
+            line_widths.append(pen)
+
+        # Align the lines, and position each tile like FreeType: in 1/64 pixels, then rounded.
+        width = max(line_widths)
+        tiles = []  # (tile, top, left) of each glyph with ink.
+        top = left = math.inf
+        clipped = False
+        bottom = right = -math.inf
+        for line_index, placed in enumerate(line_glyphs):
+            line_x = 0.0
+            if align == "center":
+                line_x = (width - line_widths[line_index]) / 2
+            elif align == "right":
+                line_x = width - line_widths[line_index]
+            line_x_64 = math.floor(line_x * 64 + 0.5) + 32
+            y = line_index * self.line_spacing
+            for glyph, pen in placed:
+                tile_top = glyph.top + y
+                tile_left = glyph.left + math.floor((line_x_64 + pen * 64) / 64)
+                tile = glyph.tile
+                if tile_top < 0 or tile_left < 0:  # Clip any ink before the origin, as Pillow.
+                    tile = tile[max(-tile_top, 0):, max(-tile_left, 0):]
+                    if tile.size == 0:
+                        continue
+                    tile_top, tile_left = max(tile_top, 0), max(tile_left, 0)
+                    clipped = True
+                tiles.append((tile, tile_top, tile_left))
+                top, left = min(top, tile_top), min(left, tile_left)
+                bottom = max(bottom, tile_top + tile.shape[0])
+                right = max(right, tile_left + tile.shape[1])
+        if len(tiles) == 0:
+            return np.zeros((1, 1), dtype=np.uint8)
+
+        # Where glyphs overlap, Pillow's coverage is 1 - (1 - a) * (1 - b), so multiply the
+        # transparencies of the tiles, then round the coverage once.
+        transparency = np.ones((bottom - top, right - left))
+        for tile, tile_top, tile_left in tiles:
+            row, column = tile_top - top, tile_left - left
+            transparency[row:row + tile.shape[0], column:column + tile.shape[1]] *= tile
+        transparency *= -255
+        transparency += 255.5
+        coverage = transparency.astype(np.uint8)
+        if clipped:  # What is left of a clipped tile may not reach its edges.
+            rows, columns = np.nonzero(coverage)
+            if rows.size == 0:
+                return np.zeros((1, 1), dtype=np.uint8)
+            coverage = coverage[rows.min():rows.max() + 1, columns.min():columns.max() + 1]
+        return coverage
@@ -0,0 +1,288 @@
+""" Opt-in peak-memory profiling of the rendering and processing hot paths """
+
+from contextlib import contextmanager
+import functools
+import os
+import threading
+import tracemalloc
+from typing import Callable, Dict, Iterator, List, Tuple
+import weakref
+
+from PIL import Image
+
+# Set to "1" to enable the process-wide profiler at import time (see `memory_profiler`).
+ENVIRONMENT_VARIABLE = "PYOSIRIX_EXAMPLE_PROFILE_MEMORY"
+
+# The enabled profilers, which are told about every Pillow image buffer (see `_hook_pillow`).
+_pillow_profilers: List["MemoryProfiler"] = []
+_pillow_originals = None  # Pillow's own (Image._new, frombuffer) while they are wrapped.
+_pillow_lock = threading.Lock()
+
+
+def _image_bytes(image: Image.Image) -> int:
+    """ The size of the buffer Pillow allocated for an image (bytes).
+
+    Pillow stores multi-band pixels (e.g. "RGB") in 4 bytes, as it does "I" and "F" pixels.
+    """
+    columns, rows = image.im.size
+    mode = image.im.mode
+    if image.im.bands > 1 or mode in ("I", "F"):
+        pixel_bytes = 4
+    elif mode.startswith("I;16"):
+        pixel_bytes = 2
+    else:
+        pixel_bytes = 1
+    return columns * rows * pixel_bytes
+
+
+def _release_image(sessions: Tuple[Tuple["MemoryProfiler", int], ...], nbytes: int,
+                   fold: bool = True) -> None:
+    """ Stop counting an image buffer (see `_count_image`).
+    """
+    for profiler, session in sessions:
+        profiler._add_pillow_bytes(-nbytes, session, fold)
+
+
+def _count_image(image: Image.Image) -> Image.Image:
+    """ Count a new Pillow image buffer towards the enabled profilers until the image is freed.
+    """
+    nbytes = _image_bytes(image)
+    sessions = tuple((profiler, profiler._pillow_session) for profiler in _pillow_profilers)
+    if nbytes > 0 and sessions:
+        for profiler, session in sessions:
+            profiler._add_pillow_bytes(nbytes, session)
+        image._memory_profiler_release = weakref.finalize(image, _release_image, sessions, nbytes)
+    return image
+
+
+def _uncount_image(image: Image.Image) -> None:
+    """ Take back the count of an image that turned out to share the memory of its data.
+    """
+    release = getattr(image, "_memory_profiler_release", None)
+    info = release.detach() if release is not None else None
+    if info is not None:
+        _, _, args, _ = info
+        _release_image(*args, fold=False)  # Never allocated, so it is not part of any peak.
+
+
+def _hook_pillow(profiler: "MemoryProfiler") -> None:
+    """ Tell a profiler about Pillow's image buffers, which `tracemalloc` does not see.
+
+    Pillow wraps every new image buffer (from `Image.new`, `copy`, `crop`, `resize` and so on) with
+    `Image._new`, which is wrapped in turn while any profiler is enabled. Images made by
+    `frombuffer` (and so `fromarray`) may share the memory of their data instead, which is then
+    not counted again.
+    """
+    global _pillow_originals
+    with _pillow_lock:
+        if profiler in _pillow_profilers:
+            return
+        _pillow_profilers.append(profiler)
+        if _pillow_originals is not None:
+            return
+        new, frombuffer = Image.Image._new, Image.frombuffer
+
+        @functools.wraps(new)
+        def counted_new(self, im):
+            return _count_image(new(self, im))
+
+        @functools.wraps(frombuffer)
+        def counted_frombuffer(*args, **kwargs):
+            image = frombuffer(*args, **kwargs)
+            if image.readonly:  # Shares the memory of its data, which was counted when allocated.
+                _uncount_image(image)
+            return image
+
+        Image.Image._new, Image.frombuffer = counted_new, counted_frombuffer
+        _pillow_originals = (new, frombuffer)
+
+
+def _unhook_pillow(profiler: "MemoryProfiler") -> None:
+    """ Stop telling a profiler about Pillow's image buffers, restoring Pillow once none is left.
+    """
+    global _pillow_originals
+    with _pillow_lock:
+        if profiler in _pillow_profilers:
+            _pillow_profilers.remove(profiler)
+        if len(_pillow_profilers) == 0 and _pillow_originals is not None:
+            Image.Image._new, Image.frombuffer = _pillow_originals
+            _pillow_originals = None
+
+
+class _Frame:
+    """ An open profiled block: the memory in use when it started and the highest seen since.
+    """
+    __slots__ = ("start", "peak")
+
+    def __init__(self, start: int):
+        self.start = start
+        self.peak = start
+
+
+class MemoryProfiler:
+    """ Records the peak memory allocated by named blocks (calls and stages), using `tracemalloc`.
+
+    Blocks may be nested: each reports its own peak above the memory in use when it started, so a
+    stage within a call is reported separately from the call as a whole. The memory in use covers
+    the whole process, so a block's peak includes anything allocated by other threads while it
+    runs (which is what matters when memory blows up under concurrency).
+
+    `tracemalloc` sees Python objects and Numpy arrays (including every `np.array(image)`
+    conversion), but not the buffers that Pillow allocates in C, such as its canvases. While
+    enabled, the profiler therefore also counts the buffer of every Pillow image until the image
+    is freed (see `_hook_pillow`), and adds them to the traced memory. Pillow is restored when
+    the profiler is disabled.
+
+    Tracing slows allocation down considerably, so profiling is off unless enabled. While
+    disabled, `profile` costs a single attribute check.
+
+    Properties:
+        enabled (bool): Whether to record anything. Default is False.
+    """
+    def __init__(self, enabled: bool = False):
+        self.enabled = False
+        self.peaks = {}  # [calls, last, max, total] peak bytes, keyed by block name.
+        self._frames: List[_Frame] = []  # Open blocks, across all threads.
+        self._started_tracing = False
+        self._pillow_bytes = 0  # The Pillow image buffers in use.
+        self._pillow_session = 0  # Incremented by `enable`, so older images are not released.
+        # Re-entrant, as an image may be freed (and so released) while the lock is held.
+        self._lock = threading.RLock()
+        if enabled:
+            self.enable()
+
+    def enable(self) -> None:
+        """ Start recording, starting `tracemalloc` if it is not already tracing.
+        """
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            if not self.enabled:
+                self._pillow_session += 1
+                self._pillow_bytes = 0
+            self.enabled = True
+        _hook_pillow(self)
+
+    def disable(self) -> None:
+        """ Stop recording, stopping `tracemalloc` if it was started by `enable`. Recorded peaks
+        are kept.
+        """
+        _unhook_pillow(self)
+        with self._lock:
+            self.enabled = False
+            if self._started_tracing and len(self._frames) == 0:
+                tracemalloc.stop()
+                self._started_tracing = False
+
+    def _update_frames(self) -> int:
+        """ Fold the peak memory in use into every open block, then reset it. Call with the lock.
+
+        Returns:
+            int: The memory currently in use (bytes).
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        for frame in self._frames:
+            frame.peak = max(frame.peak, peak + self._pillow_bytes)
+        tracemalloc.reset_peak()
+        return current + self._pillow_bytes
+
+    def _add_pillow_bytes(self, nbytes: int, session: int, fold: bool = True) -> None:
+        """ Count Pillow image buffers being allocated (or freed, if negative).
+
+        The Pillow bytes in use only change here, so folding the peak in beforehand (unless only
+        correcting the count) keeps each block's peak exact.
+        """
+        with self._lock:
+            if not self.enabled or session != self._pillow_session:
+                return
+            if fold and self._frames:
+                self._update_frames()
+            self._pillow_bytes += nbytes
+
+    @contextmanager
+    def profile(self, name: str) -> Iterator[None]:
+        """ Record the peak memory allocated by the enclosed block.
+
+        Args:
+            name (str): The name of the block (e.g. "Text2Image.text_to_image").
+        """
+        if not self.enabled or not tracemalloc.is_tracing():
+            yield
+            return
+
+        with self._lock:
+            frame = _Frame(self._update_frames())
+            self._frames.append(frame)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._update_frames()
+                self._frames.remove(frame)
+                self._record(name, frame.peak - frame.start)
+
+    def _record(self, name: str, peak: int) -> None:
+        """ Add the peak of one call to a block's totals. Call with the lock.
+        """
+        entry = self.peaks.get(name)
+        if entry is None:
+            self.peaks[name] = [1, peak, peak, peak]
+        else:
+            entry[0] += 1
+            entry[1] = peak
+            entry[2] = max(entry[2], peak)
+            entry[3] += peak
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        """ A copy of all recorded peaks.
+
+        Returns:
+            dict: For each block name, the number of "calls" and the "last", "max" and "mean" peak
+                bytes per call.
+        """
+        with self._lock:
+            return {name: {"calls": calls, "last": last, "max": max_peak, "mean": total // calls}
+                    for name, (calls, last, max_peak, total) in self.peaks.items()}
+
+    def reset(self) -> None:
+        """ Clear all recorded peaks.
+        """
+        with self._lock:
+            self.peaks.clear()
+
+    def to_text(self) -> str:
+        """ A human-readable summary of all recorded peaks.
+
+        Returns:
+            str: One line per block, largest peak first.
+        """
+        lines = [f"memory {name}: calls={entry['calls']} max={entry['max'] / 1024 ** 2:.3f}MB "
+                 f"mean={entry['mean'] / 1024 ** 2:.3f}MB"
+                 for name, entry in sorted(self.snapshot().items(),
+                                           key=lambda item: -item[1]["max"])]
+        return "\n".join(lines)
+
+
+# The process-wide profiler, used by `profiled`.
+memory_profiler = MemoryProfiler(enabled=os.environ.get(ENVIRONMENT_VARIABLE) == "1")
+
+
+def profiled(name: str) -> Callable:
+    """ A decorator recording the peak memory of each call with `memory_profiler`.
+
+    Args:
+        name (str): The name of the block (e.g. "Service.process").
+
+    Returns:
+        Callable: The decorator.
+    """
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not memory_profiler.enabled:
+                return function(*args, **kwargs)
+            with memory_profiler.profile(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
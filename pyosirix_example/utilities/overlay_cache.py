@@ -0,0 +1,116 @@
+""" A bounded cache of rendered text images """
+
+from collections import OrderedDict
+import threading
+from typing import Dict, Hashable, Optional
+
+from PIL import Image
+
+
+class OverlayCache:
+    """ A thread-safe, least-recently-used cache of rendered text images.
+
+    Images are evicted (least recently used first) once the total size of the cached pixel data
+    would exceed `max_bytes`. An image larger than `max_bytes` is never cached.
+
+    Properties:
+        max_bytes (int): The byte budget of the cache. 0 disables it. Default is 64 MB.
+        hits (int): The number of successful look-ups.
+        misses (int): The number of failed look-ups.
+        evictions (int): The number of images evicted to stay within budget.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 ** 2):
+        if max_bytes < 0:
+            raise ValueError("Max bytes must not be negative.")
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._sizes = {}
+        self._size_bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @property
+    def size_bytes(self) -> int:
+        """ The total number of pixel bytes currently cached.
+        """
+        return self._size_bytes
+
+    @staticmethod
+    def image_bytes(image: Image) -> int:
+        """ The number of bytes used by the pixel data of a Pillow image.
+
+        Args:
+            image (PIL.Image): The image.
+
+        Returns:
+            int: The number of bytes.
+        """
+        band_bytes = 4 if image.mode in ("F", "I") else 1
+        return image.width * image.height * len(image.getbands()) * band_bytes
+
+    def get(self, key: Hashable) -> Optional[Image.Image]:
+        """ Look up an image, marking it as most recently used.
+
+        Args:
+            key (Hashable): The cache key.
+
+        Returns:
+            PIL.Image: The cached image, or None if not present.
+        """
+        with self._lock:
+            image = self._items.get(key)
+            if image is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return image
+
+    def put(self, key: Hashable, image: Image) -> None:
+        """ Add an image to the cache, evicting the least recently used images if needed.
+
+        Args:
+            key (Hashable): The cache key.
+            image (PIL.Image): The image to cache. It should not be modified afterwards.
+        """
+        size = self.image_bytes(image)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._size_bytes -= self._sizes.pop(key)
+                del self._items[key]
+            while self._items and self._size_bytes + size > self.max_bytes:
+                old_key, _ = self._items.popitem(last=False)
+                self._size_bytes -= self._sizes.pop(old_key)
+                self.evictions += 1
+            self._items[key] = image
+            self._sizes[key] = size
+            self._size_bytes += size
+
+    def clear(self) -> None:
+        """ Remove all images from the cache (counters are kept).
+        """
+        with self._lock:
+            self._items.clear()
+            self._sizes.clear()
+            self._size_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """ A snapshot of the cache counters.
+
+        Returns:
+            dict: The hits, misses, evictions, number of entries and bytes used.
+        """
+        with self._lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "entries": len(self._items),
+                    "size_bytes": self._size_bytes}
@@ -0,0 +1,223 @@
+""" A persistent, size-limited store of rendered text images """
+
+import hashlib
+import os
+import tempfile
+import threading
+from typing import Dict, Hashable, Optional
+
+import numpy as np
+from numpy.typing import NDArray
+
+# Part of every file name, so stores written in an older format are never read.
+STORE_VERSION = 1
+
+
+class OverlayStore:
+    """ Keeps rendered text images as `.npy` files in a directory, so they survive restarts.
+
+    Each file is named after a content hash of its key (the text and render parameters) and is
+    opened memory-mapped and read-only, so processes sharing the directory also share the pages.
+    Files are written atomically, and the oldest files (by last use) are deleted once the
+    directory would exceed `max_bytes`. The store is only an optimisation, so a file that cannot be
+    written or deleted (e.g. the disk is full or read-only) is counted rather than raised.
+
+    Properties:
+        directory (str): Where the files are kept. Created if it does not exist.
+        max_bytes (int): The byte budget of the directory. 0 disables it. Default is 256 MB.
+        metrics: An optional object whose `increment(name)` method counts the files that could not
+            be written or deleted, as "store_errors" (for example,
+            `pyosirix_example.server.metrics.Metrics`). Default is None.
+        hits (int): The number of successful look-ups by this instance.
+        misses (int): The number of failed look-ups by this instance.
+        evictions (int): The number of files deleted by this instance to stay within budget.
+        errors (int): The number of files this instance could not write or delete.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 256 * 1024 ** 2, metrics=None):
+        if max_bytes < 0:
+            raise ValueError("Max bytes must not be negative.")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.metrics = metrics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        # A running total of the files written, so the directory is only scanned when it may be
+        # over budget. Files written by other processes are picked up by that scan.
+        self._size_bytes = sum(size for _, _, size in self._files())
+
+    def __len__(self) -> int:
+        return len(self._files())
+
+    @staticmethod
+    def digest(key: Hashable) -> str:
+        """ The content hash of a key, used as its file name.
+
+        Args:
+            key (Hashable): The key. Its `repr` must be stable between runs (e.g. a tuple of
+                strings, numbers and tuples).
+
+        Returns:
+            str: The hex digest.
+        """
+        return hashlib.sha256(repr((STORE_VERSION, key)).encode("utf-8")).hexdigest()
+
+    def path(self, key: Hashable) -> str:
+        """ The file in which a key is stored.
+
+        Args:
+            key (Hashable): The key.
+
+        Returns:
+            str: The file path (which may not exist).
+        """
+        return os.path.join(self.directory, f"{self.digest(key)}.npy")
+
+    @property
+    def size_bytes(self) -> int:
+        """ The total size of the files in the store.
+        """
+        return sum(size for _, _, size in self._files())
+
+    def _files(self):
+        """ The (path, last use, size) of each file in the store.
+        """
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(".npy") and entry.is_file():
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:  # Evicted by another process.
+                        continue
+                    files.append((entry.path, stat.st_mtime_ns, stat.st_size))
+        return files
+
+    def get(self, key: Hashable) -> Optional[NDArray]:
+        """ Look up an image, marking it as recently used.
+
+        Args:
+            key (Hashable): The key.
+
+        Returns:
+            NDArray: A read-only, memory-mapped array, or None if not present.
+        """
+        path = self.path(key)
+        try:
+            array = np.load(path, mmap_mode="r")
+            os.utime(path)
+        except (FileNotFoundError, ValueError, OSError):  # Missing, evicted or truncated.
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return array
+
+    def _count_error(self) -> None:
+        """ Count a file that could not be written or deleted.
+        """
+        with self._lock:
+            self.errors += 1
+        if self.metrics is not None:
+            self.metrics.increment("store_errors")
+
+    def put(self, key: Hashable, array: NDArray) -> bool:
+        """ Write an image to the store, deleting the oldest files if needed.
+
+        Args:
+            key (Hashable): The key.
+            array (NDArray): The image array.
+
+        Returns:
+            bool: Whether the image was stored. It is not when it is larger than `max_bytes` or
+                could not be written (see `errors`).
+        """
+        array = np.ascontiguousarray(array)
+        if array.nbytes > self.max_bytes:
+            return False
+        path = self.path(key)
+        temp_path = None
+        try:
+            fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, array, allow_pickle=False)
+                size = f.tell()
+            try:
+                replaced = os.path.getsize(path)
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(temp_path, path)  # Readers never see a partial file.
+        except OSError:
+            if temp_path is not None:
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+            self._count_error()
+            return False
+
+        with self._lock:
+            self._size_bytes += size - replaced
+            over_budget = self._size_bytes > self.max_bytes
+        if over_budget:
+            self._evict()
+        return True
+
+    def _evict(self) -> None:
+        """ Delete the least recently used files until the store is within budget.
+        """
+        errors = 0
+        with self._lock:
+            try:
+                files = sorted(self._files(), key=lambda file: file[1])
+            except OSError:  # E.g. the directory was removed. Try again on the next put.
+                files = None
+                errors += 1
+            if files is not None:
+                size = sum(file_size for _, _, file_size in files)
+                for path, _, file_size in files:
+                    if size <= self.max_bytes:
+                        break
+                    try:
+                        os.remove(path)  # Open memory maps stay valid until they are closed.
+                        self.evictions += 1
+                    except FileNotFoundError:
+                        pass
+                    except OSError:  # Still on disk.
+                        errors += 1
+                        continue
+                    size -= file_size
+                self._size_bytes = size
+        for _ in range(errors):
+            self._count_error()
+
+    def clear(self) -> None:
+        """ Delete all files from the store (counters are kept).
+        """
+        with self._lock:
+            for path, _, _ in self._files():
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self._size_bytes = sum(size for _, _, size in self._files())
+
+    def stats(self) -> Dict[str, int]:
+        """ A snapshot of the store counters.
+
+        Returns:
+            dict: The hits, misses, evictions, errors, number of files and bytes used.
+        """
+        files = self._files()
+        with self._lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "errors": self.errors,
+                    "entries": len(files),
+                    "size_bytes": sum(size for _, _, size in files)}
@@ -0,0 +1,209 @@
+""" Methods used to convert Numpy arrays to and from `Image` protocol buffer messages """
+
+import math
+import sys
+from typing import Any, Dict
+import zlib
+
+import numpy as np
+from numpy.typing import NDArray
+
+# These mirror the `ByteOrder` enum in server.proto.
+LITTLE_ENDIAN = 0
+BIG_ENDIAN = 1
+
+# These mirror the `PixelEncoding` enum in server.proto.
+RAW = 0
+DELTA_DEFLATE = 1
+
+# The dtypes (by name) that `decode_image` accepts.
+PIXEL_DTYPES = ("uint8", "int8", "uint16", "int16", "uint32", "int32", "uint64", "int64",
+                "float16", "float32", "float64")
+
+# The integer dtypes that greyscale images are sent as when they fit (see `compact_array`).
+COMPACT_DTYPES = ("int16", "uint16")
+
+
+def native_byte_order() -> int:
+    """ The `ByteOrder` value of this machine.
+
+    Returns:
+        int: LITTLE_ENDIAN or BIG_ENDIAN.
+    """
+    return LITTLE_ENDIAN if sys.byteorder == "little" else BIG_ENDIAN
+
+
+def delta_deflate(array: NDArray, level: int = 1) -> bytes:
+    """ Losslessly compress an array: deltas between consecutive values, then zlib.
+
+    The deltas are taken between the raw values viewed as unsigned integers (with wrap-around), so
+    any dtype is supported and smooth or constant regions (such as background) compress well.
+
+    Args:
+        array (NDArray): A contiguous array in native byte order.
+        level (int): The zlib compression level (1 is fastest). Default is 1.
+
+    Returns:
+        bytes: The compressed buffer.
+    """
+    values = array.reshape(-1).view(f"u{array.dtype.itemsize}")
+    deltas = np.empty_like(values)
+    if values.size > 0:
+        deltas[0] = values[0]
+        np.subtract(values[1:], values[:-1], out=deltas[1:])
+    return zlib.compress(deltas.tobytes(), level)
+
+
+def inflate_delta(buffer: bytes, dtype: np.dtype, size: int) -> NDArray:
+    """ Decompress a buffer written by `delta_deflate`.
+
+    At most `size` values are inflated, so a small buffer cannot expand into a huge allocation.
+
+    Args:
+        buffer (bytes): The compressed buffer.
+        dtype (np.dtype): The dtype (and byte order) of the original values.
+        size (int): The number of values expected.
+
+    Returns:
+        NDArray: A flat array of the original values, in native byte order.
+
+    Raises:
+        ValueError: When the buffer is corrupt or does not hold exactly `size` values.
+    """
+    expected = size * dtype.itemsize
+    inflater = zlib.decompressobj()
+    try:
+        raw = inflater.decompress(buffer, expected + 1)
+    except zlib.error as e:
+        raise ValueError(f"Pixel buffer cannot be decompressed: {e}") from e
+    if len(raw) != expected or len(inflater.unconsumed_tail) > 0:
+        raise ValueError("Pixel buffer size does not match the declared shape and dtype.")
+    unsigned = np.dtype(f"u{dtype.itemsize}").newbyteorder(dtype.byteorder)
+    deltas = np.frombuffer(raw, dtype=unsigned)
+    values = np.cumsum(deltas, dtype=unsigned.newbyteorder("="))  # Wraps around, like the deltas.
+    return values.view(dtype.newbyteorder("="))
+
+
+def compact_array(array: NDArray) -> NDArray:
+    """ A greyscale array in the smallest dtype that holds its values exactly (for sending).
+
+    Float arrays (such as the float64 arrays of `DCMPix.image`) become int16 or uint16 when all of
+    their values are integers in range (e.g. CT and MR data), otherwise float32, which is the
+    precision the server works in. Other arrays are returned as they are.
+
+    Args:
+        array (NDArray): The array.
+
+    Returns:
+        NDArray: The compact array (`array` itself if no conversion is needed).
+    """
+    if array.ndim != 2 or array.dtype.kind != "f":
+        return array
+    if array.size > 0:
+        low, high = array.min(), array.max()  # Both NaN if any value is, so no match below.
+        for name in COMPACT_DTYPES:
+            info = np.iinfo(name)
+            if info.min <= low and high <= info.max:
+                compact = array.astype(name)
+                if np.array_equal(compact, array):
+                    return compact
+                break  # Not integers, so no other integer dtype will do either.
+    return array.astype("float32", copy=False)
+
+
+def encode_array(array: NDArray, legacy: bool = False, compress: bool = False,
+                 level: int = 1) -> Dict[str, Any]:
+    """ Encode a Numpy array as the fields of an `Image` message.
+
+    The pixel data is written once as a raw byte buffer (`pixels`) alongside its dtype, byte order
+    and shape, which avoids building a Python float for every pixel.
+
+    Args:
+        array (NDArray): The array to encode. Must be 2 or 3 dimensional.
+        legacy (bool): Whether to write the pixels to the legacy `image` (repeated float) field
+            instead. Default is False.
+        compress (bool): Whether to compress the pixels (see `delta_deflate`). Ignored if `legacy`.
+            Default is False.
+        level (int): The zlib compression level if `compress`. Default is 1.
+
+    Returns:
+        dict: Keyword arguments for the `Image` message constructor.
+
+    Raises:
+        ValueError: When the array is not 2 or 3 dimensional.
+    """
+    if array.ndim not in (2, 3):
+        raise ValueError("Array must be 3 or 2 dimensional.")
+    fields = {"rows": array.shape[0], "columns": array.shape[1]}
+    if legacy:
+        fields["image"] = array.ravel().tolist()
+        return fields
+    array = np.ascontiguousarray(array)
+    if compress:
+        array = array.astype(array.dtype.newbyteorder("="), copy=False)
+        fields["pixels"] = delta_deflate(array, level)
+        fields["encoding"] = DELTA_DEFLATE
+    else:
+        fields["pixels"] = array.tobytes()
+    byte_order = array.dtype.byteorder
+    if byte_order == ">" or (byte_order == "=" and sys.byteorder == "big"):
+        fields["byte_order"] = BIG_ENDIAN
+    else:
+        fields["byte_order"] = LITTLE_ENDIAN  # Includes "|" (single byte, order irrelevant).
+    fields["dtype"] = array.dtype.name
+    fields["shape"] = list(array.shape)
+    return fields
+
+
+def decode_image(message) -> NDArray:
+    """ Decode the pixel data of an `Image` message into a Numpy array.
+
+    The raw `pixels` buffer is used when present (decompressing it if needed), otherwise the
+    legacy `image` field is read as float32. Raw buffers are returned in native byte order and are
+    writeable.
+
+    Args:
+        message (server_pb2.Image): The message to decode.
+
+    Returns:
+        NDArray: The decoded array.
+
+    Raises:
+        ValueError: When the dtype is not one of `PIXEL_DTYPES`, the buffer size does not match
+            the declared shape and dtype, or the buffer cannot be decompressed.
+    """
+    pixels = message.pixels  # Each access to a bytes field returns a new copy, so only read once.
+    if len(pixels) == 0:
+        return np.array(message.image, dtype="float32").reshape(message.rows, message.columns)
+
+    dtype_name = message.dtype or "float32"
+    if dtype_name not in PIXEL_DTYPES:
+        raise ValueError(f"Dtype {dtype_name} is not supported.")
+    dtype = np.dtype(dtype_name)
+    if dtype.itemsize > 1:
+        dtype = dtype.newbyteorder(">" if message.byte_order == BIG_ENDIAN else "<")
+    shape = tuple(message.shape) if len(message.shape) > 0 else (message.rows, message.columns)
+    if min(shape) < 0:
+        raise ValueError("Shape must not be negative.")
+    size = math.prod(shape)
+    if message.encoding == DELTA_DEFLATE:
+        # The size is known before inflating, which bounds the memory a payload can claim.
+        return inflate_delta(pixels, dtype, size).reshape(shape)  # A new, writeable array.
+    if size * dtype.itemsize != len(pixels):
+        raise ValueError("Pixel buffer size does not match the declared shape and dtype.")
+
+    # np.frombuffer of bytes is read-only, so take a single (native order) writeable copy.
+    array = np.frombuffer(pixels, dtype=dtype).reshape(shape)
+    return array.astype(dtype.newbyteorder("="), copy=True)
+
+
+def uses_legacy_field(message) -> bool:
+    """ Whether an `Image` message carries its pixels in the legacy `image` field.
+
+    Args:
+        message (server_pb2.Image): The message to check.
+
+    Returns:
+        bool: True if the legacy field holds the pixels.
+    """
+    return len(message.image) > 0  # Cheaper than len(message.pixels), which copies the buffer.
@@ -1,9 +1,19 @@
-from typing import Tuple
+from contextlib import contextmanager, nullcontext
+import math
+from typing import List, Optional, Sequence, Tuple, Union
 
-from PIL import Image, ImageDraw, ImageFont, ImageChops
+from PIL import Image, ImageDraw, ImageChops
 import numpy as np
 from numpy.typing import NDArray
 
+from pyosirix_example.utilities.font_registry import font_registry
+from pyosirix_example.utilities.memory_profile import memory_profiler, profiled
+from pyosirix_example.utilities.overlay_cache import OverlayCache
+from pyosirix_example.utilities.overlay_store import OverlayStore
+
+# Greyscale dtypes that are pasted natively rather than converted to float32.
+INTEGER_DTYPES = ("int16", "uint16")
+
 
 class Text2Image:
     """ A class that creates a text image from a text string.
@@ -11,12 +21,53 @@ class Text2Image:
     Properties:
         max_shape (Tuple[int, int]): The maximum shape of the initial text image. Set to something
             large to avoid text clipping. Default is (5000, 5000).
+        cache (OverlayCache): An optional cache of rendered text images, which may be shared
+            between instances and threads. Default is None (no caching).
+        measure_text (bool): Whether to measure the text first and render it into a canvas of
+            exactly that size (never larger than `max_shape`), rather than into a `max_shape`
+            canvas. The result is the same, but far less memory is used. Default is False.
+        metrics: An optional object whose `stage(name)` method returns a context manager used to
+            time the "text_to_image", "resize" and "paste" stages of the "numpy" engine (for
+            example, `pyosirix_example.server.metrics.Metrics`). Default is None.
+        store (OverlayStore): An optional on-disk store of rendered text images, checked after
+            `cache`, which may be shared between processes and survives restarts. Default is None.
+        direct_size (bool): Whether to render the text at the font size that gives the width
+            requested by `scale` (see `FontRegistry.font_size_for_width`), rather than at
+            `font_size` followed by a resize. Faster and sharper, though the text may be a pixel
+            or two narrower than requested. Default is False.
+        glyph_atlas (bool): Whether to compose the text from glyphs rasterised once per font and
+            size (see `GlyphAtlas`), rather than rasterising every string. Much faster when many
+            different strings are rendered (e.g. slice numbers), with the same result. The text is
+            not clipped to `max_shape`. Default is False.
     """
 
-    def __init__(self, max_shape: Tuple[int, int] = None):
+    def __init__(self, max_shape: Tuple[int, int] = None, cache: OverlayCache = None,
+                 measure_text: bool = False, metrics=None, store: OverlayStore = None,
+                 direct_size: bool = False, glyph_atlas: bool = False):
         if max_shape is None:
             max_shape = (5000, 5000)
         self.max_shape = max_shape
+        self.cache = cache
+        self.measure_text = measure_text
+        self.metrics = metrics
+        self.store = store
+        self.direct_size = direct_size
+        self.glyph_atlas = glyph_atlas
+
+    def _stage(self, name: str):
+        """ A context manager timing a stage with `metrics`, if set, and recording its peak memory
+        if `memory_profiler` is enabled.
+        """
+        stage = nullcontext() if self.metrics is None else self.metrics.stage(name)
+        if memory_profiler.enabled:
+            return self._profiled_stage(name, stage)
+        return stage
+
+    @staticmethod
+    @contextmanager
+    def _profiled_stage(name: str, stage):
+        with memory_profiler.profile(f"Text2Image/{name}"), stage:
+            yield
 
     @staticmethod
     def append_value_to_tuple(v, t: Tuple) -> Tuple:
@@ -64,58 +115,68 @@ class Text2Image:
         Returns:
             PIL.Image: Trimmed image.
         """
-        if image.mode != 'RGB':
-            zero_image = Image.new(image.mode, image.size)
+        if image.mode == 'L':
+            bbox = image.getbbox()  # Same as the difference from zero, without the extra images.
         else:
-            zero_image = Image.new(image.mode, image.size, bg_color)
-        diff_image = ImageChops.difference(image, zero_image)
-        bbox = diff_image.getbbox()
+            if image.mode != 'RGB':
+                zero_image = Image.new(image.mode, image.size)
+            else:
+                zero_image = Image.new(image.mode, image.size, bg_color)
+            diff_image = ImageChops.difference(image, zero_image)
+            bbox = diff_image.getbbox()
         if bbox:
             image = image.crop(bbox)
         return image
 
     @staticmethod
-    def paste_image_in_image(image: Image, base_image: Image, mask_image: Image = None,
-                             location: int = 1, scale: float = 0.2, offset: float = 0.05) -> Image:
-        """ Paste one Pillow image in another.
+    def overlay_box(size: Tuple[int, int], base_size: Tuple[int, int], location: int = 1,
+                    scale: float = 0.2, offset: float = 0.05) -> Tuple[int, int, int, int]:
+        """ Where an image is placed when pasted in a base image (see `paste_image_in_image`).
 
         Args:
-            image (Pillow.Image): The image to paste.
-            base_image (Pillow.Image): Base image to paste within.
-            mask_image (Pillow.Image): A binary mask for the image where zero-values will not be
-                pasted. Default is None, in which case no masking will be applied.
-            location (int): The location to paste the image:
-                1: top-right (default)
-                2: top-center
-                3: top-left
-                4: bottom-left
-                5: bottom-center
-                6: bottom-right
-            scale (float): The proportion of `base_image` columns occupied by Image. Rows are
-                automatically determined to ensure the aspect ratio of `image` is maintained.
-                Must be > 0 and <= 1. Default is 0.2.
-            offset (float): The amount to offset the image from the edge. Must be > 0 and < 1.
+            size (Tuple[int, int]): The size (columns, rows) of the image to paste.
+            base_size (Tuple[int, int]): The size (columns, rows) of the base image.
+            location (int): The location to paste the image (see `paste_image_in_image`).
+            scale (float): The proportion of base columns occupied by the image.
+            offset (float): The amount to offset the image from the edge.
 
         Returns:
-            Image: The pasted image.
+            Tuple[int, int, int, int]: The (left, top, columns, rows) of the resized image within
+                the base image. This may extend beyond the edges of the base image.
         """
         if scale <= 0.0 or scale > 1.0:
             raise ValueError("Scale must be between 0 and 1.")
 
-        if offset < 0.0 or offset > 1.0:
-            raise ValueError("Offset must be between 0 and 1.")
-
-        if mask_image is None:
-            mask_image = Image.new("L", image.size, 255)
-
-        columns, rows = image.size
-        base_columns, base_rows = base_image.size
+        columns, rows = size
 
         # Calculate new rows/columns
         aspect_ratio = float(rows) / columns
-        new_columns = int(scale * base_columns)
+        new_columns = int(scale * base_size[0])
         new_rows = int(aspect_ratio * new_columns)
 
+        return Text2Image.overlay_position((new_columns, new_rows), base_size, location, offset)
+
+    @staticmethod
+    def overlay_position(size: Tuple[int, int], base_size: Tuple[int, int], location: int = 1,
+                         offset: float = 0.05) -> Tuple[int, int, int, int]:
+        """ Where an image of a given (final) size is placed within a base image.
+
+        Args:
+            size (Tuple[int, int]): The size (columns, rows) of the image to place.
+            base_size (Tuple[int, int]): The size (columns, rows) of the base image.
+            location (int): The location to paste the image (see `paste_image_in_image`).
+            offset (float): The amount to offset the image from the edge.
+
+        Returns:
+            Tuple[int, int, int, int]: The (left, top, columns, rows) of the image within the base
+                image. This may extend beyond the edges of the base image.
+        """
+        if offset < 0.0 or offset > 1.0:
+            raise ValueError("Offset must be between 0 and 1.")
+
+        new_columns, new_rows = size
+        base_columns, base_rows = base_size
+
         # Determine the offset
         if location == 6:  # Bottom right
             offset_columns = base_columns - new_columns - int(offset * base_columns)
@@ -138,12 +199,46 @@ class Text2Image:
         else:
             raise ValueError("Location must be 1, 2, 3, 4, 5, 6")
 
+        return offset_columns, offset_rows, new_columns, new_rows
+
+    @staticmethod
+    def paste_image_in_image(image: Image, base_image: Image, mask_image: Image = None,
+                             location: int = 1, scale: float = 0.2, offset: float = 0.05) -> Image:
+        """ Paste one Pillow image in another.
+
+        Args:
+            image (Pillow.Image): The image to paste.
+            base_image (Pillow.Image): Base image to paste within.
+            mask_image (Pillow.Image): A binary mask for the image where zero-values will not be
+                pasted. Default is None, in which case no masking will be applied.
+            location (int): The location to paste the image:
+                1: top-right (default)
+                2: top-center
+                3: top-left
+                4: bottom-left
+                5: bottom-center
+                6: bottom-right
+            scale (float): The proportion of `base_image` columns occupied by Image. Rows are
+                automatically determined to ensure the aspect ratio of `image` is maintained.
+                Must be > 0 and <= 1. Default is 0.2.
+            offset (float): The amount to offset the image from the edge. Must be > 0 and < 1.
+
+        Returns:
+            Image: The pasted image.
+        """
+        if mask_image is None:
+            mask_image = Image.new("L", image.size, 255)
+
+        offset_columns, offset_rows, new_columns, new_rows = \
+            Text2Image.overlay_box(image.size, base_image.size, location, scale, offset)
+
         image_r = image.resize((new_columns, new_rows), Image.LANCZOS)
         mask_image_r = mask_image.resize((new_columns, new_rows), Image.NEAREST)
         base_image.paste(image_r, (offset_columns, offset_rows), mask_image_r)
 
         return base_image
 
+    @profiled("Text2Image.paste_text_in_image")
     def paste_text_in_image(self, text: str, image: Image, location: int = 1, scale: float = 0.2,
                             offset: float = 0.05, remove_background: bool = False,
                             **kwargs) -> Image:
@@ -164,28 +259,17 @@ class Text2Image:
             Image: The pasted image.
         """
         kwargs["mode"] = image.mode  # Need to ensure it is correct.
-        text_image = self.text_to_image(text, **kwargs)
+        text_image, box = self._sized_text_image(text, image.size, location, scale, offset,
+                                                 **kwargs)
 
         if remove_background:
-            text_array = np.array(text_image)
-            if image.mode == "F":
-                if "bg_value" in kwargs:
-                    bg_value = kwargs["bg_value"]
-                else:
-                    bg_value = 0
-                mask_array = (text_array != bg_value) * 255
-            else:
-                if "bg_color" in kwargs:
-                    bg_color = kwargs["bg_color"]
-                else:
-                    bg_color = (0, 0, 0)
-                mask_array = 1 * (text_array[..., 0] != bg_color[0]) + \
-                             1 * (text_array[..., 1] != bg_color[1]) + \
-                             1 * (text_array[..., 2] != bg_color[2])
-                mask_array = (mask_array > 0) * 255
-            mask_image = Image.fromarray(mask_array.astype("uint8"), mode="L")
+            mask_image = Image.fromarray(self.background_mask(text_image, **kwargs), mode="L")
         else:
-            mask_image = Image.new("L", image.size, 255)
+            mask_image = None  # No masking, the whole text image is pasted.
+
+        if text_image.size == box[2:4]:  # Already the right size (see `direct_size`).
+            image.paste(text_image, box[0:2], mask_image)
+            return image
 
         return self.paste_image_in_image(text_image,
                                          image,
@@ -194,9 +278,56 @@ class Text2Image:
                                          scale,
                                          offset)
 
+    @staticmethod
+    def background_mask(text_image: Image, mode: str = "F", bg_value: float = 0,
+                        bg_color: Tuple[int, int, int] = (0, 0, 0), **kwargs) -> NDArray:
+        """ A mask of the non-background pixels of a text image.
+
+        Args:
+            text_image (PIL.Image): The text image (see `text_to_image`).
+            mode (str, optional): One of "F" (greyscale), "RGB" or "RGBA". Default is "F".
+            bg_value (float, optional): The background value if `mode` is greyscale. Default is 0.
+            bg_color (Tuple[int, int, int]): The background color if `mode` is rgb.
+                Default is (0, 0, 0).
+            kwargs (dict): Other `text_to_image` keyword arguments, which are ignored.
+
+        Returns:
+            NDArray: A uint8 mask that is 255 for text and 0 for background.
+        """
+        text_array = np.asarray(text_image)
+        if mode == "F":
+            mask_array = text_array != bg_value
+        else:
+            mask_array = (text_array[..., 0:3] != np.asarray(bg_color[0:3])).any(axis=-1)
+        # Boolean to uint8 without an intermediate integer array, as the text image can be large.
+        return mask_array.view(np.uint8) * np.uint8(255)
+
+    @staticmethod
+    def array_mode(array: NDArray) -> str:
+        """ The Pillow mode used for a Numpy array.
+
+        Args:
+            array (NDArray): A 2D (greyscale) or 3D (RGB or RGBA) array.
+
+        Returns:
+            str: One of "F", "RGB" or "RGBA".
+        """
+        if array.ndim == 3:
+            if array.shape[-1] == 3:
+                return "RGB"
+            elif array.shape[-1] == 4:
+                return "RGBA"
+            else:
+                raise ValueError("Last dimension of array must be 3 or 4.")
+        elif array.ndim == 2:
+            return "F"
+        else:
+            raise ValueError("Array must be 3 or 2 dimensional.")
+
+    @profiled("Text2Image.paste_text_in_array")
     def paste_text_in_array(self, text: str, array: NDArray, location: int = 1, scale: float = 0.2,
                             offset: float = 0.05, remove_background: bool = False,
-                            **kwargs) -> NDArray:
+                            engine: str = "pil", in_place: bool = False, **kwargs) -> NDArray:
         """ Paste a text string within a Numpy array.
 
         Args:
@@ -208,22 +339,28 @@ class Text2Image:
             offset (float): The amount to offset the text from the edge
                 (see `paste_image_in_image`).
             remove_background (bool): Whether to include the background. Default is False.
+            engine (str): One of "pil" (convert the array to a Pillow image and back) or "numpy"
+                (only write the pixels covered by the text). Both give the same result, though
+                "numpy" is much faster for large arrays. Default is "pil".
+            in_place (bool): Whether the "numpy" engine may write into `array` rather than a copy.
+                Only possible when `array` is writeable and already has its output dtype (see
+                `output_dtype`), otherwise a copy is returned. Default is False.
             kwargs (dict): Keyword arguments passed to `text_to_image`.
 
         Returns:
             NDArray: The pasted array.
         """
-        if array.ndim == 3:
-            if array.shape[-1] == 3:
-                image = Image.fromarray(array, mode='RGB')
-            elif array.shape[-1] == 4:
-                image = Image.fromarray(array, mode='RGBA')
-            else:
-                ValueError("Last dimension of array must be 3 or 4.")
-        elif array.ndim == 2:
+        mode = self.array_mode(array)
+        if engine == "numpy":
+            return self._paste_text_in_array_numpy(text, array, mode, location, scale, offset,
+                                                   remove_background, in_place, **kwargs)
+        elif engine != "pil":
+            raise ValueError("Engine must be pil or numpy.")
+
+        if mode == "F":
             image = Image.fromarray(array.astype("float32"), mode='F')
         else:
-            raise ValueError("Array must be 3 or 2 dimensional.")
+            image = Image.fromarray(array, mode=mode)
         image = self.paste_text_in_image(text,
                                          image,
                                          location,
@@ -231,8 +368,308 @@ class Text2Image:
                                          offset,
                                          remove_background,
                                          **kwargs)
-        return np.array(image)
+        pasted = np.array(image)
+        dtype = self.output_dtype(array) if mode == "F" else pasted.dtype
+        if dtype.kind in "iu" and pasted.dtype != dtype:
+            info = np.iinfo(dtype)
+            np.rint(pasted, out=pasted)
+            pasted = np.clip(pasted, info.min, info.max, out=pasted).astype(dtype)
+        return pasted
+
+    @profiled("Text2Image.paste_text_in_volume")
+    def paste_text_in_volume(self, text: str, volume: Union[NDArray, Sequence[NDArray]],
+                             location: int = 1, scale: float = 0.2, offset: float = 0.05,
+                             remove_background: bool = False, in_place: bool = False,
+                             **kwargs) -> Union[NDArray, List[NDArray]]:
+        """ Paste a text string within every slice of a Numpy volume.
+
+        The text is rendered, resized and masked once per slice geometry, and then written into
+        all slices in a single vectorised operation (see the "numpy" engine of
+        `paste_text_in_array`).
+
+        Args:
+            text (str): The text to be pasted.
+            volume (NDArray | Sequence[NDArray]): Either an array of shape (slices, rows, columns)
+                for greyscale or (slices, rows, columns, 3 or 4) for RGB/RGBA, or a sequence of 2D
+                or 3D (RGB/RGBA) arrays that may differ in shape.
+            location (int): The text location (see `paste_image_in_image`).
+            scale (float): The proportion of slice columns occupied by the text
+                (see `paste_image_in_image`).
+            offset (float): The amount to offset the text from the edge
+                (see `paste_image_in_image`).
+            remove_background (bool): Whether to include the background. Default is False.
+            in_place (bool): Whether to write into `volume` rather than a copy, where possible
+                (see `paste_text_in_array`). Default is False.
+            kwargs (dict): Keyword arguments passed to `text_to_image`.
+
+        Returns:
+            NDArray | List[NDArray]: The pasted volume (a list if a sequence was given).
+        """
+        if not isinstance(volume, np.ndarray):
+            overlays = {}  # One overlay per unique slice geometry.
+            pasted = []
+            for array in volume:
+                mode = self.array_mode(array)
+                key = (mode, array.shape[0:2])
+                if key not in overlays:
+                    overlays[key] = self._prepare_overlay(text, mode, array.shape[0:2], location,
+                                                          scale, offset, remove_background,
+                                                          **kwargs)
+                out = self._output_array(array, mode, in_place)
+                pasted.append(self._composite(out, mode, *overlays[key]))
+            return pasted
+
+        if volume.ndim == 3:
+            mode = "F"
+        elif volume.ndim == 4:
+            mode = self.array_mode(volume[0])
+        else:
+            raise ValueError("Volume must be 4 or 3 dimensional.")
+        overlay = self._prepare_overlay(text, mode, volume.shape[1:3], location, scale, offset,
+                                        remove_background, **kwargs)
+        out = self._output_array(volume, mode, in_place)
+        return self._composite(out, mode, *overlay)
+
+    def text_region(self, text: str, shape: Tuple[int, int], location: int = 1,
+                    scale: float = 0.2, offset: float = 0.05, remove_background: bool = False,
+                    **kwargs) -> Tuple[int, int, int, int]:
+        """ The region of an array that pasting a text string would change.
+
+        Args:
+            text (str): The text to be pasted.
+            shape (Tuple[int, int]): The shape (rows, columns) of the array.
+            location (int): The text location (see `paste_image_in_image`).
+            scale (float): The proportion of array columns occupied by the text
+                (see `paste_image_in_image`).
+            offset (float): The amount to offset the text from the edge
+                (see `paste_image_in_image`).
+            remove_background (bool): Accepted for symmetry with `paste_text_in_array`; it does
+                not change the region.
+            kwargs (dict): Keyword arguments passed to `text_to_image`.
+
+        Returns:
+            Tuple[int, int, int, int]: The (left, top, columns, rows) of the region, clipped to the
+                array (columns and rows are 0 if the text falls outside of it).
+        """
+        rows, columns = shape
+        _, (left, top, new_columns, new_rows) = self._sized_text_image(text, (columns, rows),
+                                                                       location, scale, offset,
+                                                                       **kwargs)
+        row_0, row_1 = max(top, 0), min(top + new_rows, rows)
+        column_0, column_1 = max(left, 0), min(left + new_columns, columns)
+        return column_0, row_0, max(column_1 - column_0, 0), max(row_1 - row_0, 0)
+
+    @profiled("Text2Image.paste_text_in_patch")
+    def paste_text_in_patch(self, text: str, patch: NDArray, shape: Tuple[int, int],
+                            origin: Tuple[int, int], location: int = 1, scale: float = 0.2,
+                            offset: float = 0.05, remove_background: bool = False,
+                            in_place: bool = False, **kwargs) -> NDArray:
+        """ Paste a text string within a patch (sub-array) of a larger array.
+
+        The text is placed as it would be in the full array (see `paste_text_in_array`), but only
+        the pixels within the patch are written, so the rest of the array is not needed. Use
+        `text_region` to find the patch that covers the text.
+
+        Args:
+            text (str): The text to be pasted.
+            patch (NDArray): The patch to be pasted.
+            shape (Tuple[int, int]): The shape (rows, columns) of the full array.
+            origin (Tuple[int, int]): The (row, column) of the full array at which the patch starts.
+            location (int): The text location (see `paste_image_in_image`).
+            scale (float): The proportion of array columns occupied by the text
+                (see `paste_image_in_image`).
+            offset (float): The amount to offset the text from the edge
+                (see `paste_image_in_image`).
+            remove_background (bool): Whether to include the background. Default is False.
+            in_place (bool): Whether to write into `patch` rather than a copy, where possible
+                (see `paste_text_in_array`). Default is False.
+            kwargs (dict): Keyword arguments passed to `text_to_image`.
+
+        Returns:
+            NDArray: The pasted patch.
+        """
+        mode = self.array_mode(patch)
+        left, top, overlay, mask = self._prepare_overlay(text, mode, shape, location, scale,
+                                                         offset, remove_background, **kwargs)
+        with self._stage("paste"):
+            out = self._output_array(patch, mode, in_place)
+            return self._composite(out, mode, left - origin[1], top - origin[0], overlay, mask)
+
+    @profiled("Text2Image.prepare_overlay")
+    def prepare_overlay(self, text: str, shape: Tuple[int, int], mode: str = "F",
+                        location: int = 1, scale: float = 0.2, offset: float = 0.05,
+                        remove_background: bool = False,
+                        **kwargs) -> Tuple[int, int, NDArray, Optional[NDArray]]:
+        """ Render and size a text overlay once, for any number of arrays of the same shape.
+
+        Args:
+            text (str): The text to be pasted.
+            shape (Tuple[int, int]): The shape (rows, columns) of the arrays.
+            mode (str): One of "F" (greyscale), "RGB" or "RGBA". Default is "F".
+            location (int): The text location (see `paste_image_in_image`).
+            scale (float): The proportion of array columns occupied by the text
+                (see `paste_image_in_image`).
+            offset (float): The amount to offset the text from the edge
+                (see `paste_image_in_image`).
+            remove_background (bool): Whether to include the background. Default is False.
+            kwargs (dict): Keyword arguments passed to `text_to_image`.
+
+        Returns:
+            Tuple[int, int, NDArray, NDArray]: The (left, top) of the overlay, the overlay and its
+                boolean mask (None if there is no masking). Pass it to `paste_overlay`.
+        """
+        return self._prepare_overlay(text, mode, shape, location, scale, offset,
+                                     remove_background, **kwargs)
+
+    @profiled("Text2Image.paste_overlay")
+    def paste_overlay(self, array: NDArray, overlay: Tuple[int, int, NDArray, Optional[NDArray]],
+                      in_place: bool = False) -> NDArray:
+        """ Paste an overlay from `prepare_overlay` within a Numpy array.
+
+        Args:
+            array (NDArray): The array to be pasted. Its shape must match that given to
+                `prepare_overlay`.
+            overlay (Tuple[int, int, NDArray, NDArray]): The prepared overlay.
+            in_place (bool): Whether to write into `array` rather than a copy, where possible
+                (see `paste_text_in_array`). Default is False.
+
+        Returns:
+            NDArray: The pasted array.
+        """
+        mode = self.array_mode(array)
+        with self._stage("paste"):
+            out = self._output_array(array, mode, in_place)
+            return self._composite(out, mode, *overlay)
+
+    def _paste_text_in_array_numpy(self, text: str, array: NDArray, mode: str, location: int,
+                                   scale: float, offset: float, remove_background: bool,
+                                   in_place: bool, **kwargs) -> NDArray:
+        """ Paste a text string within a Numpy array, only touching the pixels under the text.
+        """
+        overlay = self._prepare_overlay(text, mode, array.shape[0:2], location, scale, offset,
+                                        remove_background, **kwargs)
+        with self._stage("paste"):
+            out = self._output_array(array, mode, in_place)
+            return self._composite(out, mode, *overlay)
+
+    def _prepare_overlay(self, text: str, mode: str, shape: Tuple[int, int], location: int,
+                         scale: float, offset: float, remove_background: bool,
+                         **kwargs) -> Tuple[int, int, NDArray, Optional[NDArray]]:
+        """ Render and resize the text (and mask) for arrays with `shape` (rows, columns).
+
+        Returns:
+            Tuple[int, int, NDArray, NDArray]: The (left, top) of the overlay, the overlay and its
+                boolean mask (None if there is no masking).
+        """
+        kwargs["mode"] = mode
+        rows, columns = shape
+        with self._stage("text_to_image"):
+            text_image, (left, top, new_columns, new_rows) = \
+                self._sized_text_image(text, (columns, rows), location, scale, offset, **kwargs)
+
+        mask = None
+        if remove_background:
+            mask = self.background_mask(text_image, **kwargs)
+        if text_image.size == (new_columns, new_rows):  # Already the right size (direct_size).
+            overlay = np.asarray(text_image)  # Read-only, as is any cached overlay.
+            mask = mask > 0 if mask is not None else None
+        else:
+            # Resize only the (small) text image and its mask.
+            with self._stage("resize"):
+                overlay = np.array(text_image.resize((new_columns, new_rows), Image.LANCZOS))
+                if mask is not None:
+                    mask_image = Image.fromarray(mask, mode="L")
+                    mask = np.array(mask_image.resize((new_columns, new_rows), Image.NEAREST)) > 0
+        if mode == "RGBA" and overlay.shape[-1] == 3:
+            overlay = np.concatenate([overlay, np.full_like(overlay[..., 0:1], 255)], axis=-1)
+        return left, top, overlay, mask
+
+    def _sized_text_image(self, text: str, base_size: Tuple[int, int], location: int,
+                          scale: float, offset: float,
+                          **kwargs) -> Tuple[Image.Image, Tuple[int, int, int, int]]:
+        """ Render a text string for a base image of `base_size` (columns, rows).
+
+        Returns:
+            Tuple[PIL.Image, Tuple[int, int, int, int]]: The text image and the (left, top,
+                columns, rows) it should occupy (see `overlay_box`). With `direct_size`, the text
+                image is already that size.
+        """
+        if not self.direct_size:
+            text_image = self._text_image(text, **kwargs)
+            return text_image, self.overlay_box(text_image.size, base_size, location, scale,
+                                                offset)
 
+        if scale <= 0.0 or scale > 1.0:
+            raise ValueError("Scale must be between 0 and 1.")
+        left_pad, right_pad = kwargs.get("pad", (0, 0, 0, 0))[0:2]
+        columns = max(int(scale * base_size[0]) - left_pad - right_pad, 1)
+        kwargs["font_size"] = font_registry.font_size_for_width(text, columns,
+                                                                kwargs.get("font_path"),
+                                                                kwargs.get("align", "left"))
+        text_image = self._text_image(text, **kwargs)
+        return text_image, self.overlay_position(text_image.size, base_size, location, offset)
+
+    @staticmethod
+    def output_dtype(array: NDArray) -> np.dtype:
+        """ The dtype of a pasted greyscale array (RGB and RGBA arrays are always uint8).
+
+        int16 and uint16 arrays (e.g. CT and MR data) keep their dtype, with the text values
+        rounded and clipped to its range, so they are not doubled in size. Others become float32.
+
+        Args:
+            array (NDArray): A greyscale array, or a stack of them.
+
+        Returns:
+            np.dtype: The dtype.
+        """
+        if array.dtype.name in INTEGER_DTYPES:
+            return np.dtype(array.dtype.name)
+        return np.dtype("float32")
+
+    @classmethod
+    def _output_array(cls, array: NDArray, mode: str, in_place: bool) -> NDArray:
+        """ The array to write into: `array` itself if allowed, otherwise a copy.
+        """
+        if mode == "F":
+            dtype = cls.output_dtype(array)
+        else:
+            dtype = np.dtype("uint8")
+        if in_place and array.dtype == dtype and array.flags.writeable:
+            return array
+        return array.astype(dtype, copy=True)
+
+    @staticmethod
+    def _composite(out: NDArray, mode: str, left: int, top: int, overlay: NDArray,
+                   mask: Optional[NDArray]) -> NDArray:
+        """ Write an overlay into `out`, broadcasting across any leading (slice) dimensions.
+        """
+        channel_axes = 0 if mode == "F" else 1
+        rows, columns = out.shape[out.ndim - channel_axes - 2:out.ndim - channel_axes]
+        new_rows, new_columns = overlay.shape[0:2]
+
+        # Clip the overlay to the array, as Pillow does when pasting.
+        row_0, row_1 = max(top, 0), min(top + new_rows, rows)
+        column_0, column_1 = max(left, 0), min(left + new_columns, columns)
+        if row_0 >= row_1 or column_0 >= column_1:
+            return out
+        overlay_slice = (slice(row_0 - top, row_1 - top), slice(column_0 - left, column_1 - left))
+        overlay = overlay[overlay_slice]
+        if out.dtype.kind in "iu" and overlay.dtype != out.dtype:
+            info = np.iinfo(out.dtype)
+            overlay = np.clip(np.rint(overlay), info.min, info.max).astype(out.dtype)
+        region_slice = (Ellipsis, slice(row_0, row_1), slice(column_0, column_1)) + \
+            (slice(None),) * channel_axes
+        region = out[region_slice]
+        if mask is None:
+            region[...] = overlay
+        else:
+            mask = mask[overlay_slice]
+            if mode != "F":
+                mask = mask[..., np.newaxis]
+            np.copyto(region, overlay, where=mask, casting="unsafe")
+        return out
+
+    @profiled("Text2Image.text_to_image")
     def text_to_image(self, text: str, font_path: str = None, font_size: float = 40,
                       value: float = 1.0, color: Tuple[int, int, int] = (255, 255, 255),
                       bg_value: float = 0.0, bg_color: Tuple[int, int, int] = (255, 255, 255),
@@ -262,42 +699,144 @@ class Text2Image:
         Returns:
             PIL.Image: The text image.
         """
+        img = self._text_image(text, font_path, font_size, value, color, bg_value, bg_color, mode,
+                               align, pad)
+        if self.cache is None and self.store is None:
+            return img
+        return img.copy()  # Callers are free to modify the returned image.
+
+    def _text_image(self, text: str, font_path: str = None, font_size: float = 40,
+                    value: float = 1.0, color: Tuple[int, int, int] = (255, 255, 255),
+                    bg_value: float = 0.0, bg_color: Tuple[int, int, int] = (255, 255, 255),
+                    mode: str = "F", align: str = "left",
+                    pad: Tuple[int, int, int, int] = (0, 0, 0, 0)) -> Image:
+        """ Convert a text string into an image (see `text_to_image`), without copying it.
+
+        The image may be the one kept by `cache`, so it must not be modified.
+        """
+        if self.cache is None and self.store is None:
+            return self._render_text(text, font_path, font_size, value, color, bg_value, bg_color,
+                                     mode, align, pad)
+
+        # The renderer's own options are part of the key, as renderers may share a cache or store.
+        key = (text, font_path, font_size, value, tuple(color), bg_value, tuple(bg_color), mode,
+               align, tuple(pad), tuple(self.max_shape), self.measure_text, self.glyph_atlas,
+               self.direct_size)
+        img = self.cache.get(key) if self.cache is not None else None
+        if img is None:
+            array = self.store.get(key) if self.store is not None else None
+            if array is not None:
+                img = Image.fromarray(array)
+            else:
+                img = self._render_text(text, font_path, font_size, value, color, bg_value,
+                                        bg_color, mode, align, pad)
+                if self.store is not None:
+                    self.store.put(key, np.asarray(img))
+            if self.cache is not None:
+                self.cache.put(key, img)
+        return img
+
+    def measure_text_shape(self, text: str, font, align: str = "left") -> Tuple[int, int]:
+        """ The smallest canvas (columns, rows) that holds a text string drawn at the origin.
+
+        Ink that falls outside of `max_shape` is clipped exactly as it would be when rendering into
+        a `max_shape` canvas.
+
+        Args:
+            text (str): The text to be measured.
+            font (ImageFont.FreeTypeFont): The font used to draw the text.
+            align (str, optional): One of "left", "center", or "right".
+
+        Returns:
+            Tuple[int, int]: The canvas shape.
+        """
+        draw = ImageDraw.Draw(Image.new('L', (1, 1)))
+        _, _, right, bottom = draw.multiline_textbbox((0, 0), text, font=font, anchor="la",
+                                                      align=align)
+        return (max(1, min(math.ceil(right), self.max_shape[0])),
+                max(1, min(math.ceil(bottom), self.max_shape[1])))
+
+    def _draw_text(self, text: str, font_path: str, font_size: float, color: Tuple[int, ...],
+                   bg_color: Tuple[int, ...], mode: str, align: str) -> Image:
+        """ Rasterise a text string with Pillow and trim it (see `_render_text`).
+        """
+        # Optional: Load a font, otherwise it will use the default font (Arial)
+        font = font_registry.get(font_path, font_size)
+
+        if self.measure_text:
+            canvas_shape = self.measure_text_shape(text, font, align)
+        else:
+            canvas_shape = self.max_shape
+
         if mode == "F":
-            img = Image.new('L', self.max_shape, 0)
-        elif mode == "RGB":
+            img = Image.new('L', canvas_shape, 0)
+        else:
+            img = Image.new('RGB', canvas_shape, bg_color)
+        draw = ImageDraw.Draw(img)
+
+        # Add text to the image and trim
+        if mode == "F":
+            draw.multiline_text((0, 0), text, fill=255, font=font, anchor="la", align=align)
+        else:
+            draw.multiline_text((0, 0), text, fill=color, font=font, anchor="la", align=align)
+        return self.trim_image(img, bg_color=bg_color)
+
+    def _compose_text(self, text: str, font_path: str, font_size: float, color: Tuple[int, ...],
+                      bg_color: Tuple[int, ...], mode: str, align: str) -> Image:
+        """ Compose a text string from its font's glyph atlas (see `_render_text`).
+        """
+        coverage = font_registry.atlas(font_path, font_size).render(text, align)
+
+        # Blend the color over the background with the coverage, rounding as Pillow does.
+        alpha = coverage[..., np.newaxis].astype(np.int32)
+        blend = np.array(bg_color[0:3]) * (255 - alpha) + np.array(color[0:3]) * alpha + 128
+        img = Image.fromarray(((blend + (blend >> 8)) >> 8).astype(np.uint8), mode="RGB")
+        return self.trim_image(img, bg_color=bg_color)  # Faint edges may round to the background.
+
+    def _compose_value(self, text: str, font_path: str, font_size: float, value: float,
+                       bg_value: float, align: str, pad: Tuple[int, int, int, int]) -> Image:
+        """ Compose a padded greyscale text image from its font's glyph atlas (see `_render_text`).
+        """
+        coverage = font_registry.atlas(font_path, font_size).render(text, align)
+        rows, columns = coverage.shape
+        left, right, top, bottom = pad
+        arr = np.zeros((top + rows + bottom, left + columns + right), dtype=np.float32)
+        text_arr = arr[top:top + rows, left:left + columns]
+        text_arr[...] = coverage
+        np.multiply(text_arr, value, out=text_arr)  # As for drawn text, so the values are the same.
+        np.divide(text_arr, 255, out=text_arr)
+        arr[arr == 0] = bg_value
+        return Image.fromarray(arr, mode="F")
+
+    def _render_text(self, text: str, font_path: str, font_size: float, value: float,
+                     color: Tuple[int, int, int], bg_value: float, bg_color: Tuple[int, int, int],
+                     mode: str, align: str, pad: Tuple[int, int, int, int]) -> Image:
+        """ Render a text string into an image (see `text_to_image`).
+        """
+        if mode == "RGB":
             color = color[0:3]  # Remove alpha if present.
             bg_color = bg_color[0:3]
-            img = Image.new('RGB', self.max_shape, bg_color)
         elif mode == "RGBA":
             if len(color) == 3:
                 color = self.append_value_to_tuple(255, color)  # Add alpha if not present.
             if len(bg_color) == 3:
                 bg_color = self.append_value_to_tuple(255, bg_color)
-            img = Image.new('RGB', self.max_shape, bg_color)
-        else:
+        elif mode != "F":
             raise ValueError("Mode must be F, RGB, or RGBA.")
-        draw = ImageDraw.Draw(img)
 
-        # Optional: Load a font, otherwise it will use the default font
-        if font_path:
-            font = ImageFont.truetype(font_path, font_size)
+        if self.glyph_atlas and text.strip() != "":
+            if mode == "F":
+                return self._compose_value(text, font_path, font_size, value, bg_value, align, pad)
+            img = self._compose_text(text, font_path, font_size, color, bg_color, mode, align)
         else:
-            font = ImageFont.truetype("Arial.ttf", font_size)
-
-        # Add text to the image and trim
-        if mode == "F":
-            draw.multiline_text((0, 0), text, fill=255, font=font, anchor="la", align=align)
-        else:
-            draw.multiline_text((0, 0), text, fill=color, font=font, anchor="la", align=align)
-
-        # Trim and pad the image
-        img = self.trim_image(img, bg_color=bg_color)
+            img = self._draw_text(text, font_path, font_size, color, bg_color, mode, align)
         img = self.pad_image(img, pad)
 
         # Convert to float if greyscale
         if mode == "F":
-            arr = np.array(img).astype("float32")
-            arr = arr * value / 255
+            arr = np.asarray(img).astype("float32")
+            np.multiply(arr, value, out=arr)  # In place, as the text image can be large.
+            np.divide(arr, 255, out=arr)
             arr[arr == 0] = bg_value
             img = Image.fromarray(arr, mode="F")
 
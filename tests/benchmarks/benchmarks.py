@@ -0,0 +1,207 @@
+""" Microbenchmarks for Text2Image and the server hot path.
+
+Run from the repository root (with the package installed), for example:
+
+    python tests/benchmarks/benchmarks.py --save baseline.json
+    python tests/benchmarks/benchmarks.py --compare baseline.json --threshold 0.25
+
+The second command exits with status 1 if any benchmark is more than 25 % slower than the
+baseline. Baselines are only comparable on the same machine.
+"""
+
+import argparse
+import itertools
+import json
+import statistics
+import sys
+import time
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+from pyosirix_example.grpc_protocols import server_pb2
+from pyosirix_example.server.server import Service
+from pyosirix_example.utilities.pixel_codec import encode_array
+from pyosirix_example.utilities.text_2_image import Text2Image
+
+SIZES = (256, 512, 1024, 2048, 4096)
+MODES = ("F", "RGB", "RGBA")
+TEXTS = {"short": "Slice 1",
+         "medium": "Patient: Anonymous, Study: MR Pelvis",
+         "long": "\n".join(["Patient: Anonymous", "Study: MR Pelvis", "Series: T2W Axial",
+                            "Slice thickness: 3.0 mm", "Not for clinical use"])}
+
+
+class _FixedText:
+    """ Stands in for the DataLoader so the benchmarks never download data. """
+    data = TEXTS["medium"]
+
+
+def time_call(function: Callable, min_time: float = 0.05, repeats: int = 5) -> float:
+    """ The median time of a call (seconds).
+
+    Args:
+        function (Callable): The function to call (without arguments).
+        min_time (float): Each repeat calls the function enough times to take at least this long.
+        repeats (int): The number of repeats.
+
+    Returns:
+        float: The median time per call.
+    """
+    function()  # Warm up (caches, fonts, etc.).
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2
+    times = [elapsed / number]
+    for _ in range(repeats - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        times.append((time.perf_counter() - start) / number)
+    return statistics.median(times)
+
+
+def make_array(size: int, mode: str) -> np.ndarray:
+    """ A random test image of shape (size, size) for mode F, or (size, size, 3 or 4) otherwise.
+    """
+    rng = np.random.default_rng(0)
+    if mode == "F":
+        return rng.uniform(0, 4095, (size, size)).astype("float32")
+    return rng.integers(0, 255, (size, size, len(mode)), dtype=np.uint8)
+
+
+def benchmark_cases(sizes: Iterable[int] = SIZES,
+                    modes: Iterable[str] = MODES) -> List[Tuple[str, Callable]]:
+    """ The benchmarks to run, as (name, function) pairs.
+    """
+    cases = []
+    t2i = Text2Image()
+    t2i_measured = Text2Image(measure_text=True)
+    t2i_direct = Text2Image(measure_text=True, direct_size=True)
+    t2i_atlas = Text2Image(glyph_atlas=True)
+    for length, text in TEXTS.items():
+        cases.append((f"text_to_image[{length}]", lambda text=text: t2i.text_to_image(text)))
+        cases.append((f"text_to_image_measured[{length}]",
+                      lambda text=text: t2i_measured.text_to_image(text)))
+        cases.append((f"text_to_image_atlas[{length}]",
+                      lambda text=text: t2i_atlas.text_to_image(text)))
+
+    # Distinct labels (e.g. slice numbers), so that no rendered overlay can be reused.
+    labels = itertools.count()
+    for name, renderer in (("pil", t2i_measured), ("atlas", t2i_atlas)):
+        cases.append((f"text_to_image_labels[{name}]",
+                      lambda renderer=renderer: renderer.text_to_image(f"Slice {next(labels)}")))
+
+    for size in sizes:
+        image = Image.new("L", (size, size))
+        image.paste(255, (size // 4, size // 4, size // 2, size // 2))
+        cases.append((f"trim_image[{size}]", lambda image=image: t2i.trim_image(image)))
+
+    for mode in modes:
+        text_image = t2i_measured.text_to_image(TEXTS["medium"], mode=mode)
+        for size in sizes:
+            array = make_array(size, mode)
+            base = Image.fromarray(array, mode=mode)
+            cases.append((f"paste_image_in_image[{mode}-{size}]",
+                          lambda text_image=text_image, base=base:
+                          t2i.paste_image_in_image(text_image, base.copy())))
+            for engine in ("pil", "numpy"):
+                cases.append((f"paste_text_in_array[{engine}-{mode}-{size}]",
+                              lambda array=array, engine=engine:
+                              t2i_measured.paste_text_in_array(TEXTS["medium"], array,
+                                                               engine=engine)))
+            cases.append((f"paste_text_in_array[direct-{mode}-{size}]",
+                          lambda array=array: t2i_direct.paste_text_in_array(
+                              TEXTS["medium"], array, engine="numpy")))
+
+    service = Service(cache_bytes=64 * 1024 ** 2)
+    service.data_loader = _FixedText()
+    for size in sizes:
+        request = server_pb2.Image(**encode_array(make_array(size, "F")))
+        cases.append((f"service_process[{size}]",
+                      lambda request=request: service.process(request)))
+    return cases
+
+
+def run(sizes: Iterable[int] = SIZES, modes: Iterable[str] = MODES, min_time: float = 0.05,
+        repeats: int = 5, pattern: str = None) -> Dict[str, float]:
+    """ Run the benchmarks.
+
+    Args:
+        sizes (Iterable[int]): The image sizes (rows and columns) to test.
+        modes (Iterable[str]): The image modes to test.
+        min_time (float): The minimum duration of each repeat (seconds).
+        repeats (int): The number of repeats of each benchmark.
+        pattern (str): Only run benchmarks whose name contains this string. Default is None.
+
+    Returns:
+        Dict[str, float]: The median time per call (seconds) of each benchmark.
+    """
+    results = {}
+    for name, function in benchmark_cases(sizes, modes):
+        if pattern is None or pattern in name:
+            results[name] = time_call(function, min_time, repeats)
+    return results
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float],
+            threshold: float = 0.25) -> List[Tuple[str, float]]:
+    """ Find the benchmarks that are slower than the baseline by more than a threshold.
+
+    Args:
+        results (Dict[str, float]): The new results.
+        baseline (Dict[str, float]): The baseline results. Benchmarks missing from either are
+            ignored.
+        threshold (float): The allowed fractional slow-down. Default is 0.25 (25 %).
+
+    Returns:
+        List[Tuple[str, float]]: The (name, ratio of new to baseline time) of each regression.
+    """
+    regressions = []
+    for name, seconds in results.items():
+        if name in baseline and baseline[name] > 0:
+            ratio = seconds / baseline[name]
+            if ratio > 1 + threshold:
+                regressions.append((name, ratio))
+    return regressions
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES)
+    parser.add_argument("--min-time", type=float, default=0.05)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("-k", dest="pattern", help="Only run benchmarks containing this string.")
+    parser.add_argument("--save", help="Save the results as JSON to this path.")
+    parser.add_argument("--compare", help="Compare the results with this JSON baseline.")
+    parser.add_argument("--threshold", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.modes, args.min_time, args.repeats, args.pattern)
+    for name, seconds in results.items():
+        print(f"{name:45s} {seconds * 1000:10.3f} ms")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for name, ratio in regressions:
+            print(f"REGRESSION {name}: {ratio:.2f}x the baseline time")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
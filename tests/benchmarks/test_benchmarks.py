@@ -0,0 +1,35 @@
+""" Checks that the benchmark suite runs; timings themselves are only compared by benchmarks.py. """
+
+import json
+
+import benchmarks
+
+
+def test_run_small():
+    results = benchmarks.run(sizes=[128], modes=["F", "RGB"], min_time=0.0, repeats=1)
+
+    assert "service_process[128]" in results
+    assert "paste_text_in_array[numpy-RGB-128]" in results
+    assert "trim_image[128]" in results
+    assert all(seconds > 0 for seconds in results.values())
+
+
+def test_compare():
+    baseline = {"a": 1.0, "b": 1.0, "c": 1.0}
+    results = {"a": 1.1, "b": 2.0, "d": 5.0}
+
+    assert benchmarks.compare(results, baseline, threshold=0.25) == [("b", 2.0)]
+    assert benchmarks.compare(results, baseline, threshold=1.5) == []
+
+
+def test_main_save_and_compare(tmp_path):
+    path = str(tmp_path / "baseline.json")
+    args = ["--sizes", "128", "--modes", "F", "--min-time", "0", "--repeats", "1", "-k", "trim"]
+    assert benchmarks.main(args + ["--save", path]) == 0
+    with open(path) as f:
+        baseline = json.load(f)
+    assert list(baseline) == ["trim_image[128]"]
+
+    with open(path, "w") as f:
+        json.dump({name: seconds / 100 for name, seconds in baseline.items()}, f)
+    assert benchmarks.main(args + ["--compare", path]) == 1
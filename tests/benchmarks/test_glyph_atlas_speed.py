@@ -0,0 +1,32 @@
+""" Speed targets of text composed from a glyph atlas, for labels that change on every slice. """
+
+import itertools
+
+import benchmarks
+from pyosirix_example.utilities.font_registry import font_registry
+from pyosirix_example.utilities.text_2_image import Text2Image
+
+RENDER_BUDGET = 250e-6  # Seconds. Generous, as a short label takes tens of microseconds.
+MIN_SPEEDUP = 3  # Over Pillow, which rasterises every glyph again for each label.
+
+
+def labels():
+    """ New slice labels, so that nothing is reused between calls.
+    """
+    return (f"Slice {i}" for i in itertools.count())
+
+
+def test_render_within_budget():
+    atlas = font_registry.atlas(None, 40)
+    texts = labels()
+    seconds = benchmarks.time_call(lambda: atlas.render(next(texts)), min_time=0.1)
+    assert seconds < RENDER_BUDGET
+
+
+def test_text_to_image_faster_than_pillow():
+    t2i_pil = Text2Image(measure_text=True)
+    t2i_atlas = Text2Image(measure_text=True, glyph_atlas=True)
+    texts = labels()
+    pil = benchmarks.time_call(lambda: t2i_pil.text_to_image(next(texts)), min_time=0.1)
+    atlas = benchmarks.time_call(lambda: t2i_atlas.text_to_image(next(texts)), min_time=0.1)
+    assert atlas * MIN_SPEEDUP < pil
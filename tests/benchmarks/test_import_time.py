@@ -0,0 +1,44 @@
+""" Import-time budget of the package. """
+
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+IMPORT_BUDGET = 0.25  # Seconds. Generous, as the package itself should take a few milliseconds.
+HEAVY_MODULES = ("dvc", "grpc", "osirix", "PIL", "numpy")
+
+SCRIPT = f"""
+import json, sys, time
+start = time.perf_counter()
+import pyosirix_example
+seconds = time.perf_counter() - start
+version = pyosirix_example.__version__
+print(json.dumps({{"seconds": seconds,
+                  "loaded": [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+
+def import_package() -> dict:
+    """ Import the package in a fresh interpreter, as on startup.
+    """
+    output = subprocess.run([sys.executable, "-c", SCRIPT], cwd=ROOT, capture_output=True,
+                            text=True, check=True).stdout
+    return json.loads(output)
+
+
+def test_import_does_not_load_heavy_modules():
+    assert import_package()["loaded"] == []
+
+
+def test_import_time_within_budget():
+    seconds = min(import_package()["seconds"] for _ in range(3))  # Ignore one-off disk delays.
+    assert seconds < IMPORT_BUDGET
+
+
+def test_submodules_load_on_access():
+    import pyosirix_example
+
+    assert pyosirix_example.utilities.pixel_codec.encode_array is not None
+    assert "server" in dir(pyosirix_example)
@@ -0,0 +1,96 @@
+""" Peak-memory budgets of the rendering and processing hot paths. """
+
+import numpy as np
+import pytest
+
+from pyosirix_example.grpc_protocols import server_pb2
+from pyosirix_example.utilities.memory_profile import memory_profiler
+from pyosirix_example.utilities.pixel_codec import encode_array
+from pyosirix_example.utilities.text_2_image import Text2Image
+
+# Reference images: a CT slice, an RGB screen capture and a large (e.g. X-ray) image.
+REFERENCE_IMAGES = [((512, 512), "int16"), ((512, 512), "float32"), ((512, 512, 3), "uint8"),
+                    ((2048, 2048), "float32")]
+OVERHEAD = 256 * 1024  # Bytes allowed on top of each budget for bookkeeping.
+# Bytes allowed per image pixel for the text image, which grows with it. At the server's scale, the
+# (float32) text image is about a fifth of the image, and the cached image is alive along with the
+# two copies that `np.asarray(image)` makes of it (Pillow's `tobytes` joins its chunks).
+TEXT_BYTES_PER_PIXEL = 3
+
+
+@pytest.fixture(scope="function")
+def profiler():
+    memory_profiler.enable()
+    memory_profiler.reset()
+    yield memory_profiler
+    memory_profiler.disable()
+    memory_profiler.reset()
+
+
+def output_dtype(shape, dtype) -> np.dtype:
+    """ The dtype of a pasted array (see `Text2Image.output_dtype`).
+    """
+    return Text2Image.output_dtype(np.empty(0, dtype)) if len(shape) == 2 else np.dtype("uint8")
+
+
+def allowance(shape) -> int:
+    """ The memory allowed for rendering the text for an image, on top of any copies of it.
+    """
+    return OVERHEAD + TEXT_BYTES_PER_PIXEL * shape[0] * shape[1]
+
+
+def peak(name: str) -> int:
+    return memory_profiler.snapshot()[name]["max"]
+
+
+@pytest.mark.parametrize("shape, dtype", REFERENCE_IMAGES)
+def test_paste_text_in_array_numpy(profiler, shape, dtype):
+    array = np.zeros(shape, dtype=dtype)
+    Text2Image(measure_text=True).paste_text_in_array("Test\ntext", array, engine="numpy")
+
+    # A single copy of the array: the text is rendered, resized and masked at its own size.
+    output_bytes = int(np.prod(shape)) * output_dtype(shape, dtype).itemsize
+    assert peak("Text2Image.paste_text_in_array") <= output_bytes + allowance(shape)
+
+
+def test_full_canvas_exceeds_budget(profiler):
+    array = np.zeros((512, 512), dtype="float32")
+    Text2Image(measure_text=False).paste_text_in_array("Test\ntext", array, engine="numpy")
+
+    # Without `measure_text`, the text is drawn on a canvas of `max_shape` (5000x5000), which is
+    # allocated by Pillow rather than traced by `tracemalloc`.
+    assert peak("Text2Image.paste_text_in_array") > array.nbytes + allowance(array.shape)
+
+
+@pytest.mark.parametrize("shape, dtype", REFERENCE_IMAGES)
+def test_paste_text_in_array_numpy_in_place(profiler, shape, dtype):
+    array = np.zeros(shape, dtype=output_dtype(shape, dtype))
+    Text2Image(measure_text=True).paste_text_in_array("Test\ntext", array, engine="numpy",
+                                                      in_place=True)
+
+    assert peak("Text2Image.paste_text_in_array") <= allowance(shape)
+
+
+@pytest.mark.parametrize("shape, dtype", REFERENCE_IMAGES)
+def test_paste_text_in_array_pil(profiler, shape, dtype):
+    array = np.zeros(shape, dtype=dtype)
+    Text2Image(measure_text=True).paste_text_in_array("Test\ntext", array)
+
+    # The (float32, if greyscale) copy given to Pillow, Pillow's own image, and the bytes that
+    # `np.array(image)` copies the result out of, before any conversion back to int16/uint16.
+    budget = 3 * array.size * (4 if array.ndim == 2 else 1)
+    assert peak("Text2Image.paste_text_in_array") <= budget + allowance(shape)
+
+
+@pytest.mark.parametrize("shape, dtype", REFERENCE_IMAGES)
+def test_process(profiler, service, shape, dtype):
+    array = np.zeros(shape, dtype=dtype)
+    request = server_pb2.Image(**encode_array(array))
+    service.process(request)
+
+    # The pixels copied out of the request and the (writeable) decoded array, which is then pasted
+    # in place, and later the array and the pixels of the reply.
+    assert peak("Service.process/decode") <= 2 * array.nbytes + OVERHEAD
+    assert peak("Service.process/render") <= allowance(shape)
+    assert peak("Service.process/encode") <= array.nbytes + OVERHEAD
+    assert peak("Service.process") <= 2 * array.nbytes + allowance(shape)
@@ -0,0 +1,203 @@
+""" Unit tests for the balancer module. """
+
+from concurrent import futures
+import time
+
+import grpc
+import pytest
+
+from pyosirix_example.client.balancer import Balancer
+from pyosirix_example.client.channel_pool import ChannelPool
+from pyosirix_example.client.client import Client
+from pyosirix_example.grpc_protocols import server_pb2_grpc
+from pyosirix_example.server.data_loader import DataLoader
+from pyosirix_example.server.server import Service, server_options
+from test_client import FakePix
+
+
+@pytest.fixture(scope="function")
+def servers(monkeypatch):
+    """ Three local servers on different ports, as (address, service, server) tuples.
+    """
+    monkeypatch.setattr(DataLoader, "data", property(lambda self: "Test"))
+    servers = []
+    for _ in range(3):
+        service = Service()
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=2), options=server_options())
+        server_pb2_grpc.add_ServiceServicer_to_server(service, server)
+        port = server.add_insecure_port("127.0.0.1:0")
+        server.start()
+        servers.append((f"127.0.0.1:{port}", service, server))
+    yield servers
+    for _, _, server in servers:
+        server.stop(None)
+
+
+@pytest.fixture(scope="function")
+def pool():
+    pool = ChannelPool(initial_backoff_ms=100, max_backoff_ms=100)
+    yield pool
+    pool.close()
+
+
+def requests_per_server(servers):
+    return [service.metrics.snapshot()["counters"].get("requests", 0)
+            for _, service, _ in servers]
+
+
+def test_round_robin(servers, pool):
+    balancer = Balancer([address for address, _, _ in servers], channel_pool=pool)
+    client = Client(balancer=balancer, channel_pool=pool)
+    for _ in range(6):
+        pix = FakePix()
+        client.write_text_in_pix("Test", pix)
+        assert pix.image.max() > 0
+
+    assert requests_per_server(servers) == [2, 2, 2]
+
+
+def test_least_loaded(servers, pool):
+    balancer = Balancer([address for address, _, _ in servers], policy="least_loaded",
+                        channel_pool=pool)
+    balancer.check()
+    balancer.started(servers[0][0])  # As if busy with another call.
+    balancer.started(servers[1][0])
+
+    assert balancer.address() == servers[2][0]
+
+
+def test_unhealthy_server_is_dropped(servers, pool):
+    addresses = [address for address, _, _ in servers]
+    servers[1][2].stop(None)
+    balancer = Balancer(addresses, channel_pool=pool, check_timeout=0.5)
+
+    assert balancer.check() == {addresses[0]: True, addresses[1]: False, addresses[2]: True}
+    assert balancer.healthy == [addresses[0], addresses[2]]
+    assert {balancer.address() for _ in range(4)} == {addresses[0], addresses[2]}
+
+
+def test_pipelined_skips_failed_server(servers, pool):
+    addresses = [address for address, _, _ in servers]
+    balancer = Balancer(addresses, channel_pool=pool, check_interval=60)
+    balancer.check()
+    servers[0][2].stop(None)  # Fails after the health check, so calls to it fail.
+    client = Client(balancer=balancer, channel_pool=pool, max_in_flight=3)
+    pixes = [FakePix() for _ in range(6)]
+    client.write_text_in_pix_list_pipelined("Test", {0: pixes})
+
+    assert all(pix.image.max() > 0 for pix in pixes)
+    assert addresses[0] not in balancer.healthy
+    assert sum(requests_per_server(servers[1:])) == 6
+
+
+def test_series_stream_is_loaded(servers, pool, monkeypatch):
+    addresses = [address for address, _, _ in servers]
+    balancer = Balancer(addresses, policy="least_loaded", channel_pool=pool, check_interval=60)
+    balancer.check()
+    calls = []
+    for name in ("started", "finished"):
+        method = getattr(balancer, name)
+        monkeypatch.setattr(balancer, name, lambda address, name=name, method=method:
+                            calls.append((name, address, balancer.address())) or method(address))
+    Client(balancer=balancer, channel_pool=pool).write_text_in_pix_list("Test", {0: [FakePix()]})
+
+    # While the stream is open, its server is not the least loaded.
+    assert calls[0][0:2] == ("started", addresses[0]) and calls[0][2] == addresses[0]
+    assert calls[1][0:2] == ("finished", addresses[0]) and calls[1][2] != addresses[0]
+
+
+def test_series_stream_skips_failed_server(servers, pool):
+    addresses = [address for address, _, _ in servers]
+    balancer = Balancer(addresses, channel_pool=pool, check_interval=60)
+    balancer.check()
+    servers[0][2].stop(None)  # Fails after the health check, so the stream to it fails.
+    pixes = [FakePix() for _ in range(4)]
+    Client(balancer=balancer, channel_pool=pool).write_text_in_pix_list("Test", {0: pixes})
+
+    assert all(pix.image.max() > 0 for pix in pixes)
+    assert addresses[0] not in balancer.healthy
+    assert sum(requests_per_server(servers[1:])) == 4
+
+
+def test_register_overlay_on_every_server(servers, pool):
+    balancer = Balancer([address for address, _, _ in servers], channel_pool=pool)
+    client = Client(balancer=balancer, channel_pool=pool)
+    client.register_overlay("Registered", location=4)
+
+    assert all(len(service.overlays) == 1 for _, service, _ in servers)
+    pix = FakePix()
+    client.write_text_in_pix("Test", pix)
+    assert pix.image[16:, :16].max() > 0  # Bottom left.
+
+
+class SlowHealthService(Service):
+    """ A service whose health checks take a while, or are rejected, as when it is very busy. """
+    def __init__(self, delay=0.0, code=None):
+        super().__init__()
+        self.delay = delay
+        self.code = code
+
+    def Health(self, request, context):
+        time.sleep(self.delay)
+        if self.code is not None:
+            context.abort(self.code, "Busy.")
+        return super().Health(request, context)
+
+
+@pytest.fixture(scope="function")
+def start_server():
+    started = []
+
+    def start(service):
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=2), options=server_options())
+        server_pb2_grpc.add_ServiceServicer_to_server(service, server)
+        port = server.add_insecure_port("127.0.0.1:0")
+        server.start()
+        started.append(server)
+        return f"127.0.0.1:{port}"
+    yield start
+    for server in started:
+        server.stop(None)
+
+
+def test_busy_servers_are_loaded_not_dropped(servers, pool, start_server):
+    exhausted = start_server(SlowHealthService(code=grpc.StatusCode.RESOURCE_EXHAUSTED))
+    slow = start_server(SlowHealthService(delay=0.5))
+    balancer = Balancer([exhausted, slow, servers[0][0]], policy="least_loaded",
+                        channel_pool=pool, check_timeout=0.2)
+
+    assert balancer.check() == {exhausted: True, slow: True, servers[0][0]: True}
+    assert balancer.address() == servers[0][0]
+    for _ in range(5):  # The idle server is preferred until it is busier than the others.
+        balancer.started(servers[0][0])
+    assert balancer.address() in (exhausted, slow)
+
+
+def test_checks_are_concurrent(pool, start_server):
+    addresses = [start_server(SlowHealthService(delay=0.3)) for _ in range(3)]
+    balancer = Balancer(addresses, channel_pool=pool, check_interval=0.0, check_timeout=2.0)
+    start = time.monotonic()
+    balancer.check()
+    assert time.monotonic() - start < 0.8  # Not one after another.
+
+    start = time.monotonic()
+    assert balancer.address() in addresses  # Stale, so refreshed in the background.
+    assert time.monotonic() - start < 0.2
+    for _ in range(50):  # Let the background check finish before the channels are closed.
+        if balancer._last_check > start:
+            break
+        time.sleep(0.02)
+    assert balancer._last_check > start
+
+
+def test_no_healthy_server(pool):
+    balancer = Balancer(["127.0.0.1:1"], channel_pool=pool, check_timeout=0.2)
+    with pytest.raises(RuntimeError, match="No healthy server"):
+        balancer.address()
+
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError, match="At least one address"):
+        Balancer([])
+    with pytest.raises(ValueError, match="Policy must be"):
+        Balancer(["127.0.0.1:1"], policy="random")
@@ -0,0 +1,46 @@
+""" Unit tests for the channel_pool module. """
+
+import grpc
+import numpy as np
+
+from pyosirix_example.client.channel_pool import ChannelPool
+from pyosirix_example.grpc_protocols import server_pb2
+from pyosirix_example.utilities.pixel_codec import decode_image, encode_array
+
+
+def test_channels_are_reused():
+    pool = ChannelPool()
+    assert pool.channel("127.0.0.1:1") is pool.channel("127.0.0.1:1")
+    assert pool.stub("127.0.0.1:1") is pool.stub("127.0.0.1:1")
+    assert pool.channel("127.0.0.1:2") is not pool.channel("127.0.0.1:1")
+    assert len(pool) == 2
+
+    pool.close("127.0.0.1:1")
+    assert len(pool) == 1
+    pool.close()
+    assert len(pool) == 0
+
+
+def test_options():
+    options = dict(ChannelPool(keepalive_time_ms=5000, max_message_length=1024).options)
+    assert options["grpc.keepalive_time_ms"] == 5000
+    assert options["grpc.max_receive_message_length"] == 1024
+    assert options["grpc.max_send_message_length"] == 1024
+
+
+def test_large_message(server_address):
+    pool = ChannelPool()
+    array = np.zeros((1500, 1500), dtype="float32")  # 9 MB, above the gRPC default of 4 MB.
+    response = pool.stub(server_address).ProcessImage(server_pb2.Image(**encode_array(array)))
+    pool.close()
+
+    assert decode_image(response).shape == (1500, 1500)
+
+
+def test_compressed_channel(server_address):
+    pool = ChannelPool(compression=grpc.Compression.Gzip)
+    array = np.zeros((256, 256), dtype="float32")
+    response = pool.stub(server_address).ProcessImage(server_pb2.Image(**encode_array(array)))
+    pool.close()
+
+    assert decode_image(response).max() > 0
@@ -0,0 +1,129 @@
+""" Unit tests for the client module. """
+
+import grpc
+import numpy as np
+import pytest
+
+from pyosirix_example.client.client import Client
+from pyosirix_example.grpc_protocols import server_pb2
+
+
+class FakePix:
+    """ Stands in for an OsiriX DCMPix, which needs a running OsiriX instance. """
+    def __init__(self, rows: int = 32, columns: int = 32, dtype: str = "float32"):
+        self.image = np.zeros((rows, columns), dtype=dtype)
+
+
+class FakeViewer:
+    """ Stands in for an OsiriX ViewerController. """
+    def __init__(self, frames: int = 2, slices: int = 3):
+        self.frames = [[FakePix() for _ in range(slices)] for _ in range(frames)]
+        self.updates = 0
+
+    @property
+    def max_movie_index(self) -> int:
+        return len(self.frames)
+
+    def pix_list(self, movie_idx: int):
+        return self.frames[movie_idx]
+
+    def needs_display_update(self):
+        self.updates += 1
+
+
+@pytest.fixture(scope="function")
+def client(server_address):
+    yield Client(server_address)
+
+
+def test_write_text_in_pix(client):
+    pix = FakePix()
+    client.write_text_in_pix("Test", pix)
+
+    assert pix.image.shape == (32, 32)
+    assert pix.image.max() > 0
+
+
+@pytest.mark.parametrize("values, dtype", [(1000.0, "int16"), (40000.0, "uint16"),
+                                           (0.5, "float32")])
+def test_write_text_in_pix_float64(client, service, values, dtype):
+    pix = FakePix(dtype="float64")  # As DCMPix.image returns for greyscale images.
+    pix.image[:] = values
+    client.write_text_in_pix("Test", pix)
+
+    received = service.metrics.snapshot()["counters"]["pixel_bytes_received"]
+    assert received == 32 * 32 * np.dtype(dtype).itemsize  # Not 8 bytes per pixel.
+    assert pix.image.dtype == dtype
+    assert (pix.image != values).any()  # The text was burnt in.
+
+
+def test_write_text_in_pix_patch_keeps_fractions(client):
+    pix = FakePix(64, 80, dtype="float64")
+    pix.image[-1, -1] = 0.25  # Outside the overlay, so not in the patch.
+    client.write_text_in_pix_patch("Test", pix)
+
+    assert pix.image.dtype == "float32"
+    assert pix.image[-1, -1] == 0.25
+    assert pix.image.max() > 0
+
+
+@pytest.mark.parametrize("compression", [grpc.Compression.Gzip, grpc.Compression.Deflate])
+def test_write_text_in_pix_compressed(server_address, compression):
+    client = Client(server_address, compression=compression, compress_threshold=1024)
+    pix = FakePix()
+    client.write_text_in_pix("Test", pix)
+
+    assert client.image_request(pix.image).encoding == server_pb2.DELTA_DEFLATE
+    assert pix.image.max() > 0
+
+
+def test_register_overlay(client):
+    overlay_id = client.register_overlay("Client text", location=4, scale=0.5)
+    pix = FakePix()
+    client.write_text_in_pix("Client text", pix)
+
+    assert client.overlay_id == overlay_id > 0
+    assert pix.image[16:, :16].max() > 0  # Bottom left.
+    assert pix.image[:16].max() == 0
+
+
+def test_write_text_in_viewer_controller(client):
+    viewer = FakeViewer()
+    client.write_text_in_viewer_controller("Test", viewer)
+
+    assert viewer.updates == 1
+    assert all(pix.image.max() > 0 for frame in viewer.frames for pix in frame)
+
+
+def test_write_text_in_viewer_controller_single_frame(client):
+    viewer = FakeViewer()
+    client.write_text_in_viewer_controller("Test", viewer, movie_idx=1)
+
+    assert all(pix.image.max() == 0 for pix in viewer.frames[0])
+    assert all(pix.image.max() > 0 for pix in viewer.frames[1])
+
+
+@pytest.mark.parametrize("max_in_flight", [1, 4, 100])
+def test_write_text_in_viewer_controller_pipelined(server_address, max_in_flight):
+    client = Client(server_address, max_in_flight=max_in_flight)
+    viewer = FakeViewer(frames=2, slices=5)
+    viewer.frames[1][2].image = np.zeros((40, 24), dtype="float32")  # Results must not be mixed up.
+    client.write_text_in_viewer_controller("Test", viewer, pipelined=True)
+
+    assert viewer.updates == 1
+    assert viewer.frames[1][2].image.shape == (40, 24)
+    assert all(pix.image.max() > 0 for frame in viewer.frames for pix in frame)
+
+
+def test_write_text_in_viewer_controller_patch(client):
+    viewer = FakeViewer(frames=1, slices=2)
+    expected = FakeViewer(frames=1, slices=2)
+    for pix, expected_pix in zip(viewer.frames[0], expected.frames[0]):
+        pix.image = expected_pix.image = np.full((64, 80), 3, dtype="float32")
+    client.write_text_in_viewer_controller("Test", expected)
+    client.write_text_in_viewer_controller("Test", viewer, patch=True)
+
+    assert viewer.updates == 1
+    assert len(client._placements) == 1
+    for pix, expected_pix in zip(viewer.frames[0], expected.frames[0]):
+        assert np.array_equal(pix.image, expected_pix.image)
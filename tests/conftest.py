@@ -1,10 +1,37 @@
 """ An example configuration file to demonstrate package-wide fixture sharing. """
 
+from concurrent import futures
+
+import grpc
 import pytest
 
+from pyosirix_example.grpc_protocols import server_pb2_grpc
+from pyosirix_example.server.data_loader import DataLoader
+from pyosirix_example.server.server import Service, server_options
+
 
 @pytest.fixture(scope='function')
 def shared_data():
     """ Example fixture, yielding test data shared across all test files in this directory.
     """
     yield [1, 2, 3, 4, 5]
+
+
+@pytest.fixture(scope="function")
+def service(monkeypatch):
+    """ A server Service that burns a fixed string rather than downloading the DVC data.
+    """
+    monkeypatch.setattr(DataLoader, "data", property(lambda self: "Test"))
+    yield Service()
+
+
+@pytest.fixture(scope="function")
+def server_address(service):
+    """ The address of a local gRPC server running `service` on a free port.
+    """
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=2), options=server_options())
+    server_pb2_grpc.add_ServiceServicer_to_server(service, server)
+    port = server.add_insecure_port("127.0.0.1:0")
+    server.start()
+    yield f"127.0.0.1:{port}"
+    server.stop(None)
@@ -0,0 +1,61 @@
+""" Unit tests for the data_loader module. """
+
+import os
+
+import pytest
+
+from pyosirix_example.server.data_loader import DataLoader
+
+
+@pytest.fixture(scope="function")
+def data_loader(tmp_path, monkeypatch):
+    downloads = []
+
+    def download(self):
+        downloads.append(1)
+        with open(self.data_path, "w") as f:
+            f.write("Downloaded")
+
+    monkeypatch.setattr(DataLoader, "__download_data__", download)
+    loader = DataLoader()
+    loader.data_directory = str(tmp_path)
+    loader.downloads = downloads
+    yield loader
+
+
+def test_data_path(data_loader):
+    assert os.path.basename(os.path.dirname(DataLoader().data_path)) == "data"
+
+
+def test_data_downloaded_once(data_loader):
+    assert data_loader.data == "Downloaded"
+    assert data_loader.data == "Downloaded"
+    assert len(data_loader.downloads) == 1
+
+
+def test_data_reloaded_when_changed(data_loader):
+    assert data_loader.data == "Downloaded"
+    with open(data_loader.data_path, "w") as f:
+        f.write("Changed text")
+    os.utime(data_loader.data_path, ns=(0, 0))
+
+    assert data_loader.data == "Changed text"
+
+
+def test_data_kept_in_memory(data_loader, monkeypatch):
+    assert data_loader.data == "Downloaded"
+
+    def fail(*args, **kwargs):
+        raise AssertionError("File read again.")
+
+    monkeypatch.setattr("builtins.open", fail)
+    assert data_loader.data == "Downloaded"
+
+
+def test_prefetch(data_loader):
+    data_loader.prefetch()
+    assert data_loader.data == "Downloaded"
+    assert len(data_loader.downloads) == 1
+
+    data_loader.prefetch(background=False)
+    assert len(data_loader.downloads) == 1
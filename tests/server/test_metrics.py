@@ -0,0 +1,64 @@
+""" Unit tests for the metrics module. """
+
+from concurrent import futures
+
+import pytest
+
+from pyosirix_example.server.metrics import Histogram, Metrics
+
+
+def test_histogram():
+    histogram = Histogram(bounds=(1.0, 2.0))
+    for value in (0.5, 1.0, 1.5, 3.0):
+        histogram.observe(value)
+
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.count == 4
+    assert histogram.total == pytest.approx(6.0)
+    assert histogram.quantile(0.5) == 1.0
+    assert histogram.quantile(1.0) == float("inf")
+
+
+def test_stage_and_counters():
+    metrics = Metrics()
+    with metrics.stage("work"):
+        pass
+    metrics.increment("requests")
+    metrics.increment("bytes", 10)
+
+    snapshot = metrics.snapshot()
+    assert snapshot["stages"]["work"][0] == 1
+    assert snapshot["counters"] == {"requests": 1, "bytes": 10}
+    assert "stage work: count=1" in metrics.to_text()
+
+    metrics.reset()
+    assert metrics.snapshot()["stages"] == {}
+
+
+def test_in_flight():
+    metrics = Metrics()
+    with metrics.in_flight():
+        assert metrics.gauges["in_flight"] == 1
+    assert metrics.gauges["in_flight"] == 0
+
+
+def test_disabled():
+    metrics = Metrics(enabled=False)
+    with metrics.stage("work"):
+        metrics.increment("requests")
+    assert metrics.snapshot()["stages"] == {} and metrics.counters == {}
+
+
+def test_thread_safety():
+    metrics = Metrics()
+
+    def work(_):
+        with metrics.in_flight(), metrics.stage("work"):
+            metrics.increment("requests")
+
+    with futures.ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(work, range(1000)))
+
+    assert metrics.counters["requests"] == 1000
+    assert metrics.histograms["work"].count == 1000
+    assert metrics.gauges["in_flight"] == 0
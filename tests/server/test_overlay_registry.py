@@ -0,0 +1,102 @@
+""" Unit tests for the overlay_registry module. """
+
+import numpy as np
+import pytest
+
+from pyosirix_example.server.overlay_registry import OverlayRegistry, OverlayRegistryFull
+from pyosirix_example.utilities.text_2_image import Text2Image
+
+KWARGS = dict(location=3, scale=0.5, value=10)
+
+
+@pytest.fixture(scope="function")
+def registry():
+    yield OverlayRegistry(Text2Image(measure_text=True))
+
+
+def test_register_returns_same_id(registry):
+    id_1 = registry.register("Test", KWARGS)
+    id_2 = registry.register("Test", dict(KWARGS))
+    id_3 = registry.register("Other", KWARGS)
+
+    assert id_1 == id_2 == 1
+    assert id_3 == 2
+    assert len(registry) == 2
+
+
+def test_paste_matches_text2image(registry):
+    overlay_id = registry.register("Test", KWARGS, shape=(64, 80))
+    array = np.random.default_rng(0).uniform(0, 5, (64, 80)).astype("float32")
+    expected = Text2Image(measure_text=True).paste_text_in_array("Test", array, engine="numpy",
+                                                                 **KWARGS)
+
+    assert np.array_equal(registry.paste(overlay_id, array, "Ignored"), expected)
+
+
+def test_paste_default_text(registry):
+    overlay_id = registry.register(None, KWARGS)
+    array = np.zeros((64, 80), dtype="float32")
+    expected = Text2Image(measure_text=True).paste_text_in_array("Default", array, **KWARGS)
+
+    assert np.array_equal(registry.paste(overlay_id, array, "Default"), expected)
+
+
+def test_overlays_are_pinned(registry, monkeypatch):
+    overlay_id = registry.register("Test", KWARGS)
+    array = np.zeros((64, 80), dtype="float32")
+    registry.paste(overlay_id, array, "")
+
+    def fail(*args, **kwargs):
+        raise AssertionError("Overlay rendered again.")
+    monkeypatch.setattr(registry.text_2_image, "prepare_overlay", fail)
+
+    assert registry.paste(overlay_id, array, "").max() > 0
+
+
+def test_register_cap():
+    registry = OverlayRegistry(Text2Image(measure_text=True), max_overlays=2)
+    registry.register("A", KWARGS)
+    registry.register("B", KWARGS)
+
+    assert registry.register("A", KWARGS) == 1  # Already registered, so not counted again.
+    with pytest.raises(OverlayRegistryFull):
+        registry.register("C", KWARGS)
+    assert len(registry) == 2
+
+
+def test_rendered_overlays_are_bounded():
+    registry = OverlayRegistry(Text2Image(measure_text=True))
+    overlay_id = registry.register(None, KWARGS, shape=(64, 80))
+    array = np.zeros((64, 80), dtype="float32")
+    registry.paste(overlay_id, array, "Slice 0")
+    registry.max_bytes = 3 * registry.size_bytes  # Room for about three.
+    for i in range(20):  # One overlay per slice text.
+        registry.paste(overlay_id, array, f"Slice {i}")
+
+    assert 0 < registry.size_bytes <= registry.max_bytes
+    assert registry.evictions > 0
+    expected = Text2Image(measure_text=True).paste_text_in_array("Slice 0", array, **KWARGS)
+    assert np.array_equal(registry.paste(overlay_id, array, "Slice 0"), expected)
+
+
+def test_fonts_restricted():
+    registry = OverlayRegistry(Text2Image(measure_text=True), fonts=["Arial.ttf"])
+    registry.register("Test", dict(KWARGS, font_path="Arial.ttf"))
+    registry.register("Test", KWARGS)
+
+    with pytest.raises(ValueError, match="not available"):
+        registry.register("Test", dict(KWARGS, font_path="/etc/passwd"))
+    assert len(registry) == 2
+
+
+def test_invalid_spec(registry):
+    with pytest.raises(ValueError, match="Location must be"):
+        registry.register("Test", dict(KWARGS, location=7))
+    with pytest.raises(ValueError, match="Cannot render overlay"):
+        registry.register("Test", dict(KWARGS, font_path="missing.ttf"))
+    assert len(registry) == 0
+
+
+def test_unknown_id(registry):
+    with pytest.raises(KeyError, match="Unknown overlay ID"):
+        registry.paste(3, np.zeros((8, 8)), "")
@@ -0,0 +1,69 @@
+""" Unit tests for the render_pool module. """
+
+import numpy as np
+import pytest
+
+from pyosirix_example.server.render_pool import RenderPool
+from pyosirix_example.utilities.overlay_store import OverlayStore
+from pyosirix_example.utilities.text_2_image import Text2Image
+
+
+@pytest.fixture(scope="module")
+def render_pool():
+    with RenderPool(processes=2, fonts=[("Arial.ttf", 40)], text="Test",
+                    render_kwargs={"value": 10}) as pool:
+        pool.warm_up()
+        yield pool
+
+
+@pytest.mark.parametrize("shape, dtype", [((64, 80), "float64"), ((64, 80), "float32"),
+                                          ((64, 80), "int16"), ((64, 80), "uint16"),
+                                          ((64, 80, 3), "uint8"), ((64, 80, 4), "uint8")])
+def test_paste_text_in_array_matches_text2image(render_pool, shape, dtype):
+    array = np.random.default_rng(0).uniform(0, 200, shape).astype(dtype)
+    result = render_pool.paste_text_in_array("Test", array, location=3, scale=0.5, value=10)
+    expected = Text2Image(measure_text=True).paste_text_in_array("Test", array, location=3,
+                                                                 scale=0.5, value=10)
+
+    assert result.dtype == expected.dtype
+    assert np.array_equal(result, expected)
+
+
+def test_paste_text_in_array_leaves_input(render_pool):
+    array = np.zeros((32, 32), dtype="float32")
+    result = render_pool.paste_text_in_array("Test", array)
+
+    assert result.max() > 0
+    assert array.max() == 0
+
+
+def test_paste_text_in_array_error(render_pool):
+    with pytest.raises(ValueError, match="Location must be"):
+        render_pool.paste_text_in_array("Test", np.zeros((32, 32)), location=7)
+
+
+def test_workers_share_store(tmp_path):
+    with RenderPool(processes=2, fonts=[("Arial.ttf", 40)], text="Test",
+                    render_kwargs={"value": 10}, store_directory=str(tmp_path)) as pool:
+        pool.warm_up()
+        result = pool.paste_text_in_array("Test", np.zeros((32, 32), dtype="float32"), value=10)
+
+    assert result.max() > 0
+    assert len(OverlayStore(str(tmp_path))) == 1  # The pre-rendered text, written once.
+
+
+def test_workers_prerender_direct_size(tmp_path):
+    with RenderPool(processes=1, fonts=[("Arial.ttf", 40)], text="Test",
+                    render_kwargs={"location": 3, "scale": 0.5, "value": 10},
+                    store_directory=str(tmp_path), direct_size=True,
+                    warm_shapes=[(64, 80), (128, 160)]) as pool:
+        pool.warm_up()
+        assert len(OverlayStore(str(tmp_path))) == 2  # One font size per image width.
+
+        result = pool.paste_text_in_array("Test", np.zeros((64, 80), dtype="float32"),
+                                          location=3, scale=0.5, value=10)
+    expected = Text2Image(measure_text=True, direct_size=True).paste_text_in_array(
+        "Test", np.zeros((64, 80), dtype="float32"), location=3, scale=0.5, value=10)
+
+    assert np.array_equal(result, expected)
+    assert len(OverlayStore(str(tmp_path))) == 2  # Already rendered by the worker.
@@ -0,0 +1,385 @@
+""" Unit tests for the server module. """
+
+import asyncio
+from concurrent import futures
+import threading
+import time
+import zlib
+
+import grpc
+import numpy as np
+import pytest
+
+from pyosirix_example.grpc_protocols import server_pb2, server_pb2_grpc
+from pyosirix_example.server.data_loader import DataLoader
+from pyosirix_example.server.render_pool import RenderPool
+from pyosirix_example.server.server import RequestShed, Service, create_async_server, \
+    server_options
+from pyosirix_example.utilities.memory_profile import memory_profiler
+from pyosirix_example.utilities.pixel_codec import DELTA_DEFLATE, decode_image, encode_array
+
+
+@pytest.fixture(scope="function")
+def stub(server_address):
+    with grpc.insecure_channel(server_address) as channel:
+        yield server_pb2_grpc.ServiceStub(channel)
+
+
+def test_process_raw_pixels(service):
+    array = np.zeros((64, 64), dtype="float32")
+    response = service.process(server_pb2.Image(**encode_array(array)))
+
+    assert len(response.image) == 0
+    result = decode_image(response)
+    assert result.shape == (64, 64)
+    assert result.max() > 0
+
+
+@pytest.mark.parametrize("dtype", ["int16", "uint16"])
+def test_process_integer_pixels(service, dtype):
+    array = np.zeros((64, 64), dtype=dtype)
+    request = server_pb2.Image(**encode_array(array))
+    response = service.process(request)
+
+    assert response.dtype == dtype
+    assert len(response.pixels) == array.nbytes  # Half the size of float32.
+    result = decode_image(response)
+    assert result.dtype == np.dtype(dtype)
+    assert result.max() == 4095
+
+
+def test_process_legacy_field(service):
+    array = np.zeros((64, 64), dtype="float32")
+    response = service.process(server_pb2.Image(**encode_array(array, legacy=True)))
+
+    assert len(response.pixels) == 0
+    assert len(response.image) == 64 * 64
+    assert decode_image(response).max() > 0
+
+
+@pytest.mark.parametrize("accept_compressed, threshold, encoding", [
+    (True, 1024, server_pb2.DELTA_DEFLATE),
+    (True, 1024 ** 2, server_pb2.RAW),  # Below the threshold.
+    (False, 1024, server_pb2.RAW),  # The client cannot decode it.
+])
+def test_process_compressed_reply(service, accept_compressed, threshold, encoding):
+    service.compress_threshold = threshold
+    array = np.zeros((64, 64), dtype="float32")
+    request = server_pb2.Image(**encode_array(array, compress=True),
+                               accept_compressed=accept_compressed)
+    response = service.process(request)
+
+    assert response.encoding == encoding
+    assert decode_image(response).max() > 0
+
+
+def test_process_image_rpc(stub):
+    array = np.zeros((32, 48), dtype="float32")
+    response = stub.ProcessImage(server_pb2.Image(**encode_array(array)))
+
+    assert decode_image(response).shape == (32, 48)
+
+
+def test_process_image_rpc_bad_pixels(stub):
+    request = server_pb2.Image(rows=2, columns=2, shape=[2, 2], dtype="float32",
+                               pixels=zlib.compress(bytes(1024 ** 2)), encoding=DELTA_DEFLATE)
+    with pytest.raises(grpc.RpcError) as e:
+        stub.ProcessImage(request)
+    assert e.value.code() == grpc.StatusCode.INVALID_ARGUMENT
+
+
+def test_process_image_rpc_unknown_dtype(stub):
+    image = server_pb2.Image(shape=[2, 2], dtype="foo", pixels=bytes(16))
+    with pytest.raises(grpc.RpcError) as e:
+        stub.ProcessImage(image)
+    assert e.value.code() == grpc.StatusCode.INVALID_ARGUMENT
+
+    with pytest.raises(grpc.RpcError) as e:
+        stub.ProcessPatch(server_pb2.Patch(shape=server_pb2.Shape(rows=2, columns=2),
+                                           placement=server_pb2.Placement(columns=2, rows=2),
+                                           image=image))
+    assert e.value.code() == grpc.StatusCode.INVALID_ARGUMENT
+
+
+def test_process_series_rpc(stub):
+    requests = [server_pb2.Slice(frame=frame,
+                                 index=index,
+                                 image=server_pb2.Image(**encode_array(np.zeros((16, 16)))))
+                for frame in range(2) for index in range(3)]
+    responses = list(stub.ProcessSeries(iter(requests)))
+
+    assert [(r.frame, r.index) for r in responses] == [(r.frame, r.index) for r in requests]
+    assert all(decode_image(r.image).max() > 0 for r in responses)
+
+
+def test_process_shares_overlay_cache(service):
+    for _ in range(3):
+        service.process(server_pb2.Image(**encode_array(np.zeros((16, 16)))))
+
+    assert service.text_2_image.cache.misses == 1
+    assert service.text_2_image.cache.hits == 2
+
+
+def test_async_server(service):
+    async def run():
+        server, port = create_async_server(service, port=0, render_workers=2)
+        await server.start()
+        try:
+            async with grpc.aio.insecure_channel(f"127.0.0.1:{port}") as channel:
+                stub = server_pb2_grpc.ServiceStub(channel)
+                image = server_pb2.Image(**encode_array(np.zeros((16, 16))))
+                single = await stub.ProcessImage(image)
+                series = [response async for response in stub.ProcessSeries(
+                    iter([server_pb2.Slice(frame=0, index=i, image=image) for i in range(3)]))]
+        finally:
+            await server.stop(None)
+        return single, series
+
+    single, series = asyncio.run(run())
+    assert decode_image(single).max() > 0
+    assert [response.index for response in series] == [0, 1, 2]
+
+
+class FakeContext:
+    """ Stands in for a grpc.ServicerContext. """
+    def __init__(self, active: bool = True, remaining: float = None):
+        self.active = active
+        self.remaining = remaining
+
+    def is_active(self) -> bool:
+        return self.active
+
+    def time_remaining(self) -> float:
+        return self.remaining
+
+
+@pytest.mark.parametrize("context, code, counter", [
+    (FakeContext(active=False), grpc.StatusCode.CANCELLED, "shed_cancelled"),
+    (FakeContext(remaining=0.0), grpc.StatusCode.DEADLINE_EXCEEDED, "shed_deadline_exceeded"),
+])
+def test_process_sheds_abandoned_calls(service, context, code, counter):
+    with pytest.raises(RequestShed) as error:
+        service.process(server_pb2.Image(**encode_array(np.zeros((16, 16)))), context)
+
+    assert error.value.code == code
+    snapshot = service.metrics.snapshot()
+    assert snapshot["counters"][counter] == 1
+    assert "render" not in snapshot["stages"]  # No work was done.
+    service.process(server_pb2.Image(**encode_array(np.zeros((16, 16)))), FakeContext(remaining=5))
+
+
+def test_process_rpc_sheds_expired_deadline(service, server_address, monkeypatch):
+    def slow_data(self):
+        time.sleep(0.3)  # Outlives the deadline.
+        return "Test"
+    monkeypatch.setattr(DataLoader, "data", property(slow_data))
+
+    with grpc.insecure_channel(server_address) as channel:
+        with pytest.raises(grpc.RpcError) as error:
+            server_pb2_grpc.ServiceStub(channel).ProcessImage(
+                server_pb2.Image(**encode_array(np.zeros((16, 16)))), timeout=0.1)
+    assert error.value.code() == grpc.StatusCode.DEADLINE_EXCEEDED
+
+    for _ in range(50):  # The server notices once the text has loaded.
+        if service.metrics.snapshot()["counters"].get("shed_deadline_exceeded"):
+            break
+        time.sleep(0.02)
+    assert service.metrics.snapshot()["counters"]["shed_deadline_exceeded"] == 1
+    assert "render" not in service.metrics.snapshot()["stages"]
+
+
+def test_async_server_queue_full(service, monkeypatch):
+    release = threading.Event()
+    process = service.process
+
+    def blocking_process(request, context=None):
+        release.wait(5)
+        return process(request, context)
+    monkeypatch.setattr(service, "process", blocking_process)
+
+    async def run():
+        server, port = create_async_server(service, port=0, render_workers=1, max_queue_depth=1)
+        await server.start()
+        try:
+            async with grpc.aio.insecure_channel(f"127.0.0.1:{port}") as channel:
+                stub = server_pb2_grpc.ServiceStub(channel)
+                image = server_pb2.Image(**encode_array(np.zeros((16, 16))))
+                admitted = [asyncio.ensure_future(stub.ProcessImage(image)) for _ in range(2)]
+                await asyncio.sleep(0.2)  # One running, one queued.
+                with pytest.raises(grpc.aio.AioRpcError) as error:
+                    await stub.ProcessImage(image)
+                release.set()
+                responses = await asyncio.gather(*admitted)
+        finally:
+            await server.stop(None)
+        return error.value.code(), responses
+
+    code, responses = asyncio.run(run())
+    assert code == grpc.StatusCode.RESOURCE_EXHAUSTED
+    assert all(decode_image(response).max() > 0 for response in responses)
+    assert service.metrics.snapshot()["counters"]["shed_queue_full"] == 1
+    assert service.metrics.snapshot()["gauges"]["pending"] == 0
+
+
+def test_sync_server_queue_full(service, monkeypatch):
+    service = Service(max_active=1, max_pending=2)  # The fixture's DataLoader patch still applies.
+    release = threading.Event()
+    process = service.process
+
+    def blocking_process(request, context=None):
+        release.wait(5)
+        return process(request, context)
+    monkeypatch.setattr(service, "process", blocking_process)
+
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=4), options=server_options())
+    server_pb2_grpc.add_ServiceServicer_to_server(service, server)
+    port = server.add_insecure_port("127.0.0.1:0")
+    server.start()
+    try:
+        with grpc.insecure_channel(f"127.0.0.1:{port}") as channel:
+            stub = server_pb2_grpc.ServiceStub(channel)
+            image = server_pb2.Image(**encode_array(np.zeros((16, 16))))
+            admitted = [stub.ProcessImage.future(image) for _ in range(2)]
+            for _ in range(50):  # One running, one queued.
+                if service.metrics.snapshot()["gauges"].get("pending") == 2:
+                    break
+                time.sleep(0.02)
+            with pytest.raises(grpc.RpcError) as error:
+                stub.ProcessImage(image)
+            status = stub.Health(server_pb2.HealthRequest(), timeout=1)  # Not queued.
+            release.set()
+            responses = [future.result() for future in admitted]
+    finally:
+        server.stop(None)
+
+    assert error.value.code() == grpc.StatusCode.RESOURCE_EXHAUSTED
+    assert status.serving and status.pending == 2
+    assert all(decode_image(response).max() > 0 for response in responses)
+    assert service.metrics.snapshot()["counters"]["shed_queue_full"] == 1
+    assert service.metrics.snapshot()["gauges"]["pending"] == 0
+
+
+def test_process_with_render_pool(service):
+    with RenderPool(processes=1, direct_size=True) as render_pool:
+        expected = service.process(server_pb2.Image(**encode_array(np.zeros((32, 32)))))
+        service.render_pool = render_pool
+        result = service.process(server_pb2.Image(**encode_array(np.zeros((32, 32)))))
+
+    assert np.array_equal(decode_image(result), decode_image(expected))
+
+
+def test_get_stats_rpc(stub):
+    stub.ProcessImage(server_pb2.Image(**encode_array(np.zeros((16, 16), dtype="float32"))))
+    stats = stub.GetStats(server_pb2.StatsRequest(include_text=True, reset=True))
+
+    stages = {stage.name: stage for stage in stats.stages}
+    for name in ("process", "decode", "load_text", "render", "text_to_image", "paste", "encode"):
+        assert stages[name].count == 1
+        assert len(stages[name].counts) == len(stages[name].bounds) + 1
+    assert "resize" not in stages  # The text is rendered at its final size.
+    assert stats.counters["requests"] == 1
+    assert stats.counters["pixel_bytes_received"] == 16 * 16 * 4
+    assert stats.gauges["in_flight"] == 0
+    assert "stage render" in stats.text
+
+    assert len(stub.GetStats(server_pb2.StatsRequest()).stages) == 0
+
+
+def test_stats_memory_peaks(service):
+    memory_profiler.enable()
+    try:
+        service.process(server_pb2.Image(**encode_array(np.zeros((256, 256), dtype="float32"))))
+        stats = service.stats(include_text=True, reset=True)
+    finally:
+        memory_profiler.disable()
+
+    assert stats.gauges["peak_bytes:Service.process"] >= 256 * 256 * 4
+    assert "peak_bytes:Service.process/render" in stats.gauges
+    assert "memory Service.process:" in stats.text
+    assert memory_profiler.snapshot() == {}
+
+
+def test_register_overlay_rpc(stub):
+    spec = server_pb2.OverlaySpec(text="Registered", location=6, scale=0.5, value=100)
+    overlay_id = stub.RegisterOverlay(spec).id
+    assert stub.RegisterOverlay(spec).id == overlay_id
+
+    array = np.zeros((64, 64), dtype="float32")
+    response = stub.ProcessImage(server_pb2.Image(**encode_array(array), overlay_id=overlay_id))
+    result = decode_image(response)
+
+    assert overlay_id > 0
+    assert result[32:, 32:].max() > 0  # Bottom right.
+    assert result[:32].max() == 0
+
+
+def test_register_overlay_font_size(service):
+    array = np.zeros((200, 300), dtype="float32")
+    results = []
+    for font_size in (None, 20, 80):
+        spec = server_pb2.OverlaySpec(text="Registered", location=1, scale=0.5, value=100,
+                                      font_size=font_size)
+        request = server_pb2.Image(**encode_array(array), overlay_id=service.register_overlay(spec))
+        results.append(decode_image(service.process(request)))
+
+    # The font size is honoured (text rendered at it, then resized) when set.
+    assert not np.array_equal(results[1], results[2])
+    assert not np.array_equal(results[0], results[1])
+
+
+def test_register_overlay_rpc_errors(stub):
+    with pytest.raises(grpc.RpcError) as error:
+        stub.RegisterOverlay(server_pb2.OverlaySpec(location=9))
+    assert error.value.code() == grpc.StatusCode.INVALID_ARGUMENT
+
+    with pytest.raises(grpc.RpcError) as error:
+        stub.ProcessImage(server_pb2.Image(**encode_array(np.zeros((8, 8))), overlay_id=99))
+    assert error.value.code() == grpc.StatusCode.NOT_FOUND
+
+
+def test_register_overlay_rpc_limits(stub, service):
+    with pytest.raises(grpc.RpcError) as error:
+        stub.RegisterOverlay(server_pb2.OverlaySpec(text="Test", font_path="/etc/passwd"))
+    assert error.value.code() == grpc.StatusCode.INVALID_ARGUMENT
+
+    service.overlays.max_overlays = 1
+    stub.RegisterOverlay(server_pb2.OverlaySpec(text="First"))
+    with pytest.raises(grpc.RpcError) as error:
+        stub.RegisterOverlay(server_pb2.OverlaySpec(text="Second"))
+    assert error.value.code() == grpc.StatusCode.RESOURCE_EXHAUSTED
+    assert service.metrics.counters["overlays_rejected"] == 1
+
+
+def test_health_rpc(stub, service):
+    with service.metrics.in_flight():
+        status = stub.Health(server_pb2.HealthRequest())
+
+    assert status.serving
+    assert status.in_flight == 1
+    assert stub.Health(server_pb2.HealthRequest()).in_flight == 0
+
+
+def test_process_patch_rpc(stub):
+    array = np.random.default_rng(0).uniform(0, 100, (300, 200)).astype("float32")
+    expected = decode_image(stub.ProcessImage(server_pb2.Image(**encode_array(array))))
+
+    placement = stub.GetOverlayPlacement(server_pb2.Shape(rows=300, columns=200))
+    rows = slice(placement.top, placement.top + placement.rows)
+    columns = slice(placement.left, placement.left + placement.columns)
+    response = stub.ProcessPatch(server_pb2.Patch(shape=server_pb2.Shape(rows=300, columns=200),
+                                                  placement=placement,
+                                                  image=server_pb2.Image(
+                                                      **encode_array(array[rows, columns]))))
+    array[rows, columns] = decode_image(response)
+
+    assert placement.rows * placement.columns < array.size / 4
+    assert np.array_equal(array, expected)
+
+
+def test_process_patch_rpc_bad_shape(stub):
+    request = server_pb2.Patch(shape=server_pb2.Shape(rows=300, columns=200),
+                               placement=server_pb2.Placement(left=0, top=0, columns=5, rows=5),
+                               image=server_pb2.Image(**encode_array(np.zeros((4, 4)))))
+    with pytest.raises(grpc.RpcError) as e:
+        stub.ProcessPatch(request)
+    assert e.value.code() == grpc.StatusCode.INVALID_ARGUMENT
@@ -0,0 +1,92 @@
+""" Unit tests for the font_registry module. """
+
+from PIL import ImageFont
+
+from pyosirix_example.utilities.font_registry import FontRegistry
+
+
+def test_get_memoises_fonts():
+    registry = FontRegistry()
+    font_1 = registry.get(None, 20)
+    font_2 = registry.get("Arial.ttf", 20)
+    font_3 = registry.get(None, 30)
+
+    assert isinstance(font_1, ImageFont.FreeTypeFont)
+    assert font_1 is font_2
+    assert font_3 is not font_1
+    assert len(registry) == 2
+
+
+def test_preload():
+    registry = FontRegistry()
+    registry.preload([("Arial.ttf", 12), ("Arial.ttf", 14), ("Arial.ttf", 12)])
+    assert len(registry) == 2
+
+    registry.clear()
+    assert len(registry) == 0
+
+
+def test_font_size_for_width():
+    registry = FontRegistry()
+    size = registry.font_size_for_width("Test text", 200)
+
+    assert registry.text_width("Test text", font_size=size) <= 200
+    assert registry.text_width("Test text", font_size=size + 1) > 200
+    assert registry.font_size_for_width("Test text", 400) > size
+
+
+def test_font_size_for_width_is_memoised():
+    registry = FontRegistry()
+    registry.font_size_for_width("Test", 100)
+    measured = len(registry._widths)
+    registry.font_size_for_width("Test", 100)
+
+    assert len(registry._widths) == measured
+
+
+def test_atlas_is_shared():
+    registry = FontRegistry()
+    atlas = registry.atlas(None, 20)
+
+    assert atlas is registry.atlas("Arial.ttf", 20)
+    assert atlas.font is registry.get(None, 20)
+    assert registry.atlas(None, 30) is not atlas
+
+    registry.clear()
+    assert registry.atlas(None, 20) is not atlas
+
+
+def test_measurements_are_bounded():
+    registry = FontRegistry(max_measurements=50)
+    sizes = [registry.font_size_for_width(f"Slice {i}", 300) for i in range(100)]
+
+    assert len(registry._widths) <= 50 and len(registry._sizes) <= 50
+    assert len(registry) == 0  # Measuring does not keep fonts loaded.
+    assert registry.font_size_for_width("Slice 99", 300) == sizes[-1]
+    assert registry.text_width("Slice 99", font_size=sizes[-1]) <= 300
+    assert registry.text_width("Slice 99", font_size=sizes[-1] + 1) > 300
+
+
+def test_measuring_fonts_are_loaded_once(monkeypatch):
+    loads = []
+    truetype = ImageFont.truetype
+    monkeypatch.setattr(ImageFont, "truetype", lambda *args: loads.append(args) or truetype(*args))
+    registry = FontRegistry(max_fonts=8)
+    sizes = {registry.font_size_for_width(f"Slice {i}", 300) for i in range(100)}
+
+    # Once each: the reference size, and each size found and its neighbours, not once per label.
+    assert len(loads) == len(set(loads)) <= 1 + 3 * len(sizes)
+    assert len(registry._measuring_fonts) <= 8
+
+
+def test_atlases_are_bounded():
+    registry = FontRegistry(max_atlases=2)
+    atlas = registry.atlas(None, 20)
+    registry.atlas(None, 30)
+    assert registry.atlas(None, 20) is atlas  # Now the most recently used.
+    registry.atlas(None, 40)
+
+    assert len(registry._atlases) == 2
+    assert registry.atlas(None, 20) is atlas
+    assert (registry._measuring_fonts.get(("Arial.ttf", 30)) is None and
+            ("Arial.ttf", 30) not in registry._atlases)
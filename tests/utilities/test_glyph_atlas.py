@@ -0,0 +1,56 @@
+""" Unit tests for the glyph_atlas module. """
+
+from PIL import Image, ImageDraw
+import numpy as np
+import pytest
+
+from pyosirix_example.utilities.font_registry import font_registry
+from pyosirix_example.utilities.glyph_atlas import GlyphAtlas
+from pyosirix_example.utilities.text_2_image import Text2Image
+
+
+def _pillow_coverage(text, font, align="left"):
+    """ The text drawn by Pillow at the origin and trimmed to its ink. """
+    img = Image.new("L", (2000, 1000), 0)
+    ImageDraw.Draw(img).multiline_text((0, 0), text, fill=255, font=font, anchor="la",
+                                       align=align)
+    return np.array(Text2Image.trim_image(img, bg_color=0))
+
+
+@pytest.mark.parametrize("font_size", [12, 40])
+@pytest.mark.parametrize("align", ["left", "center", "right"])
+@pytest.mark.parametrize("text", ["Slice 17", "AVAWAy, fi!", "Patient: Anonymous\nSlice 3/120",
+                                  "a\n\nWide line of text\n  indented"])
+def test_render_matches_pillow(text, align, font_size):
+    font = font_registry.get(None, font_size)
+    atlas = GlyphAtlas(font)
+
+    assert np.array_equal(atlas.render(text, align), _pillow_coverage(text, font, align))
+
+
+def test_render_adds_missing_glyphs():
+    font = font_registry.get(None, 20)
+    atlas = GlyphAtlas(font, characters="0123456789")
+    assert len(atlas) == 10 and "µ" not in atlas
+    nbytes = atlas.nbytes
+
+    assert np.array_equal(atlas.render("5 µm"), _pillow_coverage("5 µm", font))
+    assert "µ" in atlas and " " in atlas and "m" in atlas
+    assert len(atlas) == 13 and atlas.nbytes > nbytes
+
+
+@pytest.mark.parametrize("text", ["", " ", "  \n "])
+def test_render_no_ink(text):
+    coverage = GlyphAtlas(font_registry.get(None, 20)).render(text)
+    assert coverage.shape == (1, 1) and coverage.dtype == np.uint8 and coverage[0, 0] == 0
+
+
+def test_render_bad_align():
+    with pytest.raises(ValueError):
+        GlyphAtlas(font_registry.get(None, 20)).render("Test", align="justify")
+
+
+@pytest.mark.parametrize("text", ["Test", "AVAWAy", "Slice 17 / 120", ""])
+def test_text_length(text):
+    font = font_registry.get(None, 30)
+    assert GlyphAtlas(font).text_length(text) == pytest.approx(font.getlength(text))
@@ -0,0 +1,127 @@
+""" Unit tests for the memory_profile module. """
+
+import os
+import subprocess
+import sys
+import tracemalloc
+
+from PIL import Image
+import numpy as np
+import pytest
+
+from pyosirix_example.utilities.memory_profile import ENVIRONMENT_VARIABLE, MemoryProfiler, \
+    memory_profiler, profiled
+
+
+@pytest.fixture(scope="function")
+def profiler():
+    profiler = MemoryProfiler(enabled=True)
+    yield profiler
+    profiler.disable()
+
+
+def test_disabled_records_nothing():
+    profiler = MemoryProfiler()
+    with profiler.profile("block"):
+        np.ones(1024 ** 2)
+
+    assert not profiler.enabled
+    assert profiler.snapshot() == {}
+
+
+def test_profile_peak(profiler):
+    with profiler.profile("block"):
+        array = np.ones(1024 ** 2)  # 8 MB.
+        del array
+
+    peaks = profiler.snapshot()["block"]
+    assert peaks["calls"] == 1
+    assert 8 * 1024 ** 2 <= peaks["max"] < 9 * 1024 ** 2
+
+
+def test_profile_pillow_buffers(profiler):
+    with profiler.profile("block"):
+        image = Image.new("F", (2048, 2048), 1)  # 16 MB, allocated by Pillow.
+        del image
+
+    assert profiler.snapshot()["block"]["max"] >= 15 * 1024 ** 2  # Not traced by tracemalloc.
+
+
+def test_profile_pillow_shared_buffers(profiler):
+    array = np.ones((2048, 2048), dtype=np.uint8)
+    with profiler.profile("block"):
+        image = Image.fromarray(array)  # Shares the memory of `array`, which is already counted.
+        del image
+
+    assert profiler.snapshot()["block"]["max"] < 1024 ** 2
+
+
+def test_disable_restores_pillow():
+    new, frombuffer = Image.Image._new, Image.frombuffer
+    profiler = MemoryProfiler(enabled=True)
+    assert Image.Image._new is not new
+    profiler.disable()
+
+    assert Image.Image._new is new and Image.frombuffer is frombuffer
+
+
+def test_profile_nested(profiler):
+    with profiler.profile("outer"):
+        with profiler.profile("inner"):
+            array = np.ones(1024 ** 2)
+            del array
+        array = np.ones(512 ** 2)
+        del array
+
+    snapshot = profiler.snapshot()
+    assert snapshot["inner"]["max"] < 9 * 1024 ** 2
+    assert snapshot["outer"]["max"] >= snapshot["inner"]["max"]  # Seen by the outer block too.
+    assert snapshot["outer"]["max"] < 9 * 1024 ** 2
+
+
+def test_profile_counts_calls(profiler):
+    for size in (1024, 1024 ** 2):
+        with profiler.profile("block"):
+            np.ones(size)
+
+    peaks = profiler.snapshot()["block"]
+    assert peaks["calls"] == 2
+    assert peaks["last"] == peaks["max"]
+    assert peaks["mean"] < peaks["max"]
+    assert "memory block: calls=2" in profiler.to_text()
+
+    profiler.reset()
+    assert profiler.snapshot() == {}
+
+
+def test_disable_stops_tracing():
+    was_tracing = tracemalloc.is_tracing()
+    profiler = MemoryProfiler(enabled=True)
+    assert tracemalloc.is_tracing()
+    profiler.disable()
+    assert tracemalloc.is_tracing() == was_tracing
+
+
+def test_profiled():
+    @profiled("test_profiled")
+    def allocate(size):
+        return np.ones(size).size
+
+    memory_profiler.enable()
+    try:
+        assert allocate(1024) == 1024
+        assert memory_profiler.snapshot()["test_profiled"]["calls"] == 1
+    finally:
+        memory_profiler.disable()
+        memory_profiler.reset()
+    assert allocate.__name__ == "allocate"
+
+
+@pytest.mark.parametrize("value, enabled", [("1", True), ("0", False)])
+def test_environment_variable(value, enabled):
+    script = "from pyosirix_example.utilities.memory_profile import memory_profiler; " \
+             "print(memory_profiler.enabled)"
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    output = subprocess.run([sys.executable, "-c", script], cwd=root, capture_output=True,
+                            text=True, check=True, env={**os.environ, ENVIRONMENT_VARIABLE: value})
+    assert output.stdout.strip() == str(enabled)
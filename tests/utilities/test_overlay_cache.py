@@ -0,0 +1,68 @@
+""" Unit tests for the overlay_cache module. """
+
+from concurrent import futures
+
+from PIL import Image
+import pytest
+
+from pyosirix_example.utilities.overlay_cache import OverlayCache
+
+
+def test_image_bytes():
+    assert OverlayCache.image_bytes(Image.new("F", (10, 5))) == 200
+    assert OverlayCache.image_bytes(Image.new("RGB", (10, 5))) == 150
+
+
+def test_get_put_counters():
+    cache = OverlayCache()
+    assert cache.get("a") is None
+    cache.put("a", Image.new("L", (10, 10)))
+    assert cache.get("a") is not None
+
+    assert cache.stats() == {"hits": 1, "misses": 1, "evictions": 0, "entries": 1,
+                             "size_bytes": 100}
+
+
+def test_eviction_is_least_recently_used():
+    cache = OverlayCache(max_bytes=300)
+    for key in "abc":
+        cache.put(key, Image.new("L", (10, 10)))
+    cache.get("a")  # "b" is now the least recently used.
+    cache.put("d", Image.new("L", (10, 10)))
+
+    assert cache.get("b") is None
+    assert all(cache.get(key) is not None for key in "acd")
+    assert cache.evictions == 1
+    assert cache.size_bytes == 300
+
+
+def test_oversized_image_not_cached():
+    cache = OverlayCache(max_bytes=50)
+    cache.put("a", Image.new("L", (10, 10)))
+    assert len(cache) == 0
+
+
+def test_negative_budget():
+    with pytest.raises(ValueError, match="must not be negative"):
+        OverlayCache(max_bytes=-1)
+
+
+def test_zero_budget_disables():
+    cache = OverlayCache(max_bytes=0)
+    cache.put("a", Image.new("L", (1, 1)))
+    assert len(cache) == 0 and cache.get("a") is None
+
+
+def test_thread_safety():
+    cache = OverlayCache(max_bytes=1000)
+
+    def work(i):
+        cache.put(i % 20, Image.new("L", (10, 10)))
+        cache.get((i + 1) % 20)
+
+    with futures.ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(work, range(2000)))
+
+    assert cache.size_bytes <= 1000
+    assert cache.size_bytes == 100 * len(cache)
+    assert cache.hits + cache.misses == 2000
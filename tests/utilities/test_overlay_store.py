@@ -0,0 +1,131 @@
+""" Unit tests for the overlay_store module. """
+
+import os
+
+import numpy as np
+import pytest
+
+from pyosirix_example.server.metrics import Metrics
+from pyosirix_example.utilities.overlay_store import OverlayStore
+from pyosirix_example.utilities.text_2_image import Text2Image
+
+
+def raise_os_error(*args, **kwargs):
+    raise OSError(28, "No space left on device")
+
+
+def test_get_put(tmp_path):
+    store = OverlayStore(str(tmp_path))
+    array = np.arange(12, dtype="float32").reshape(3, 4)
+    assert store.get(("a", 1)) is None
+    store.put(("a", 1), array)
+
+    stored = store.get(("a", 1))
+    assert isinstance(stored, np.memmap)
+    assert not stored.flags.writeable
+    assert np.array_equal(stored, array)
+    assert store.stats()["hits"] == 1 and store.stats()["misses"] == 1
+    assert len(store) == 1
+
+
+def test_survives_new_instance(tmp_path):
+    OverlayStore(str(tmp_path)).put("a", np.ones((5, 5, 3), dtype=np.uint8))
+    stored = OverlayStore(str(tmp_path)).get("a")
+
+    assert stored is not None
+    assert stored.shape == (5, 5, 3)
+
+
+def test_key_is_content_hash(tmp_path):
+    store = OverlayStore(str(tmp_path))
+    assert store.path(("a", 1.0)) == OverlayStore(str(tmp_path)).path(("a", 1.0))
+    assert store.path(("a", 1.0)) != store.path(("a", 2.0))
+    assert os.path.dirname(store.path("a")) == str(tmp_path)
+
+
+def test_eviction_is_oldest_first(tmp_path):
+    array = np.zeros((10, 10), dtype=np.uint8)
+    store = OverlayStore(str(tmp_path))
+    store.put("a", array)
+    file_bytes = store.size_bytes
+    store.max_bytes = 3 * file_bytes
+    for index, key in enumerate("abc"):
+        store.put(key, array)
+        os.utime(store.path(key), ns=(index, index))  # Make the order of use explicit.
+    store.get("a")  # "b" is now the oldest.
+    store.put("d", array)
+
+    assert store.get("b") is None
+    assert all(store.get(key) is not None for key in "acd")
+    assert store.evictions == 1
+    assert store.size_bytes == 3 * file_bytes
+
+
+def test_eviction_scans_only_when_over_budget(tmp_path, monkeypatch):
+    array = np.zeros((10, 10), dtype=np.uint8)
+    store = OverlayStore(str(tmp_path))
+    store.put("a", array)
+    store.max_bytes = 3 * store.size_bytes
+    scans = []
+    files = store._files
+    monkeypatch.setattr(store, "_files", lambda: scans.append(1) or files())
+    for key in "abc":  # "a" is replaced rather than added.
+        store.put(key, array)
+    assert len(scans) == 0
+
+    store.put("d", array)
+    assert len(scans) == 1
+    assert store.evictions == 1 and len(store) == 3
+
+
+@pytest.mark.parametrize("fail", ["mkstemp", "save", "replace"])
+def test_write_errors_are_counted(tmp_path, monkeypatch, fail):
+    target = {"mkstemp": "tempfile.mkstemp", "save": "numpy.save", "replace": "os.replace"}[fail]
+    monkeypatch.setattr(target, raise_os_error)
+    metrics = Metrics()
+    store = OverlayStore(str(tmp_path), metrics=metrics)
+
+    assert not store.put("a", np.zeros((2, 2)))
+    assert store.get("a") is None
+    assert os.listdir(tmp_path) == []  # No temporary file is left behind.
+    assert store.stats()["errors"] == 1
+    assert metrics.snapshot()["counters"]["store_errors"] == 1
+
+
+def test_eviction_errors_are_counted(tmp_path, monkeypatch):
+    array = np.zeros((10, 10), dtype=np.uint8)
+    store = OverlayStore(str(tmp_path))
+    store.put("a", array)
+    store.max_bytes = store.size_bytes
+    monkeypatch.setattr("os.remove", raise_os_error)
+
+    assert store.put("b", array)
+    assert store.errors == 2 and store.evictions == 0  # Neither file could be deleted.
+    assert len(store) == 2
+
+
+def test_text_to_image_survives_write_errors(tmp_path, monkeypatch):
+    monkeypatch.setattr("os.replace", raise_os_error)
+    t2i = Text2Image(store=OverlayStore(str(tmp_path)))
+
+    assert t2i.text_to_image("Test").size == Text2Image().text_to_image("Test").size
+    assert t2i.store.errors == 1
+
+
+def test_oversized_array_not_stored(tmp_path):
+    store = OverlayStore(str(tmp_path), max_bytes=50)
+    store.put("a", np.zeros((10, 10), dtype=np.uint8))
+    assert store.get("a") is None
+
+
+def test_clear(tmp_path):
+    store = OverlayStore(str(tmp_path))
+    store.put("a", np.zeros((2, 2)))
+    store.clear()
+    assert len(store) == 0
+    assert store.size_bytes == 0
+
+
+def test_invalid_max_bytes(tmp_path):
+    with pytest.raises(ValueError, match="must not be negative"):
+        OverlayStore(str(tmp_path), max_bytes=-1)
@@ -0,0 +1,137 @@
+""" Unit tests for the pixel_codec module. """
+
+import tracemalloc
+import zlib
+
+import numpy as np
+import pytest
+
+from pyosirix_example.grpc_protocols import server_pb2
+from pyosirix_example.utilities.pixel_codec import BIG_ENDIAN, DELTA_DEFLATE, compact_array, \
+    decode_image, encode_array, uses_legacy_field
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float64", "int16", "uint16", "uint8"])
+def test_encode_decode_round_trip(dtype):
+    array = (np.arange(12 * 7) % 200).astype(dtype).reshape(12, 7)
+    message = server_pb2.Image(**encode_array(array))
+    message = server_pb2.Image.FromString(message.SerializeToString())
+
+    decoded = decode_image(message)
+    assert not uses_legacy_field(message)
+    assert decoded.dtype == np.dtype(dtype)
+    assert decoded.flags.writeable
+    assert np.array_equal(decoded, array)
+
+
+def test_encode_decode_rgb():
+    array = np.random.default_rng(0).integers(0, 255, (5, 4, 3), dtype=np.uint8)
+    message = server_pb2.Image(**encode_array(array))
+
+    assert (message.rows, message.columns) == (5, 4)
+    assert np.array_equal(decode_image(message), array)
+
+
+def test_decode_big_endian():
+    array = np.arange(6, dtype=">f4").reshape(2, 3)
+    message = server_pb2.Image(**encode_array(array))
+
+    assert message.byte_order == BIG_ENDIAN
+    decoded = decode_image(message)
+    assert decoded.dtype == np.dtype("float32")
+    assert np.array_equal(decoded, array)
+
+
+def test_decode_legacy_field():
+    array = np.arange(6, dtype="float32").reshape(2, 3)
+    message = server_pb2.Image(**encode_array(array, legacy=True))
+
+    assert uses_legacy_field(message)
+    assert np.array_equal(decode_image(message), array)
+
+
+def test_decode_size_mismatch():
+    message = server_pb2.Image(rows=2, columns=3, pixels=b"\x00" * 8, dtype="float32")
+    with pytest.raises(ValueError, match="Pixel buffer size"):
+        decode_image(message)
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float64", "int16", "uint16", "uint8", ">i2"])
+def test_delta_deflate_round_trip(dtype):
+    array = np.random.default_rng(0).integers(-100, 100, (12, 7)).astype(dtype)
+    message = server_pb2.Image(**encode_array(array, compress=True))
+    message = server_pb2.Image.FromString(message.SerializeToString())
+
+    decoded = decode_image(message)
+    assert message.encoding == DELTA_DEFLATE
+    assert decoded.dtype == np.dtype(dtype).newbyteorder("=")
+    assert decoded.flags.writeable
+    assert np.array_equal(decoded, array)
+
+
+def test_delta_deflate_compresses_background():
+    array = np.zeros((256, 256), dtype="float32")
+    array[100:120, 100:180] = 4095
+    message = server_pb2.Image(**encode_array(array, compress=True))
+
+    assert len(message.pixels) < array.nbytes // 50
+    assert np.array_equal(decode_image(message), array)
+
+
+def test_delta_deflate_size_mismatch():
+    fields = encode_array(np.zeros((2, 3), dtype="float32"), compress=True)
+    fields["shape"] = [3, 3]
+    with pytest.raises(ValueError, match="Pixel buffer size"):
+        decode_image(server_pb2.Image(**fields))
+
+
+def test_delta_deflate_bomb():
+    # 64 MB of zeros compresses to about 64 KB, but declares only 4 values.
+    message = server_pb2.Image(rows=2, columns=2, shape=[2, 2], dtype="float32",
+                               pixels=zlib.compress(bytes(64 * 1024 ** 2), 9),
+                               encoding=DELTA_DEFLATE)
+    tracemalloc.start()
+    try:
+        with pytest.raises(ValueError, match="Pixel buffer size"):
+            decode_image(message)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak < 1024 ** 2
+
+
+def test_delta_deflate_corrupt():
+    message = server_pb2.Image(rows=2, columns=2, dtype="float32", pixels=b"not zlib",
+                               encoding=DELTA_DEFLATE)
+    with pytest.raises(ValueError, match="cannot be decompressed"):
+        decode_image(message)
+
+
+def test_decode_negative_shape():
+    message = server_pb2.Image(shape=[-2, -2], dtype="uint8", pixels=b"\x00" * 4)
+    with pytest.raises(ValueError, match="Shape"):
+        decode_image(message)
+
+
+@pytest.mark.parametrize("dtype", ["foo", "object", "complex64", "bool", "<f4"])
+def test_decode_unsupported_dtype(dtype):
+    message = server_pb2.Image(shape=[2, 2], dtype=dtype, pixels=b"\x00" * 32)
+    with pytest.raises(ValueError, match="not supported"):
+        decode_image(message)
+
+
+@pytest.mark.parametrize("values, dtype", [([-1024, 3071], "int16"), ([0, 65535], "uint16"),
+                                           ([0, 70000], "float32"), ([0, 0.5], "float32"),
+                                           ([0, np.nan], "float32")])
+def test_compact_array(values, dtype):
+    array = np.array([values, values], dtype="float64")
+    compact = compact_array(array)
+
+    assert compact.dtype == dtype
+    assert np.array_equal(compact, array, equal_nan=True)
+
+
+def test_compact_array_leaves_others():
+    rgb = np.zeros((4, 4, 3), dtype="float64")
+    integers = np.zeros((4, 4), dtype="int32")
+    assert compact_array(rgb) is rgb and compact_array(integers) is integers
@@ -4,6 +4,9 @@ from PIL import Image, ImageDraw
 import numpy as np
 import pytest
 
+from pyosirix_example.utilities.font_registry import font_registry
+from pyosirix_example.utilities.overlay_cache import OverlayCache
+from pyosirix_example.utilities.overlay_store import OverlayStore
 from pyosirix_example.utilities.text_2_image import Text2Image
 
 
@@ -82,3 +85,253 @@ def test_text_to_image(text2image_instance):
 
     assert isinstance(img, Image.Image)
     assert img.size[0] > 0 and img.size[1] > 0  # Ensure the image is not empty
+
+
+def test_text_to_image_cached():
+    t2i = Text2Image(cache=OverlayCache())
+    img_1 = t2i.text_to_image("Test text", font_size=20)
+    img_2 = t2i.text_to_image("Test text", font_size=20)
+    img_3 = t2i.text_to_image("Test text", font_size=21)
+
+    assert img_1 is not img_2
+    assert np.array_equal(np.array(img_1), np.array(img_2))
+    assert img_3.size != img_1.size
+    assert t2i.cache.hits == 1 and t2i.cache.misses == 2
+
+
+def test_text_to_image_shared_cache():
+    cache = OverlayCache()
+    kwargs = dict(text="AVAWAy", mode="RGB", color=(200, 100, 50))
+    images = [Text2Image(cache=cache, measure_text=True, **options).text_to_image(**kwargs)
+              for options in ({}, {"glyph_atlas": True}, {"direct_size": True})]
+
+    # Each renderer gets its own render rather than another's from the shared cache.
+    assert cache.misses == 3 and cache.hits == 0 and len(cache) == 3
+    assert np.array_equal(np.array(images[1]), np.array(
+        Text2Image(measure_text=True, glyph_atlas=True).text_to_image(**kwargs)))
+    assert np.array_equal(np.array(images[0]), np.array(
+        Text2Image(measure_text=True).text_to_image(**kwargs)))
+
+
+@pytest.mark.parametrize("mode", ["F", "RGB", "RGBA"])
+def test_text_to_image_stored(tmp_path, mode):
+    img_1 = Text2Image(store=OverlayStore(str(tmp_path))).text_to_image("Test", mode=mode)
+    t2i = Text2Image(cache=OverlayCache(), store=OverlayStore(str(tmp_path)))  # As if restarted.
+    img_2 = t2i.text_to_image("Test", mode=mode)
+
+    assert img_2.mode == img_1.mode
+    assert np.array_equal(np.array(img_1), np.array(img_2))
+    assert t2i.store.hits == 1 and t2i.store.misses == 0
+    assert t2i.cache.misses == 1
+
+
+@pytest.mark.parametrize("mode", ["F", "RGB", "RGBA"])
+@pytest.mark.parametrize("align", ["left", "center", "right"])
+def test_text_to_image_measured_canvas(mode, align):
+    text = "Test text\nwith two lines"
+    fixed = Text2Image(max_shape=(1000, 1000)).text_to_image(text, mode=mode, align=align,
+                                                             color=(10, 20, 30), value=7)
+    measured = Text2Image(measure_text=True).text_to_image(text, mode=mode, align=align,
+                                                           color=(10, 20, 30), value=7)
+
+    assert measured.size == fixed.size
+    assert np.array_equal(np.array(measured), np.array(fixed))
+
+
+def test_measure_text_shape_clipped():
+    t2i = Text2Image(max_shape=(50, 10), measure_text=True)
+    shape = t2i.measure_text_shape("A long line of text", font_registry.get(None, 40), "left")
+    assert shape == (50, 10)
+
+
+@pytest.mark.parametrize("shape", [(120, 160), (120, 160, 3), (120, 160, 4)])
+@pytest.mark.parametrize("location", [1, 2, 3, 4, 5, 6])
+@pytest.mark.parametrize("remove_background", [False, True])
+def test_paste_text_in_array_numpy_matches_pil(shape, location, remove_background):
+    rng = np.random.default_rng(location)
+    if len(shape) == 2:
+        array = rng.uniform(0, 100, shape).astype("float32")
+        kwargs = {"value": 50.0, "bg_value": 0.0}
+    else:
+        array = rng.integers(0, 255, shape, dtype=np.uint8)
+        kwargs = {"color": (255, 0, 0), "bg_color": (0, 0, 0)}
+    t2i = Text2Image(measure_text=True)
+    pil = t2i.paste_text_in_array("Test\ntext", array, location=location, scale=0.3,
+                                  remove_background=remove_background, **kwargs)
+    fast = t2i.paste_text_in_array("Test\ntext", array, location=location, scale=0.3,
+                                   remove_background=remove_background, engine="numpy", **kwargs)
+
+    assert fast.dtype == pil.dtype
+    assert np.array_equal(fast, pil)
+
+
+def test_paste_text_in_array_numpy_in_place(text2image_instance):
+    array = np.zeros((100, 100), dtype="float32")
+    result = text2image_instance.paste_text_in_array("Test", array, engine="numpy", in_place=True)
+    assert result is array
+    assert array.max() > 0
+
+    array = np.zeros((100, 100), dtype="float64")  # Not float32, so a copy is made.
+    result = text2image_instance.paste_text_in_array("Test", array, engine="numpy", in_place=True)
+    assert result is not array
+    assert array.max() == 0
+
+
+@pytest.mark.parametrize("dtype", ["int16", "uint16"])
+@pytest.mark.parametrize("engine", ["pil", "numpy"])
+def test_paste_text_in_array_integer(dtype, engine):
+    array = np.random.default_rng(0).integers(0, 1000, (120, 160)).astype(dtype)
+    t2i = Text2Image(measure_text=True)
+    result = t2i.paste_text_in_array("Test", array, location=3, scale=0.5, value=4095,
+                                     engine=engine)
+    expected = t2i.paste_text_in_array("Test", array.astype("float32"), location=3, scale=0.5,
+                                       value=4095, engine=engine)
+
+    assert result.dtype == np.dtype(dtype)
+    assert result.nbytes == array.nbytes
+    info = np.iinfo(dtype)  # Resampling can overshoot the range, so values are clipped.
+    assert np.array_equal(result, np.clip(np.rint(expected), info.min, info.max).astype(dtype))
+
+
+@pytest.mark.parametrize("dtype, value, expected", [("int16", 10 ** 7, 32767),
+                                                     ("uint16", 10 ** 7, 65535),
+                                                     ("uint16", -10 ** 7, 0)])
+def test_paste_text_in_array_integer_clipped(dtype, value, expected):
+    array = np.full((100, 100), 7, dtype=dtype)
+    t2i = Text2Image(measure_text=True)
+    pil = t2i.paste_text_in_array("Test", array, value=value, bg_value=7)
+    fast = t2i.paste_text_in_array("Test", array, value=value, bg_value=7, engine="numpy",
+                                   in_place=True)
+
+    assert fast is array
+    assert np.array_equal(fast, pil)
+    assert set(np.unique(fast)) >= {7, expected}
+    assert fast.min() >= np.iinfo(dtype).min and fast.max() <= np.iinfo(dtype).max
+
+
+def test_paste_text_in_array_numpy_clipped(text2image_instance):
+    array = np.zeros((100, 100), dtype="float32")
+    pil = text2image_instance.paste_text_in_array("Test", array, location=1, scale=1.0, offset=0.5)
+    fast = text2image_instance.paste_text_in_array("Test", array, location=1, scale=1.0,
+                                                   offset=0.5, engine="numpy")
+    assert np.array_equal(fast, pil)
+
+
+def test_paste_text_in_array_bad_shape(text2image_instance):
+    with pytest.raises(ValueError, match="Last dimension of array must be 3 or 4."):
+        text2image_instance.paste_text_in_array("Test", np.zeros((10, 10, 2)))
+    with pytest.raises(ValueError, match="Engine must be pil or numpy."):
+        text2image_instance.paste_text_in_array("Test", np.zeros((10, 10)), engine="cuda")
+
+
+@pytest.mark.parametrize("shape", [(5, 80, 100), (5, 80, 100, 3), (5, 80, 100, 4)])
+@pytest.mark.parametrize("remove_background", [False, True])
+def test_paste_text_in_volume_matches_slices(shape, remove_background):
+    text2image_instance = Text2Image(measure_text=True)
+    rng = np.random.default_rng(0)
+    if len(shape) == 3:
+        volume = rng.uniform(0, 100, shape).astype("float32")
+    else:
+        volume = rng.integers(0, 255, shape, dtype=np.uint8)
+    result = text2image_instance.paste_text_in_volume("Test", volume, location=4, scale=0.5,
+                                                      remove_background=remove_background)
+
+    assert result.shape == volume.shape
+    for pasted, array in zip(result, volume):
+        expected = text2image_instance.paste_text_in_array("Test", array, location=4, scale=0.5,
+                                                           remove_background=remove_background)
+        assert np.array_equal(pasted, expected)
+
+
+def test_paste_text_in_volume_in_place(text2image_instance):
+    volume = np.zeros((3, 50, 50), dtype="float32")
+    result = text2image_instance.paste_text_in_volume("Test", volume, in_place=True)
+
+    assert result is volume
+    assert all(array.max() > 0 for array in volume)
+
+
+def test_paste_text_in_volume_sequence():
+    t2i = Text2Image(cache=OverlayCache())
+    arrays = [np.zeros((50, 50)), np.zeros((60, 40)), np.zeros((50, 50))]
+    result = t2i.paste_text_in_volume("Test", arrays)
+
+    assert [array.shape for array in result] == [(50, 50), (60, 40), (50, 50)]
+    assert np.array_equal(result[0], result[2])
+    assert t2i.cache.misses + t2i.cache.hits == 2  # Rendered once per unique geometry.
+
+
+def test_paste_text_in_volume_bad_shape(text2image_instance):
+    with pytest.raises(ValueError, match="Volume must be 4 or 3 dimensional."):
+        text2image_instance.paste_text_in_volume("Test", np.zeros((10, 10)))
+
+
+@pytest.mark.parametrize("location", [1, 3, 5])
+@pytest.mark.parametrize("remove_background", [False, True])
+def test_paste_text_in_patch_matches_array(location, remove_background):
+    t2i = Text2Image(measure_text=True)
+    array = np.random.default_rng(0).uniform(0, 100, (90, 120)).astype("float32")
+    expected = t2i.paste_text_in_array("Test", array, location=location, scale=0.4,
+                                       remove_background=remove_background)
+
+    left, top, columns, rows = t2i.text_region("Test", array.shape, location=location, scale=0.4)
+    assert columns > 0 and rows > 0
+    patch = array[top:top + rows, left:left + columns]
+    pasted = t2i.paste_text_in_patch("Test", patch, array.shape, (top, left), location=location,
+                                     scale=0.4, remove_background=remove_background)
+
+    result = array.copy()
+    result[top:top + rows, left:left + columns] = pasted
+    assert np.array_equal(result, expected)
+
+
+def test_text_region_clipped():
+    t2i = Text2Image(measure_text=True)
+    left, top, columns, rows = t2i.text_region("Test", (100, 100), location=1, scale=1.0,
+                                               offset=0.5)
+    assert left == 0 and left + columns <= 100
+
+
+@pytest.mark.parametrize("mode, shape", [("F", (200, 300)), ("RGB", (200, 300, 3))])
+def test_direct_size(mode, shape):
+    array = np.zeros(shape, dtype="float32" if mode == "F" else "uint8")
+    t2i = Text2Image(measure_text=True, direct_size=True)
+    result = t2i.paste_text_in_array("Test", array, engine="numpy", location=3, scale=0.5,
+                                     value=10, color=(255, 0, 0))
+    left, top, columns, rows = t2i.text_region("Test", (200, 300), location=3, scale=0.5)
+
+    assert (left, top) == (15, 10)
+    assert 140 <= columns <= 150  # Rendered no wider than requested.
+    touched = np.argwhere(result.reshape(200, 300, -1).max(axis=-1) > 0)
+    assert touched.min(axis=0).tolist() >= [top, left]
+    assert touched.max(axis=0).tolist() < [top + rows, left + columns]
+
+
+def test_direct_size_engines_agree():
+    array = np.random.default_rng(0).uniform(0, 100, (120, 160)).astype("float32")
+    t2i = Text2Image(measure_text=True, direct_size=True)
+    kwargs = dict(location=6, scale=0.4, remove_background=True, value=500)
+
+    assert np.array_equal(t2i.paste_text_in_array("Test", array, engine="pil", **kwargs),
+                          t2i.paste_text_in_array("Test", array, engine="numpy", **kwargs))
+
+
+@pytest.mark.parametrize("mode", ["F", "RGB", "RGBA"])
+@pytest.mark.parametrize("align", ["left", "center", "right"])
+def test_text_to_image_glyph_atlas(mode, align):
+    text = "Slice 42\nwith two lines"
+    kwargs = dict(mode=mode, align=align, color=(200, 20, 30), bg_color=(0, 0, 40), value=7,
+                  pad=(1, 2, 3, 4))
+    drawn = Text2Image().text_to_image(text, **kwargs)
+    composed = Text2Image(glyph_atlas=True).text_to_image(text, **kwargs)
+
+    assert composed.mode == drawn.mode and composed.size == drawn.size
+    assert np.array_equal(np.array(composed), np.array(drawn))
+
+
+def test_paste_text_in_array_glyph_atlas():
+    array = np.random.default_rng(0).uniform(0, 100, (120, 160)).astype("float32")
+    kwargs = dict(location=2, scale=0.5, value=500, engine="numpy")
+
+    assert np.array_equal(Text2Image(glyph_atlas=True).paste_text_in_array("12", array, **kwargs),
+                          Text2Image().paste_text_in_array("12", array, **kwargs))